@@ -1,37 +1,126 @@
 from typing import Dict, List, Tuple, Iterable, Union, Optional
-from rank_bm25 import BM25Okapi
-import re
-import nltk
-from nltk.corpus import stopwords
+from collections import Counter
+import heapq
+import math
+import os
+import numpy as np
+import orjson
+from scipy import sparse
+from Tokenizer import Tokenizer, default_tokenizer
+
+# On-disk layout written by BM25NeedsIndex.save(); bump when it changes
+INDEX_FORMAT_VERSION = 1
+
+class _MappedPostings:
+    """
+    Read-only, array-backed postings as written by BM25NeedsIndex.save().
+    Term t's postings are docs[offsets[t]:offsets[t+1]] (sorted need positions)
+    with matching tfs; arrays may be np.memmap so processes share the page cache.
+    """
+    def __init__(self, ids, vocab, offsets, docs, tfs, doc_len, idf):
+        self.ids: List[str] = ids
+        self.vocab: Dict[str, int] = vocab
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.idf = idf
+        self.norm = None
+
+    def _norm(self, k1: float, b: float):
+        # per-need k1 * (1 - b + b * dl / avgdl), same operation order as the dict path
+        if self.norm is None:
+            avgdl = int(self.doc_len.sum()) / len(self.ids)
+            self.norm = k1 * (1 - b + b * np.asarray(self.doc_len, dtype=np.float64) / avgdl)
+        return self.norm
+
+    def accumulate(self, qtok, k1: float, b: float) -> Dict[str, float]:
+        norm = self._norm(k1, b)
+        acc = np.zeros(len(self.ids), dtype=np.float64)
+        touched = np.zeros(len(self.ids), dtype=bool)
+        for q in qtok:
+            r = self.vocab.get(q)
+            if r is None:
+                continue
+            lo, hi = self.offsets[r], self.offsets[r + 1]
+            d = self.docs[lo:hi]
+            tf = np.asarray(self.tfs[lo:hi], dtype=np.float64)
+            acc[d] += self.idf[r] * (tf * (k1 + 1) / (tf + norm[d]))
+            touched[d] = True
+        hit = np.flatnonzero(touched)
+        return dict(zip([self.ids[i] for i in hit], acc[hit].tolist()))
+
+    def score_docs(self, qtok, positions, k1: float, b: float) -> Dict[str, float]:
+        norm = self._norm(k1, b)
+        acc: Dict[str, float] = {}
+        for pos in positions:
+            score = 0.0
+            for q in qtok:
+                r = self.vocab.get(q)
+                if r is None:
+                    continue
+                lo, hi = self.offsets[r], self.offsets[r + 1]
+                j = lo + int(np.searchsorted(self.docs[lo:hi], pos))
+                if j < hi and self.docs[j] == pos:
+                    tf = float(self.tfs[j])
+                    score += float(self.idf[r]) * (tf * (k1 + 1) / (tf + float(norm[pos])))
+            acc[self.ids[pos]] = score
+        return acc
+
+    def weights(self, k1: float, b: float):
+        norm = self._norm(k1, b)
+        rows = np.repeat(np.arange(len(self.vocab)), np.diff(self.offsets))
+        tf = np.asarray(self.tfs, dtype=np.float64)
+        data = self.idf[rows] * (tf * (k1 + 1) / (tf + norm[self.docs]))
+        return sparse.csr_matrix((data, np.asarray(self.docs), np.asarray(self.offsets)),
+                                 shape=(len(self.vocab), len(self.ids)))
 
 class BM25NeedsIndex:
-    def __init__(self, needs: Optional[Dict[str, str]] = None):
+    def __init__(self, needs: Optional[Dict[str, str]] = None, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25,
+                 tokenizer: Optional[Tokenizer] = None):
         """
         needs: optional initial mapping {need_id: need_text}
+        k1, b, epsilon: BM25Okapi parameters (same defaults as rank_bm25)
+        tokenizer: optional Tokenizer (e.g. Tokenizer(stem=True)); defaults to the shared one
         """
-        self._tokenize = lambda s: re.findall(r"\w+", s.lower())
-        self.needs: Dict[str, str] = dict(needs) if needs else {}
-        self._ids: List[str] = []
-        self._docs_tok: List[List[str]] = []
-        self._bm25: Optional[BM25Okapi] = None
-        nltk.download("stopwords", quiet=True)
-        self.stopwords= set(stopwords.words("english"))
-        self._rebuild()
-
-    def _preprocess(self, text: str) -> str:
-        text = text.lower()
-        text = re.sub(r"[^a-z0-9\s]", " ", text)
-        text = self._tokenize(text)
-        tokens = [t for t in text if t and t not in self.stopwords]
-        return tokens
+        self.tokenizer = tokenizer if tokenizer is not None else default_tokenizer()
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.needs: Dict[str, str] = {}
+        # Inverted index: term -> {need_id: term frequency}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        # Forward index (needed to undo a document on update/remove)
+        self._doc_tf: Dict[str, Dict[str, int]] = {}
+        self._doc_len: Dict[str, int] = {}
+        self._total_len = 0
+        # IDF table is derived from document frequencies; refreshed lazily on search
+        self._idf: Dict[str, float] = {}
+        self._idf_dirty = False
+        # (terms x needs) CSR of BM25 term weights for search_many; rebuilt lazily after mutations
+        self._matrix = None
+        # search_many's matrix in (term row, need slot, tf) triplets, appended to as needs are
+        # indexed so a rebuild only recomputes the weights; a removed need's slot goes dead
+        self._triplets = None   # (rows, slots, tfs) lists; None until search_many first needs them
+        self._term_row: Dict[str, int] = {}
+        self._slot: Dict[str, int] = {}
+        self._slot_ids: List[str] = []
+        self._slot_len: List[int] = []
+        self._dead_slots = 0
+        # Set by load(): array-backed postings used until the first mutation
+        self._mapped: Optional[_MappedPostings] = None
+        self.stopwords = self.tokenizer.stopwords
+        if needs:
+            self.add_needs(needs)
+
+    def _preprocess(self, text: str) -> List[str]:
+        return list(self.tokenizer(text))
 
     # ---------- public API ----------
     def add_need(self, need_id: str, need_text: str, overwrite: bool = False) -> None:
         if (need_id in self.needs) and not overwrite:
             raise ValueError(f"need_id '{need_id}' already exists. Set overwrite=True to replace.")
-        self.needs[need_id] = need_text
-        # Incremental add (rebuild keeps things simple & correct for small/med corpora)
-        self._rebuild()
+        self._index(need_id, need_text)
 
     def add_needs(self, items: Union[Dict[str, str], Iterable[Tuple[str, str]]], overwrite: bool = False) -> None:
         if isinstance(items, dict):
@@ -39,37 +128,291 @@ class BM25NeedsIndex:
         for nid, txt in items:
             if (nid in self.needs) and not overwrite:
                 raise ValueError(f"need_id '{nid}' already exists. Set overwrite=True to replace.")
-            self.needs[nid] = txt
-        self._rebuild()
+            self._index(nid, txt)
 
     def update_need(self, need_id: str, new_text: str) -> None:
         if need_id not in self.needs:
             raise KeyError(f"need_id '{need_id}' not found.")
-        self.needs[need_id] = new_text
-        self._rebuild()
+        self._index(need_id, new_text)
 
     def remove_need(self, need_id: str) -> None:
         if need_id in self.needs:
+            self._unindex(need_id)
             del self.needs[need_id]
-            self._rebuild()
+
+    def get_scores(self, qtok: List[str]) -> List[float]:
+        """BM25Okapi scores of a tokenized query against every need, aligned with self.needs order."""
+        acc = self._accumulate(qtok)
+        return [acc.get(nid, 0.0) for nid in self.needs]
 
     def search(self, query: str, top_k: int = 5) -> List[Dict[str, Union[str, float]]]:
         """Return top_k needs most similar to query as [{id, need, score}, ...]."""
-        if not self._bm25 or not self._ids:
+        if not self.needs or self._total_len == 0 or top_k <= 0:
             return []
-        qtok = self._preprocess(query)
-        scores = self._bm25.get_scores(qtok)
-        # stable sort by (-score, id) for deterministic ties
-        ranked = sorted(range(len(scores)), key=lambda i: (-scores[i], self._ids[i]))
+        acc = self._accumulate(self.tokenizer(query))
+        # bounded heap over (-score, id) keeps ties deterministic without sorting every candidate
+        ranked = heapq.nsmallest(top_k, ((-score, nid) for nid, score in acc.items() if score > 0))
+        return [{"id": nid, "description": self.needs[nid], "score": -neg} for neg, nid in ranked]
+
+    def search_many(self, queries: List[str], top_k: int = 5) -> List[List[Dict[str, Union[str, float]]]]:
+        """
+        Batched search(): all queries are tokenized into one sparse (queries x terms) count
+        matrix and scored with a single product against the cached term-weight matrix.
+        The product only shortlists candidates; the shortlist is rescored exactly, so each
+        ranked list is identical to what search() returns for that query.
+        """
+        if not self.needs or self._total_len == 0 or top_k <= 0:
+            return [[] for _ in queries]
+        _, vocab, weights = self._weight_matrix()
+        qtoks = [self.tokenizer(query) for query in queries]
+        rows, cols = [], []
+        for qi, qtok in enumerate(qtoks):
+            for term in qtok:
+                col = vocab.get(term)
+                if col is not None:
+                    rows.append(qi)
+                    cols.append(col)
+        # repeated query terms are summed, matching BM25Okapi's per-token loop
+        qmat = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(queries), len(vocab)))
+        scores = (qmat @ weights).tocsr()
+
         out = []
-        for i in ranked[:top_k]:
-            nid = self._ids[i]
-            if float(scores[i]) > 0:
-                out.append({"id": nid, "description": self.needs[nid], "score": float(scores[i])})
+        for qi, qtok in enumerate(qtoks):
+            lo, hi = scores.indptr[qi], scores.indptr[qi + 1]
+            docs, vals = scores.indices[lo:hi], scores.data[lo:hi]
+            if len(vals) > top_k:
+                # shortlist with a small tolerance so near-ties that differ only by summation order survive
+                kth = np.partition(vals, len(vals) - top_k)[len(vals) - top_k]
+                docs = docs[vals >= kth - 1e-9 * abs(kth)]
+            # exact rescoring of the shortlist keeps scores and tie-breaks identical to search()
+            shortlist = [(-score, nid) for nid, score in self._score_docs(qtok, docs.tolist()).items()
+                         if score > 0]
+            ranked = heapq.nsmallest(top_k, shortlist)
+            out.append([{"id": nid, "description": self.needs[nid], "score": -neg} for neg, nid in ranked])
         return out
 
+    def save(self, path: str) -> None:
+        """
+        Write the index to directory `path`: meta.json (params, ids, texts, vocabulary)
+        plus .npy arrays for posting offsets, need positions, term frequencies,
+        document lengths and IDF.
+        """
+        os.makedirs(path, exist_ok=True)
+        if self._mapped is not None:
+            m = self._mapped
+            ids, vocab = m.ids, list(m.vocab)
+            offsets, docs, tfs, doc_len, idf = m.offsets, m.docs, m.tfs, m.doc_len, m.idf
+        else:
+            self._refresh_idf()
+            ids = list(self.needs)
+            pos_of = {nid: i for i, nid in enumerate(ids)}
+            vocab = list(self._postings)
+            offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+            docs, tfs = [], []
+            for t, term in enumerate(vocab):
+                for pos, tf in sorted((pos_of[nid], tf) for nid, tf in self._postings[term].items()):
+                    docs.append(pos)
+                    tfs.append(tf)
+                offsets[t + 1] = len(docs)
+            docs = np.asarray(docs, dtype=np.int32)
+            tfs = np.asarray(tfs, dtype=np.int32)
+            doc_len = np.asarray([self._doc_len[nid] for nid in ids], dtype=np.int32)
+            idf = np.asarray([self._idf[term] for term in vocab], dtype=np.float64)
+        for name, arr in (("offsets", offsets), ("docs", docs), ("tfs", tfs), ("doc_len", doc_len), ("idf", idf)):
+            # write beside and swap in: `path` may be where this index's mapped arrays live,
+            # and the mapping keeps reading the old file until it is released
+            target = os.path.join(path, f"{name}.npy")
+            with open(target + ".tmp", "wb") as f:
+                np.save(f, np.asarray(arr))
+            os.replace(target + ".tmp", target)
+        meta = {
+            "version": INDEX_FORMAT_VERSION,
+            "k1": self.k1, "b": self.b, "epsilon": self.epsilon,
+            "stem": self.tokenizer.stem,
+            "ids": ids,
+            "texts": [self.needs[nid] for nid in ids],
+            "vocab": vocab,
+        }
+        # meta.json last, so a half-written index fails to load instead of loading wrong
+        with open(os.path.join(path, "meta.json"), "wb") as f:
+            f.write(orjson.dumps(meta))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, tokenizer: Optional[Tokenizer] = None) -> "BM25NeedsIndex":
+        """
+        Load an index written by save(). With mmap=True the postings stay memory-mapped
+        and read-only, so several processes can search one index without copying it;
+        the first add/update/remove converts it back to the in-memory dict index.
+        """
+        with open(os.path.join(path, "meta.json"), "rb") as f:
+            meta = orjson.loads(f.read())
+        if meta.get("version") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported BM25 index version {meta.get('version')} (expected {INDEX_FORMAT_VERSION}).")
+        if tokenizer is None and meta["stem"]:
+            tokenizer = Tokenizer(stem=True)
+        index = cls(k1=meta["k1"], b=meta["b"], epsilon=meta["epsilon"], tokenizer=tokenizer)
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in ("offsets", "docs", "tfs", "doc_len", "idf")
+        }
+        ids = meta["ids"]
+        index.needs = dict(zip(ids, meta["texts"]))
+        index._total_len = int(arrays["doc_len"].sum())
+        index._mapped = _MappedPostings(ids, {term: i for i, term in enumerate(meta["vocab"])}, **arrays)
+        return index
+
     # ---------- internals ----------
-    def _rebuild(self) -> None:
-        self._ids = list(self.needs.keys())
-        self._docs_tok = [self._preprocess(self.needs[nid]) for nid in self._ids]
-        self._bm25 = BM25Okapi(self._docs_tok) if self._docs_tok else None
+    def _thaw(self) -> None:
+        """Materialize mapped postings into the mutable dict index."""
+        m, self._mapped = self._mapped, None
+        for term, r in m.vocab.items():
+            lo, hi = int(m.offsets[r]), int(m.offsets[r + 1])
+            posting = {m.ids[pos]: tf for pos, tf in zip(m.docs[lo:hi].tolist(), m.tfs[lo:hi].tolist())}
+            self._postings[term] = posting
+            for nid, tf in posting.items():
+                self._doc_tf.setdefault(nid, {})[term] = tf
+        for nid, dl in zip(m.ids, m.doc_len.tolist()):
+            self._doc_tf.setdefault(nid, {})
+            self._doc_len[nid] = dl
+        self._idf_dirty = True
+        self._matrix = None
+        self._triplets = None
+
+    def _index(self, nid: str, text: str) -> None:
+        """Add (or replace) one need in O(len(text))."""
+        if self._mapped is not None:
+            self._thaw()
+        if nid in self.needs:
+            self._unindex(nid)
+        tf = Counter(self.tokenizer(text))
+        self.needs[nid] = text
+        self._doc_tf[nid] = tf
+        self._doc_len[nid] = sum(tf.values())
+        self._total_len += self._doc_len[nid]
+        for term, freq in tf.items():
+            self._postings.setdefault(term, {})[nid] = freq
+        if self._triplets is not None:
+            self._add_slot(nid, tf)
+        self._idf_dirty = True
+        self._matrix = None
+
+    def _accumulate(self, qtok: List[str]) -> Dict[str, float]:
+        """
+        Term-at-a-time scoring: only needs that appear in a query term's posting list
+        are visited. Every other need scores exactly 0 under BM25Okapi (tf=0).
+        """
+        if not self.needs or self._total_len == 0:
+            return {}
+        if self._mapped is not None:
+            return self._mapped.accumulate(qtok, self.k1, self.b)
+        self._refresh_idf()
+        k1, b = self.k1, self.b
+        avgdl = self._total_len / len(self.needs)
+        doc_len = self._doc_len
+        acc: Dict[str, float] = {}
+        for q in qtok:
+            idf = self._idf.get(q)
+            if idf is None:
+                continue
+            for nid, tf in self._postings[q].items():
+                acc[nid] = acc.get(nid, 0.0) + idf * (tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_len[nid] / avgdl)))
+        return acc
+
+    def _score_docs(self, qtok: List[str], positions: List[int]) -> Dict[str, float]:
+        """Same arithmetic as _accumulate, restricted to the needs at the given positions in self.needs."""
+        if self._mapped is not None:
+            return self._mapped.score_docs(qtok, positions, self.k1, self.b)
+        ids = self._weight_matrix()[0]
+        nids = [ids[pos] for pos in positions]
+        self._refresh_idf()
+        k1, b = self.k1, self.b
+        avgdl = self._total_len / len(self.needs)
+        acc: Dict[str, float] = {}
+        for nid in nids:
+            tfs, norm = self._doc_tf[nid], k1 * (1 - b + b * self._doc_len[nid] / avgdl)
+            score = 0.0
+            for q in qtok:
+                tf = tfs.get(q, 0)
+                if tf:
+                    score += self._idf[q] * (tf * (k1 + 1) / (tf + norm))
+            acc[nid] = score
+        return acc
+
+    def _unindex(self, nid: str) -> None:
+        if self._mapped is not None:
+            self._thaw()
+        for term in self._doc_tf.pop(nid):
+            posting = self._postings[term]
+            del posting[nid]
+            if not posting:
+                del self._postings[term]
+        self._total_len -= self._doc_len.pop(nid)
+        if self._triplets is not None:
+            del self._slot[nid]
+            self._dead_slots += 1
+        self._idf_dirty = True
+        self._matrix = None
+
+    def _reset_slots(self) -> None:
+        """Rebuild the search_many triplets from the dict index, one slot per need."""
+        self._triplets = ([], [], [])
+        self._term_row, self._slot, self._slot_ids, self._slot_len = {}, {}, [], []
+        self._dead_slots = 0
+        for nid in self.needs:
+            self._add_slot(nid, self._doc_tf[nid])
+
+    def _add_slot(self, nid: str, tf: Dict[str, int]) -> None:
+        rows, slots, tfs = self._triplets
+        slot = self._slot[nid] = len(self._slot_ids)
+        self._slot_ids.append(nid)
+        self._slot_len.append(self._doc_len[nid])
+        for term, freq in tf.items():
+            rows.append(self._term_row.setdefault(term, len(self._term_row)))
+            slots.append(slot)
+            tfs.append(freq)
+
+    def _refresh_idf(self) -> None:
+        """Recompute IDF from posting-list lengths, mirroring BM25Okapi._calc_idf."""
+        if not self._idf_dirty:
+            return
+        n_docs = len(self.needs)
+        idf = {}
+        idf_sum = 0.0
+        negative = []
+        for term, posting in self._postings.items():
+            value = math.log(n_docs - len(posting) + 0.5) - math.log(len(posting) + 0.5)
+            idf[term] = value
+            idf_sum += value
+            if value < 0:
+                negative.append(term)
+        if idf:
+            eps = self.epsilon * (idf_sum / len(idf))
+            for term in negative:
+                idf[term] = eps
+        self._idf = idf
+        self._idf_dirty = False
+
+    def _weight_matrix(self):
+        """Return (ids, vocab, weights) where weights[t, d] is need d's BM25 contribution for term t."""
+        if self._matrix is None and self._mapped is not None:
+            m = self._mapped
+            self._matrix = (m.ids, m.vocab, m.weights(self.k1, self.b))
+        if self._matrix is None:
+            self._refresh_idf()
+            if self._triplets is None or self._dead_slots > len(self.needs):
+                self._reset_slots()
+            k1, b = self.k1, self.b
+            rows, slots, tfs = (np.asarray(x) for x in self._triplets)
+            live = np.zeros(len(self._slot_ids), dtype=bool)
+            live[list(self._slot.values())] = True
+            keep = live[slots]
+            rows, slots = rows[keep].astype(np.int64), slots[keep].astype(np.int64)
+            tf = tfs[keep].astype(np.float64)
+            doc_len = np.asarray(self._slot_len, dtype=np.float64)
+            norm = k1 * (1 - b + b * doc_len / (self._total_len / len(self.needs)))
+            idf = np.asarray([self._idf.get(term, 0.0) for term in self._term_row], dtype=np.float64)
+            data = idf[rows] * (tf * (k1 + 1) / (tf + norm[slots]))
+            weights = sparse.csr_matrix((data, (rows, slots)), shape=(len(self._term_row), len(self._slot_ids)))
+            # columns are slots; a dead slot has no entries, so it never reaches a result
+            self._matrix = (self._slot_ids, self._term_row, weights)
+        return self._matrix
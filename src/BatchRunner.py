@@ -0,0 +1,191 @@
+from typing import Callable, List, Optional, Sequence, Tuple
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import orjson
+from openai.lib._pydantic import to_strict_json_schema
+from ResponseCache import CACHE_MISS, ResponseCache, get_response_cache
+from Telemetry import get_telemetry
+
+# OpenAI accepts at most this many requests per batch input file
+MAX_BATCH_REQUESTS = 50_000
+BATCH_ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATES = ("completed", "failed", "expired", "cancelled")
+
+def request_line(custom_id: str, prompt, model: str, resp_format=None) -> dict:
+    """One line of a batch input file: the chat.completions body call_gpt would have sent."""
+    if resp_format is None:
+        response_format = {"type": "text"}
+    else:
+        response_format = {"type": "json_schema", "json_schema": {
+            "name": resp_format.__name__, "schema": to_strict_json_schema(resp_format), "strict": True}}
+    return {"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": {
+        "model": model, "messages": [{"role": "user", "content": prompt}], "response_format": response_format}}
+
+def parse_result(line: dict, resp_format=None):
+    """Output of one batch result line, like call_gpt's: str or resp_format instance; None on error."""
+    response = line.get("response") or {}
+    if line.get("error") or response.get("status_code") != 200:
+        print(f"batch request {line.get('custom_id')} failed: {line.get('error') or response.get('body')}")
+        return None
+    content = response["body"]["choices"][0]["message"]["content"]
+    if resp_format is None:
+        return content
+    try:
+        return resp_format.model_validate_json(content)
+    except Exception as e:
+        print(e)
+        return None
+
+# -------- backends --------
+class OpenAIBatchBackend:
+    """Submits through the OpenAI Batch API (files + batches, 24h completion window)."""
+    def __init__(self, client=None):
+        if client is None:
+            from LLMGateway import get_gateway
+            client = get_gateway().client
+        self.client = client
+
+    async def submit(self, jsonl_path: str) -> str:
+        with open(jsonl_path, "rb") as f:
+            batch_file = await self.client.files.create(file=f, purpose="batch")
+        batch = await self.client.batches.create(input_file_id=batch_file.id, endpoint=BATCH_ENDPOINT,
+                                                 completion_window="24h")
+        return batch.id
+
+    async def status(self, batch_id: str) -> str:
+        return (await self.client.batches.retrieve(batch_id)).status
+
+    async def results(self, batch_id: str) -> List[dict]:
+        batch = await self.client.batches.retrieve(batch_id)
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                content = await self.client.files.content(file_id)
+                lines.extend(orjson.loads(l) for l in content.read().splitlines() if l.strip())
+        return lines
+
+class LocalBatchBackend:
+    """
+    File-based stand-in for tests and offline runs. submit() copies the input to
+    `work_dir/<batch id>/input.jsonl`; the batch is complete once output.jsonl (in the
+    Batch API output format) exists next to it. With a `responder(body) -> str`, the
+    output is written immediately; otherwise something else must write it.
+    """
+    def __init__(self, work_dir: str, responder: Optional[Callable[[dict], str]] = None):
+        self.work_dir = work_dir
+        self.responder = responder
+        os.makedirs(work_dir, exist_ok=True)
+
+    async def submit(self, jsonl_path: str) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        batch_dir = os.path.join(self.work_dir, batch_id)
+        os.makedirs(batch_dir)
+        shutil.copy(jsonl_path, os.path.join(batch_dir, "input.jsonl"))
+        if self.responder is not None:
+            self._respond(batch_dir)
+        return batch_id
+
+    async def status(self, batch_id: str) -> str:
+        done = os.path.exists(os.path.join(self.work_dir, batch_id, "output.jsonl"))
+        return "completed" if done else "in_progress"
+
+    async def results(self, batch_id: str) -> List[dict]:
+        with open(os.path.join(self.work_dir, batch_id, "output.jsonl"), "rb") as f:
+            return [orjson.loads(l) for l in f if l.strip()]
+
+    def _respond(self, batch_dir: str):
+        out = []
+        with open(os.path.join(batch_dir, "input.jsonl"), "rb") as f:
+            for raw in f:
+                req = orjson.loads(raw)
+                body = {"choices": [{"index": 0, "message": {"role": "assistant", "content": self.responder(req["body"])}}]}
+                out.append({"custom_id": req["custom_id"], "response": {"status_code": 200, "body": body}, "error": None})
+        tmp = os.path.join(batch_dir, "output.jsonl.tmp")
+        with open(tmp, "wb") as f:
+            f.write(b"".join(orjson.dumps(line) + b"\n" for line in out))
+        os.replace(tmp, os.path.join(batch_dir, "output.jsonl"))
+
+def get_batch_backend():
+    """Backend chosen by LLM_BATCH_BACKEND ("openai" or "local:<dir>"), or None for direct calls."""
+    spec = os.getenv("LLM_BATCH_BACKEND")
+    if not spec:
+        return None
+    if spec == "openai":
+        return OpenAIBatchBackend()
+    if spec.startswith("local:"):
+        return LocalBatchBackend(spec[len("local:"):])
+    raise ValueError(f"Unknown LLM_BATCH_BACKEND '{spec}' (use 'openai' or 'local:<dir>').")
+
+# -------- runner --------
+async def run_batch(requests: Sequence[Tuple], backend, poll_interval: float = 30.0,
+                    work_dir: Optional[str] = None, cache: Optional[ResponseCache] = None,
+                    stage: Optional[str] = None, template: Optional[str] = None, caller: str = "batch") -> list:
+    """
+    Run (prompt, model, resp_format) requests through `backend` instead of one API call
+    each: write them as JSONL (split at MAX_BATCH_REQUESTS), submit, poll until every batch
+    is done, and return the outputs in request order (None where a request failed).
+    Like call_gpt, requests already in the response cache (`cache`, or the shared one)
+    are answered from it and not submitted, fresh outputs are stored there, and every
+    request is recorded in Telemetry under `stage` (latency: submit to result).
+    """
+    requests = list(requests)
+    if not requests:
+        return []
+    cache = cache if cache is not None else get_response_cache()
+    telemetry = get_telemetry()
+    outputs = [None] * len(requests)
+    keys = [None] * len(requests)
+    todo = []
+    for i, (prompt, model, resp_format) in enumerate(requests):
+        if cache is not None:
+            keys[i] = ResponseCache.key(model, prompt, resp_format)
+            cached = cache.get(keys[i], resp_format)  # raises ResponseCacheMiss in replay mode
+            if cached is not CACHE_MISS:
+                outputs[i] = cached
+                call = telemetry.new_call(model, stage, template, caller)
+                call.update(cache_hit=True, ok=True, latency_s=0.0)
+                telemetry.record(call)
+                continue
+        todo.append(i)
+    if not todo:
+        return outputs
+    own_dir = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix="llm_batch_")
+    t0 = time.perf_counter()
+    try:
+        batch_ids = []
+        for part, lo in enumerate(range(0, len(todo), MAX_BATCH_REQUESTS)):
+            path = os.path.join(work_dir, f"requests_{part}.jsonl")
+            with open(path, "wb") as f:
+                for i in todo[lo:lo + MAX_BATCH_REQUESTS]:
+                    prompt, model, resp_format = requests[i]
+                    f.write(orjson.dumps(request_line(f"req-{i}", prompt, model, resp_format)) + b"\n")
+            batch_ids.append(await backend.submit(path))
+
+        pending = list(batch_ids)
+        while pending:
+            states = await asyncio.gather(*[backend.status(b) for b in pending])
+            done = [b for b, state in zip(pending, states) if state in TERMINAL_STATES]
+            for batch_id in done:
+                for line in await backend.results(batch_id):
+                    i = int(line["custom_id"].split("-", 1)[1])
+                    prompt, model, resp_format = requests[i]
+                    outputs[i] = parse_result(line, resp_format)
+                    usage = ((line.get("response") or {}).get("body") or {}).get("usage") or {}
+                    call = telemetry.new_call(model, stage, template, caller)
+                    call.update(ok=outputs[i] is not None, latency_s=time.perf_counter() - t0,
+                                input_tokens=usage.get("prompt_tokens", 0), output_tokens=usage.get("completion_tokens", 0))
+                    telemetry.record(call)
+                    if cache is not None and outputs[i] is not None:
+                        cache.put(keys[i], model, outputs[i])
+            pending = [b for b in pending if b not in done]
+            if pending:
+                await asyncio.sleep(poll_interval)
+        return outputs
+    finally:
+        if own_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,141 @@
+from typing import List, Optional
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+import threading
+import time
+from FileManifest import FileManifest
+
+# <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+_EVENT = struct.Struct("iIII")   # wd, mask, cookie, len; followed by the NUL-padded name
+
+class DirWatcher:
+    """
+    Yields the files that appear in a FileManifest's directory, in batches ordered by
+    ctime, once they are complete. On Linux this uses inotify through libc (a file is
+    ready when it is closed after writing, or moved in); elsewhere, or with
+    use_inotify=False, it polls manifest.refresh() every `poll_interval` seconds and
+    holds a new file back until it has not been modified for `settle` seconds.
+    Files already in the manifest when the watcher starts are not reported.
+    The manifest is only read and changed while holding `lock`; pass the lock its
+    other users hold (e.g. Transcriber._manifest_lock) when it is shared.
+    """
+    def __init__(self, manifest: FileManifest, poll_interval: float = 2.0, settle: float = 1.0,
+                 use_inotify: bool = True, lock: Optional[threading.Lock] = None):
+        self.manifest = manifest
+        self.poll_interval = poll_interval
+        self.settle = settle
+        self._lock = lock if lock is not None else threading.Lock()
+        with self._lock:
+            self.seen = set(manifest.names.tolist())
+        self._pending = set()   # listed but possibly still being written
+        self._fd = self._inotify() if use_inotify else None
+        # files that arrived between the manifest's scan and the watch being set up
+        self._refresh()
+
+    @property
+    def mode(self) -> str:
+        return "inotify" if self._fd is not None else "polling"
+
+    def _inotify(self) -> Optional[int]:
+        name = ctypes.util.find_library("c")
+        try:
+            libc = ctypes.CDLL(name or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(self.manifest.directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    async def next_batch(self, timeout: Optional[float] = None) -> List[str]:
+        """Wait for new complete files (at most `timeout` seconds; [] if none arrived)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.poll_interval if deadline is None else min(self.poll_interval, deadline - time.monotonic())
+            if self._fd is not None:
+                names = await self._read_events(max(0.0, min(wait, self.settle) if self._pending else wait))
+                names += self._take_settled()
+            else:
+                await asyncio.sleep(max(0.0, wait))
+                self._refresh()
+                names = self._take_settled()
+            if names or (deadline is not None and time.monotonic() >= deadline):
+                with self._lock:
+                    return sorted(names, key=self.manifest.ctime_of)
+
+    def _refresh(self):
+        """List the directory; files not reported yet become pending."""
+        with self._lock:
+            added = self.manifest.refresh()
+        self._pending.update(n for n in added if n not in self.seen)
+
+    async def _read_events(self, timeout: float) -> List[str]:
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        loop.add_reader(self._fd, readable.set)
+        try:
+            await asyncio.wait_for(readable.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        finally:
+            loop.remove_reader(self._fd)
+        names, overflow = [], False
+        while True:
+            try:
+                buf = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buf):
+                _, mask, _, length = _EVENT.unpack_from(buf, offset)
+                name = buf[offset + _EVENT.size: offset + _EVENT.size + length].rstrip(b"\0").decode("utf-8", "replace")
+                offset += _EVENT.size + length
+                overflow |= bool(mask & IN_Q_OVERFLOW)
+                if name:
+                    names.append(name)
+        if overflow:
+            # events were dropped: fall back to a listing
+            self._refresh()
+        ready = []
+        for name in dict.fromkeys(names):
+            if not name.endswith(self.manifest.suffix) or name in self.seen:
+                continue
+            if not os.path.isfile(os.path.join(self.manifest.directory, name)):
+                continue
+            with self._lock:
+                self.manifest.update(name)   # stat after close: final ctime and size
+            self.seen.add(name)
+            self._pending.discard(name)
+            ready.append(name)
+        return ready
+
+    def _take_settled(self) -> List[str]:
+        """Pending files that have not been modified for `settle` seconds."""
+        ready, now = [], time.time()
+        for name in sorted(self._pending):
+            try:
+                st = os.stat(os.path.join(self.manifest.directory, name))
+            except FileNotFoundError:
+                self._pending.discard(name)
+                continue
+            if now - st.st_mtime >= self.settle:
+                with self._lock:
+                    self.manifest.update(name)
+                self.seen.add(name)
+                ready.append(name)
+        self._pending.difference_update(ready)
+        return ready
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
@@ -1,18 +1,18 @@
 import json 
 from prompts import tool_spec, eval
 from response_formats import ScenarioResponse, ToolResponse, Tool, JudgeResponse, PatternInductionResponse
-from utils import call_gpt
 import os 
 import re
 import numpy as np
 import orjson
 import asyncio 
-from openai import AsyncOpenAI
+from LLMGateway import get_gateway, PRIORITY_LOW
+from BatchRunner import get_batch_backend, run_batch
 from dotenv import load_dotenv
 from collections import deque
 from typing import List, Dict, Tuple
 from itertools import combinations 
-from sentence_transformers import SentenceTransformer
+from ModelRegistry import get_sentence_model
 load_dotenv()
 
 class EndToEnd(): 
@@ -27,9 +27,10 @@ class EndToEnd():
         self.user = user
         self.model = model
         self.scenario = scenario
-        self.client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.llm = get_gateway().caller("EndToEnd", priority=PRIORITY_LOW)
         self.outfile = outfile
-        self._sem = asyncio.Semaphore(int(os.getenv("LLM_CONCURRENCY", "16")))
+        # judge passes go through the Batch API when LLM_BATCH_BACKEND is set
+        self.batch_backend = get_batch_backend()
 
     @staticmethod 
     def _normalize_text(s: str) -> str:
@@ -38,7 +39,7 @@ class EndToEnd():
         return s
 
     def dedupe_instances(self, threshold= 0.8) -> List[dict]:
-        em_model = SentenceTransformer("all-MiniLM-L6-v2")
+        em_model = get_sentence_model("all-MiniLM-L6-v2")
 
         # Normalize text and embed
         proposed_needs = [EndToEnd._normalize_text(p['need']) for p in self.needs]
@@ -84,17 +85,15 @@ class EndToEnd():
             formatted_needs.append(f"Need: {need['need']}\nReasoning: {need['reasoning']}")
         return '\n'.join(formatted_needs)
 
-    async def _guarded_call(self, *args, **kwargs):
-        async with self._sem:
-            return await call_gpt(*args, **kwargs)
-        
     async def generate_scenarios(self, selected_needs: str) -> Tuple[List[dict], List[int]]: 
         baseline_prompt = tool_spec.PATTERN_INDUCTION_PROMPT
         baseline_prompt = baseline_prompt.format(context=self.scenario, limit=5, json_schema=tool_spec.PATTERN_INDUCTION_JSON_SCHEMA)
         needs_prompt = tool_spec.PATTERN_INDUCTION_PROMPT_NEEDS
         needs_prompt = needs_prompt.format(context=self.scenario, needs=selected_needs, limit=5, json_schema=tool_spec.PATTERN_INDUCTION_JSON_SCHEMA)
-        baseline_resps = await self._guarded_call(self.client, baseline_prompt, self.model, resp_format=PatternInductionResponse)
-        needs_resps = await self._guarded_call(self.client, needs_prompt, self.model, resp_format=PatternInductionResponse)
+        baseline_resps = await self.llm(baseline_prompt, self.model, resp_format=PatternInductionResponse,
+                                        stage="tools", template="tool_spec.PATTERN_INDUCTION_PROMPT")
+        needs_resps = await self.llm(needs_prompt, self.model, resp_format=PatternInductionResponse,
+                                     stage="tools", template="tool_spec.PATTERN_INDUCTION_PROMPT_NEEDS")
         return [i.model_dump() for i in baseline_resps.patterns], [i.model_dump() for i in needs_resps.patterns]
         # randomize 
         # for br, nr in zip(baseline_resps.tools, needs_resps.tools):
@@ -113,13 +112,15 @@ class EndToEnd():
         baseline_prompt = tool_spec.PATTERN_INDUCTION_PROMPT
         baseline_prompt = baseline_prompt.format(context=self.scenario, limit=5, json_schema=tool_spec.PATTERN_INDUCTION_JSON_SCHEMA)
 
-        baseline_tool = await self._guarded_call(self.client, baseline_prompt, self.model, resp_format=PatternInductionResponse)
+        baseline_tool = await self.llm(baseline_prompt, self.model, resp_format=PatternInductionResponse,
+                                        stage="tools", template="tool_spec.PATTERN_INDUCTION_PROMPT")
         # print(baseline_tool)
         needs_prompt = tool_spec.TOOL_UPDATE_PROMPT
         output = []
         for tool in baseline_tool:
             fmt_needs_prompt = needs_prompt.format(tool=tool, needs=selected_needs, json_schema=tool_spec.PATTERN_INDUCTION_JSON_SCHEMA)
-            tool_update = await self._guarded_call(self.client, fmt_needs_prompt, self.model, resp_format=PatternInductionResponse)
+            tool_update = await self.llm(fmt_needs_prompt, self.model, resp_format=PatternInductionResponse,
+                                          stage="tools", template="tool_spec.TOOL_UPDATE_PROMPT")
             output.append(tool_update.model_dump())
         return output
     
@@ -131,18 +132,19 @@ class EndToEnd():
         formatted_needs = []
 
         covered_ids = set([])
-        expected_needs = {}
-        for i, gt_need in enumerate(gt_needs):
-            tasks = []
-            expected_needs[str(i)] = []
-            for n in self.needs:
-                fmt_prompt = prompt.format(gt=gt_need, proposed=n)
-                tasks.append(self._guarded_call(self.client, fmt_prompt, "gpt-4o"))
-            resps = await asyncio.gather(*tasks, return_exceptions=True)
-            for j, resp in enumerate(resps):
-                if int(resp) == 1:
-                    covered_ids.add(j)
-                    expected_needs[str(i)].append(self.needs[j])
+        expected_needs = {str(i): [] for i in range(len(gt_needs))}
+        pairs = [(i, j) for i in range(len(gt_needs)) for j in range(len(self.needs))]
+        prompts = [prompt.format(gt=gt_needs[i], proposed=self.needs[j]) for i, j in pairs]
+        if self.batch_backend is not None:
+            resps = await run_batch([(p, "gpt-4o", None) for p in prompts], self.batch_backend,
+                                    stage="judge", template="eval.NEEDS_JUDGE", caller=self.llm.name)
+        else:
+            resps = await asyncio.gather(*[self.llm(p, "gpt-4o", stage="judge", template="eval.NEEDS_JUDGE")
+                                           for p in prompts], return_exceptions=True)
+        for (i, j), resp in zip(pairs, resps):
+            if int(resp) == 1:
+                covered_ids.add(j)
+                expected_needs[str(i)].append(self.needs[j])
         unexpected_needs = []
         for i in range(len(self.needs)):
             if i not in covered_ids:
@@ -0,0 +1,190 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+import fcntl
+import hashlib
+import os
+import re
+import unicodedata
+import numpy as np
+import orjson
+
+# On-disk layout of an EmbeddingCache directory; bump when it changes
+CACHE_FORMAT_VERSION = 1
+
+def normalize_text(text: str) -> str:
+    """Cache-key normalization: NFC, trimmed, internal whitespace collapsed."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+class EmbeddingCache:
+    """
+    Content-addressed, on-disk cache of float32 sentence embeddings for one model.
+
+    Layout of `cache_dir/<model>/`:
+      meta.json     version, model name, dimension
+      vectors.f32   append-only arena of float32 rows, read through np.memmap
+      keys.txt      one hex key per line; line i is the key of arena row i
+    A key is sha1(model name + normalized text). Rows are appended vector-first,
+    so a key on disk always has its vector; rows past the last key (an interrupted
+    write) are cut off before the next append. A small LRU keeps hot vectors in memory.
+    Several instances (in one process or several) may share a directory: appends
+    hold an flock on `lock` and first pick up the keys the others have written.
+    """
+    def __init__(self, cache_dir: str, model_name: str, dim: Optional[int] = None, lru_size: int = 10_000):
+        self.model_name = model_name
+        self.path = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9._-]", "_", model_name))
+        self.dim = dim
+        self.lru_size = int(lru_size)
+        self.hits = 0
+        self.misses = 0
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._rows = {}   # key -> arena row
+        self._n_rows = 0  # lines in keys.txt (duplicates included) == rows that belong to a key
+        self._keys_size = 0   # bytes of keys.txt read so far
+        self._arena = None
+        self._mapped_rows = 0
+        os.makedirs(self.path, exist_ok=True)
+        self._load_meta()
+
+    # ---------- public API ----------
+    def key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.model_name}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: List[str]) -> Tuple[List[Optional[np.ndarray]], List[int]]:
+        """Return (vectors, miss_indices); vectors[i] is None for every miss."""
+        out, missing = [], []
+        for i, text in enumerate(texts):
+            vec = self._get(self.key(text))
+            out.append(vec)
+            if vec is None:
+                missing.append(i)
+        if missing and self.dim is not None:
+            # another instance sharing the directory may have written them since
+            self._sync()
+            for i in list(missing):
+                vec = self._get(self.key(texts[i]))
+                if vec is not None:
+                    out[i] = vec
+                    missing.remove(i)
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        return out, missing
+
+    def put_many(self, texts: List[str], vecs: np.ndarray) -> None:
+        vecs = np.ascontiguousarray(vecs, dtype=np.float32)
+        if self.dim is None:
+            self.dim = int(vecs.shape[1])
+            self._write_meta()
+        with self._locked():
+            self._sync()
+            new_keys, seen = [], set()
+            with open(os.path.join(self.path, "vectors.f32"), "ab") as f:
+                # rows past the last key belong to an interrupted write
+                f.truncate(self._n_rows * 4 * self.dim)
+                for text, vec in zip(texts, vecs):
+                    key = self.key(text)
+                    if key in self._rows or key in seen:
+                        continue
+                    f.write(vec.tobytes())
+                    new_keys.append(key)
+                    seen.add(key)
+                    self._remember(key, vec.copy())
+            if new_keys:
+                with open(os.path.join(self.path, "keys.txt"), "a", encoding="utf-8") as f:
+                    f.write("".join(k + "\n" for k in new_keys))
+                self._sync()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._rows)}
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    # ---------- internals ----------
+    def _load_meta(self):
+        meta_path = os.path.join(self.path, "meta.json")
+        if not os.path.exists(meta_path):
+            if self.dim is not None:
+                self._write_meta()
+            return
+        with open(meta_path, "rb") as f:
+            meta = orjson.loads(f.read())
+        if meta.get("version") != CACHE_FORMAT_VERSION or meta["model_name"] != self.model_name:
+            raise ValueError(f"Embedding cache at {self.path} was written for {meta.get('model_name')} "
+                             f"(version {meta.get('version')}), expected {self.model_name} (version {CACHE_FORMAT_VERSION}).")
+        if self.dim is not None and meta["dim"] != self.dim:
+            raise ValueError(f"Embedding cache at {self.path} has dim={meta['dim']}, expected {self.dim}.")
+        self.dim = meta["dim"]
+        keys_path = os.path.join(self.path, "keys.txt")
+        vec_path = os.path.join(self.path, "vectors.f32")
+        if not (os.path.exists(keys_path) and os.path.exists(vec_path)):
+            return
+        with self._locked():
+            self._sync()
+            n_vecs = os.path.getsize(vec_path) // (4 * self.dim)
+            if self._n_rows > n_vecs:
+                # keys are written after their vectors, so this only follows outside damage
+                with open(keys_path, "r", encoding="utf-8") as f:
+                    keys = [line.strip() for line in f][:n_vecs]
+                with open(keys_path, "w", encoding="utf-8") as f:
+                    f.write("".join(k + "\n" for k in keys))
+                self._rows, self._n_rows, self._keys_size = {}, 0, 0
+                self._sync()
+            elif n_vecs > self._n_rows:
+                # vectors of an interrupted put_many that never got their keys
+                with open(vec_path, "ab") as f:
+                    f.truncate(self._n_rows * 4 * self.dim)
+
+    @contextmanager
+    def _locked(self):
+        with open(os.path.join(self.path, "lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _sync(self):
+        """Read the keys appended to keys.txt (by any instance) since the last call."""
+        keys_path = os.path.join(self.path, "keys.txt")
+        if not os.path.exists(keys_path):
+            return
+        with open(keys_path, "rb") as f:
+            f.seek(self._keys_size)
+            chunk = f.read()
+        end = chunk.rfind(b"\n") + 1   # a line still being written is read next time
+        keys = chunk[:end].decode("utf-8").splitlines()
+        for i, key in enumerate(keys):
+            self._rows.setdefault(key.strip(), self._n_rows + i)
+        self._n_rows += len(keys)
+        self._keys_size += end
+
+    def _write_meta(self):
+        meta = {"version": CACHE_FORMAT_VERSION, "model_name": self.model_name, "dim": self.dim}
+        with open(os.path.join(self.path, "meta.json"), "wb") as f:
+            f.write(orjson.dumps(meta))
+
+    def _get(self, key: str) -> Optional[np.ndarray]:
+        vec = self._lru.get(key)
+        if vec is not None:
+            self._lru.move_to_end(key)
+            return vec
+        row = self._rows.get(key)
+        if row is None:
+            return None
+        if row >= self._mapped_rows:
+            # arena grew since it was mapped
+            self._mapped_rows = os.path.getsize(os.path.join(self.path, "vectors.f32")) // (4 * self.dim)
+            self._arena = np.memmap(os.path.join(self.path, "vectors.f32"), dtype=np.float32, mode="r",
+                                    shape=(self._mapped_rows, self.dim))
+        vec = np.array(self._arena[row])
+        self._remember(key, vec)
+        return vec
+
+    def _remember(self, key: str, vec: np.ndarray):
+        self._lru[key] = vec
+        self._lru.move_to_end(key)
+        if len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
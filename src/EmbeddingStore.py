@@ -1,39 +1,123 @@
 
 
-from sentence_transformers import SentenceTransformer
+from ModelRegistry import get_encoder_pool, get_sentence_model
+from EmbeddingCache import EmbeddingCache
+from VectorIndex import ExactFlatIndex, QuantizedFlatIndex
+import asyncio
 import hnswlib
 import numpy as np
+import orjson
+import os
+import threading
+
+# On-disk layout written by EmbeddingsStore.save(); bump when it changes
+STORE_FORMAT_VERSION = 1
 
 # -------- Embedding/ANN store (fast + batched) --------
 class EmbeddingsStore:
     """
     Maintains L2-normalized sentence embeddings + ANN (HNSW) for fast cosine checks.
+    With backend="auto", small stores use an exact flat matrix (one BLAS product per
+    query) and are promoted to HNSW once they hold more than `promote_at` vectors.
     """
-    def __init__(self, st_model_name="all-MiniLM-L6-v2", sim_threshold=0.85, ann_max=200_000, device=None):
+    def __init__(self, st_model_name="all-MiniLM-L6-v2", sim_threshold=0.85, ann_max=200_000, device=None,
+                 compact_ratio=0.25, cache_dir=None, cache_lru_size=10_000, vector_dtype="float32", rerank=32,
+                 backend="auto", promote_at=4096, encode_workers=0, pool_min_texts=2048, arena_dir=None):
         self.model_name = st_model_name
-        self.model = SentenceTransformer(self.model_name, device=device)
-        self.dim = self.model.get_sentence_embedding_dimension()
+        self.device = device
+        # encode_workers > 1: encode calls with at least pool_min_texts texts go to a shared
+        # multi-process EncoderPool (smaller calls are not worth the IPC round trip)
+        self.encode_workers = int(encode_workers)
+        self.pool_min_texts = int(pool_min_texts)
+        self._dim = None
         self.threshold = float(sim_threshold)
+        # optional on-disk embedding cache shared across runs (see EmbeddingCache)
+        self.cache = EmbeddingCache(cache_dir, st_model_name, lru_size=cache_lru_size) if cache_dir else None
+        # encode() runs in worker threads (encode_stream) for several windows at once;
+        # the model and the cache arena are used by one of them at a time
+        self._encode_lock = threading.Lock()
 
-        # ANN setup
-        self.ann = hnswlib.Index(space='cosine', dim=self.dim)
+        # ANN setup (created on first insert; needs the model's dimension)
+        # vector_dtype="float32" -> HNSW graph; "int8"/"float16" -> compact QuantizedFlatIndex
+        # that re-scores its `rerank` best candidates in exact float32, kept in an arena file
+        # in arena_dir (default: cache_dir, else the directory last saved to or loaded from)
+        self.vector_dtype = vector_dtype
+        self.rerank = int(rerank)
+        self.arena_dir = arena_dir or cache_dir
+        self._store_dir = None
+        # float32 index backend: "hnsw", "exact" (flat matrix), or "auto" (exact until promote_at)
+        if backend not in ("auto", "hnsw", "exact"):
+            raise ValueError(f"Unknown backend '{backend}' (use 'auto', 'hnsw' or 'exact').")
+        self.backend = backend
+        self.promote_at = int(promote_at)
+        self.ann = None
         self._initialized = False
         self._max_elements = int(ann_max)
         self._ef = 200
         self._M = 32
         self._next_ann_id = 0
+        # removed vectors stay in the graph as tombstones until their slot is reused or we compact
+        self._deleted = 0
+        self.compact_ratio = float(compact_ratio)
 
         self.id2ann = {}      # nid -> ann_id
         self.ann2id = {}      # ann_id -> nid
 
-    def _ensure_index(self):
+    @property
+    def model(self):
+        """Shared SentenceTransformer from the process-wide registry, loaded on first use."""
+        return get_sentence_model(self.model_name, self.device)
+
+    @property
+    def dim(self) -> int:
+        if self._dim is None:
+            # a warm cache already knows the dimension, which avoids loading the model
+            if self.cache is not None and self.cache.dim is not None:
+                self._dim = self.cache.dim
+            else:
+                self._dim = self.model.get_sentence_embedding_dimension()
+        return self._dim
+
+    def _new_index(self, kind: str):
+        if kind == "hnsw":
+            return hnswlib.Index(space='cosine', dim=self.dim)
+        if kind == "exact":
+            return ExactFlatIndex(self.dim)
+        arena_dir = self.arena_dir or self._store_dir
+        if arena_dir and not os.path.isdir(arena_dir):
+            arena_dir = None   # e.g. a state snapshot that has since been replaced
+        return QuantizedFlatIndex(self.dim, dtype=self.vector_dtype, rerank=self.rerank, arena_dir=arena_dir)
+
+    @property
+    def index_kind(self) -> str:
+        """Kind of the live index: "hnsw", "exact" or the compact dtype ("int8"/"float16")."""
+        if self.vector_dtype != "float32":
+            return self.vector_dtype
+        if isinstance(self.ann, hnswlib.Index):
+            return "hnsw"
+        if isinstance(self.ann, ExactFlatIndex):
+            return "exact"
+        return "hnsw" if self.backend == "hnsw" else "exact"
+
+    def _ensure_index(self, kind=None):
         if not self._initialized:
-            self.ann.init_index(max_elements=self._max_elements, ef_construction=200, M=self._M)
+            self.ann = self._new_index(kind or self.index_kind)
+            self.ann.init_index(max_elements=self._max_elements, ef_construction=200, M=self._M,
+                                allow_replace_deleted=True)
             self.ann.set_ef(self._ef)
             self._initialized = True
 
+    def _maybe_promote(self, to_add: int):
+        """Swap the exact flat index for HNSW once the store outgrows promote_at (backend="auto")."""
+        if self.backend != "auto" or self.index_kind != "exact":
+            return
+        if len(self.id2ann) + to_add <= self.promote_at:
+            return
+        self._rebuild("hnsw")
+
     def _maybe_grow(self, to_add: int):
-        need = self._next_ann_id + to_add
+        # slots in use (live + tombstones); ann ids are labels and keep growing past reused slots
+        need = self.ann.get_current_count() + to_add
         if need > self._max_elements:
             # grow in chunks to avoid frequent resizes
             new_cap = max(need + 10_000, int(self._max_elements * 1.5))
@@ -41,9 +125,60 @@ class EmbeddingsStore:
             self._max_elements = new_cap
 
     def encode(self, texts, batch_size=256):
-        """Return L2-normalized embeddings as float32 numpy array (N, D)."""
+        """
+        Return L2-normalized embeddings as float32 numpy array (N, D).
+        With a cache, only the cache misses are sent to the model, in one batch.
+        """
         if isinstance(texts, str):
             texts = [texts]
+        with self._encode_lock:
+            return self._encode_locked(texts, batch_size)
+
+    def _encode_locked(self, texts, batch_size):
+        if self.cache is None:
+            return self._encode_model(texts, batch_size)
+        cached, missing = self.cache.get_many(texts)
+        if missing:
+            miss_texts = list(dict.fromkeys(texts[i] for i in missing))
+            fresh = self._encode_model(miss_texts, batch_size)
+            self.cache.put_many(miss_texts, fresh)
+            by_text = dict(zip(miss_texts, fresh))
+            for i in missing:
+                cached[i] = by_text[texts[i]]
+        if not cached:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack(cached).astype(np.float32, copy=False)
+
+    async def encode_stream(self, texts, batch_size=256) -> np.ndarray:
+        """
+        encode() for texts arriving from an async iterator (e.g. a streamed LLM response):
+        whatever has arrived is encoded in a worker thread, one batch at a time, while the
+        iterator keeps producing. Returns (N, D) rows in arrival order.
+        """
+        parts, pending, running = [], [], None
+        async for text in texts:
+            pending.append(text)
+            if running is None or running.done():
+                if running is not None:
+                    parts.append(running.result())
+                running = asyncio.ensure_future(asyncio.to_thread(self.encode, pending, batch_size))
+                pending = []
+        if running is not None:
+            parts.append(await running)
+        if pending:
+            parts.append(await asyncio.to_thread(self.encode, pending, batch_size))
+        if not parts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.concatenate(parts)
+
+    def cache_stats(self) -> dict:
+        """Hit/miss counters of the embedding cache (empty if caching is off)."""
+        return self.cache.stats() if self.cache is not None else {}
+
+    def _encode_model(self, texts, batch_size=256):
+        if self.encode_workers > 1 and len(texts) >= self.pool_min_texts:
+            pool = get_encoder_pool(self.model_name, self.device, self.encode_workers)
+            return pool.encode(texts, batch_size=batch_size)
         vecs = self.model.encode(
             texts,
             batch_size=batch_size,
@@ -56,13 +191,20 @@ class EmbeddingsStore:
 
     def max_cosine(self, vec: np.ndarray, k: int = 1) -> float:
         """Return max cosine similarity in index (or -inf if empty)."""
-        if not self._initialized or self._next_ann_id == 0:
+        if not self._initialized or not self.id2ann:
             return float("-inf")
         labels, dists = self.ann.knn_query(vec[np.newaxis, :], k=k)
         # hnswlib cosine distance = 1 - cosine_similarity
         cos = 1.0 - float(dists[0][0])
         return cos
 
+    def max_cosine_batch(self, vecs: np.ndarray, k: int = 1) -> np.ndarray:
+        """Max cosine similarity in index for each row of vecs, with one knn_query (-inf if empty)."""
+        if not self._initialized or not self.id2ann:
+            return np.full(len(vecs), float("-inf"), dtype=np.float32)
+        labels, dists = self.ann.knn_query(vecs, k=k)
+        return 1.0 - dists[:, 0]
+
     def is_new(self, vec: np.ndarray) -> bool:
         max_sim = self.max_cosine(vec, k=1)
         if max_sim == float("-inf"):
@@ -70,13 +212,26 @@ class EmbeddingsStore:
         return max_sim < self.threshold
 
     def add(self, nid: str, vec: np.ndarray):
+        self.add_batch([nid], vec[np.newaxis, :])
+
+    def add_batch(self, ids, vecs: np.ndarray):
+        """Insert all (nid, vec) pairs with a single add_items call. Existing nids are replaced."""
+        if len(ids) == 0:
+            return
         self._ensure_index()
-        self._maybe_grow(1)
-        ann_id = self._next_ann_id
-        self.ann.add_items(vec[np.newaxis, :], ids=np.array([ann_id], dtype=np.int64))
-        self.id2ann[nid] = ann_id
-        self.ann2id[ann_id] = nid
-        self._next_ann_id += 1
+        for nid in ids:
+            if nid in self.id2ann:
+                self._mark_deleted(nid)
+        self._maybe_promote(len(ids))
+        self._maybe_grow(len(ids))
+        ann_ids = np.arange(self._next_ann_id, self._next_ann_id + len(ids), dtype=np.int64)
+        # reuse tombstoned slots before appending new ones
+        self.ann.add_items(vecs, ids=ann_ids, replace_deleted=self._deleted > 0)
+        self._deleted = max(0, self._deleted - len(ids))
+        for nid, ann_id in zip(ids, ann_ids.tolist()):
+            self.id2ann[nid] = ann_id
+            self.ann2id[ann_id] = nid
+        self._next_ann_id += len(ids)
 
     def add_if_new(self, nid: str, vec: np.ndarray) -> bool:
         if self.is_new(vec):
@@ -86,11 +241,132 @@ class EmbeddingsStore:
 
     def batch_add_if_new(self, ids, vecs):
         """
-        Vectorized(ish) path: checks each vec against ANN and adds if < threshold.
-        (Queries still 1-by-1 to keep ANN logic simple.)
+        Batched path with the same decisions as calling add_if_new on each (nid, vec) in order:
+        one knn_query for the whole batch against the existing index, a NumPy similarity
+        matrix for duplicates inside the batch (a vec is dropped if it is too close to an
+        earlier vec of the batch that was kept), and one add_items for the survivors.
         Returns mask/list of bools indicating added.
         """
+        ids = list(ids)
+        if not ids:
+            return []
+        vecs = np.asarray(vecs, dtype=np.float32)
+        index_sim = self.max_cosine_batch(vecs)
+        batch_sim = vecs @ vecs.T  # embeddings are L2-normalized, so dot == cosine
         added = []
-        for nid, v in zip(ids, vecs):
-            added.append(self.add_if_new(nid, v))
+        kept = []
+        for i in range(len(ids)):
+            is_new = index_sim[i] < self.threshold
+            if is_new and kept:
+                is_new = batch_sim[i, kept].max() < self.threshold
+            added.append(bool(is_new))
+            if is_new:
+                kept.append(i)
+        self.add_batch([ids[i] for i in kept], vecs[kept])
         return added
+
+    def remove(self, nid: str):
+        """Drop nid's vector so it no longer suppresses new candidates (no-op if unknown)."""
+        if nid in self.id2ann:
+            self._mark_deleted(nid)
+            self._maybe_compact()
+
+    def update(self, nid: str, vec: np.ndarray):
+        """Replace nid's vector, e.g. after its observation text was rewritten."""
+        if nid not in self.id2ann:
+            raise KeyError(f"nid '{nid}' not found.")
+        self.add(nid, vec)
+
+    def _mark_deleted(self, nid: str):
+        ann_id = self.id2ann.pop(nid)
+        del self.ann2id[ann_id]
+        self.ann.mark_deleted(ann_id)
+        self._deleted += 1
+
+    def _maybe_compact(self):
+        total = self.ann.get_current_count()
+        if total and self._deleted / total > self.compact_ratio:
+            self.compact()
+
+    def compact(self):
+        """Rebuild the index from live vectors only, dropping every tombstone."""
+        if self._initialized:
+            self._rebuild(self.index_kind)
+
+    def _rebuild(self, kind: str):
+        """Re-insert the live vectors, with their labels, into a fresh index of the given kind."""
+        labels = np.fromiter(self.ann2id.keys(), dtype=np.int64, count=len(self.ann2id))
+        vecs = np.asarray(self.ann.get_items(labels), dtype=np.float32) if len(labels) else None
+        self._initialized = False
+        self._deleted = 0
+        self._ensure_index(kind)
+        if vecs is not None:
+            self.ann.add_items(vecs, ids=labels)
+
+    # ---------- persistence ----------
+    @staticmethod
+    def _index_file(kind: str) -> str:
+        # hnswlib's own binary format; the flat indexes are np.savez archives
+        return "hnsw.bin" if kind == "hnsw" else "index.npz"
+
+    def save(self, path: str):
+        """
+        Write the index (hnsw.bin for HNSW, index.npz for the exact and compact flat
+        indexes) and id maps/model info (meta.json) to directory `path`.
+        """
+        os.makedirs(path, exist_ok=True)
+        self._store_dir = path
+        index_file = self._index_file(self.index_kind)
+        if self._initialized:
+            self.ann.save_index(os.path.join(path, index_file))
+        meta = {
+            "version": STORE_FORMAT_VERSION,
+            "model_name": self.model_name,
+            "dim": self.dim,
+            "initialized": self._initialized,
+            "max_elements": self._max_elements,
+            "ef": self._ef,
+            "M": self._M,
+            "next_ann_id": self._next_ann_id,
+            "deleted": self._deleted,
+            "vector_dtype": self.vector_dtype,
+            "index_kind": self.index_kind,
+            "index_file": index_file,
+            "id2ann": self.id2ann,
+        }
+        # meta.json last, so an interrupted save is detected on load
+        with open(os.path.join(path, "meta.json"), "wb") as f:
+            f.write(orjson.dumps(meta))
+
+    def load(self, path: str):
+        """
+        Restore a store written by save() into this instance. The saved model name and
+        dimension must match this store's, otherwise the vectors would be meaningless.
+        """
+        with open(os.path.join(path, "meta.json"), "rb") as f:
+            meta = orjson.loads(f.read())
+        if meta.get("version") != STORE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported EmbeddingsStore version {meta.get('version')} (expected {STORE_FORMAT_VERSION}).")
+        if meta["model_name"] != self.model_name or meta["dim"] != self.dim:
+            raise ValueError(
+                f"Saved store uses {meta['model_name']} (dim={meta['dim']}), "
+                f"this store uses {self.model_name} (dim={self.dim})."
+            )
+        self._max_elements = max(int(meta["max_elements"]), self._max_elements)
+        self._ef = meta["ef"]
+        self._M = meta["M"]
+        self.vector_dtype = meta.get("vector_dtype", "float32")
+        self.ann = None
+        self._store_dir = path
+        self._initialized = meta["initialized"]
+        if self._initialized:
+            # stores saved before the exact backend existed are always HNSW
+            self.ann = self._new_index(meta.get("index_kind", "hnsw" if self.vector_dtype == "float32" else self.vector_dtype))
+            # stores saved before index_file was recorded wrote every kind to hnsw.bin
+            self.ann.load_index(os.path.join(path, meta.get("index_file", "hnsw.bin")), max_elements=self._max_elements,
+                                allow_replace_deleted=True)
+            self.ann.set_ef(self._ef)
+        self._next_ann_id = meta["next_ann_id"]
+        self._deleted = meta.get("deleted", 0)
+        self.id2ann = dict(meta["id2ann"])
+        self.ann2id = {ann_id: nid for nid, ann_id in self.id2ann.items()}
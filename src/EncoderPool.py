@@ -0,0 +1,77 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import multiprocessing as mp
+import os
+import numpy as np
+
+# -------- worker side (runs in the pool's child processes) --------
+_worker_model = None
+
+def _init_worker(model_name: str, device, threads: int):
+    global _worker_model
+    import torch
+    # one process per core slice; stops N workers from each spawning cpu_count() torch threads
+    torch.set_num_threads(threads)
+    from ModelRegistry import get_sentence_model
+    _worker_model = get_sentence_model(model_name, device)
+
+def _encode_chunk(texts, batch_size: int) -> np.ndarray:
+    vecs = _worker_model.encode(
+        texts,
+        batch_size=batch_size,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=False
+    )
+    return np.asarray(vecs, dtype=np.float32)
+
+# -------- Multi-process SentenceTransformer encoder --------
+class EncoderPool:
+    """
+    Pool of worker processes, each holding its own copy of the SentenceTransformer, for
+    large re-embedding jobs (e.g. backfilling historical action logs). Texts are cut into
+    chunks and streamed to the workers with at most `prefetch` chunks in flight per worker;
+    results come back in input order. Workers are spawned (not forked) so torch state is
+    never shared, and each gets cpu_count() // workers intra-op threads.
+    """
+    def __init__(self, model_name: str, device=None, workers=None, chunk_size: int = 1024, prefetch: int = 2):
+        self.model_name = model_name
+        self.workers = int(workers or os.cpu_count() or 1)
+        self.chunk_size = int(chunk_size)
+        self.prefetch = int(prefetch)
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=mp.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_name, device, threads),
+        )
+
+    def encode_iter(self, texts, batch_size: int = 256):
+        """
+        Yield L2-normalized float32 embeddings, one (chunk, D) array per chunk, in input order.
+        `texts` may be any iterable (e.g. a generator over log files); it is consumed lazily.
+        """
+        it = iter(texts)
+        pending = deque()
+        max_pending = self.workers * self.prefetch
+        while True:
+            while len(pending) < max_pending:
+                chunk = list(islice(it, self.chunk_size))
+                if not chunk:
+                    break
+                pending.append(self._executor.submit(_encode_chunk, chunk, batch_size))
+            if not pending:
+                return
+            yield pending.popleft().result()
+
+    def encode(self, texts, batch_size: int = 256) -> np.ndarray:
+        """Return L2-normalized embeddings as float32 numpy array (N, D), in input order."""
+        parts = list(self.encode_iter(texts, batch_size))
+        if not parts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.concatenate(parts)
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,121 @@
+from typing import List, Optional
+import os
+import time
+import numpy as np
+
+# Layout of the saved .npz; a manifest with another version is ignored and rebuilt
+MANIFEST_FORMAT_VERSION = 1
+
+class FileManifest:
+    """
+    Stat metadata (ctime, mtime, size) of the `suffix` files in one directory, collected in
+    a single os.scandir pass and kept as parallel arrays next to the file names.
+
+    Transcript and summary files are written once, so a file's stat is taken the first time
+    it is seen and then reused: refresh() stats only names it has not seen before, and skips
+    the directory listing entirely when the directory's own mtime has not changed. With a
+    `path`, the manifest is saved there after every refresh that changed it and loaded on
+    the next run, so reruns over a large directory do not stat its files again.
+    """
+    def __init__(self, directory: str, suffix: str = ".md", path: Optional[str] = None):
+        self.directory = directory
+        self.suffix = suffix
+        self.path = path
+        self.names = np.zeros(0, dtype=str)
+        self.ctime = np.zeros(0, dtype=np.float64)
+        self.mtime = np.zeros(0, dtype=np.float64)
+        self.size = np.zeros(0, dtype=np.int64)
+        self._dir_mtime_ns = -1
+        # the directory's mtime was already a second old at the last scan, so a later
+        # change cannot hide behind the same (coarse) timestamp
+        self._settled = False
+        self._pos = {}   # name -> row
+        if path and os.path.exists(path):
+            self._load(path)
+        self.refresh()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._pos
+
+    def refresh(self) -> List[str]:
+        """Rescan the directory; returns the names added since the last scan, by ctime."""
+        scan_ns = time.time_ns()
+        dir_mtime_ns = os.stat(self.directory).st_mtime_ns
+        if dir_mtime_ns == self._dir_mtime_ns and self._settled:
+            return []
+        names, rows, fresh = [], [], []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(self.suffix) or not entry.is_file():
+                    continue
+                names.append(entry.name)
+                row = self._pos.get(entry.name)
+                if row is None:
+                    st = entry.stat()
+                    fresh.append(entry.name)
+                    rows.append((st.st_ctime, st.st_mtime, st.st_size))
+                else:
+                    rows.append((self.ctime[row], self.mtime[row], self.size[row]))
+        removed = len(self._pos) + len(fresh) - len(names)
+        rows = np.array(rows, dtype=np.float64).reshape(-1, 3)
+        self.names = np.array(names, dtype=str)
+        self.ctime = rows[:, 0].copy()
+        self.mtime = rows[:, 1].copy()
+        self.size = rows[:, 2].astype(np.int64)
+        self._pos = {n: i for i, n in enumerate(names)}
+        self._dir_mtime_ns = dir_mtime_ns
+        self._settled = dir_mtime_ns < scan_ns - 1_000_000_000
+        if self.path and (fresh or removed or self._settled):
+            self.save(self.path)
+        return sorted(fresh, key=self.ctime_of)
+
+    def update(self, name: str):
+        """Stat one file now (e.g. once it has been fully written) and add or replace its row; not saved."""
+        st = os.stat(os.path.join(self.directory, name))
+        row = self._pos.get(name)
+        if row is None:
+            self._pos[name] = len(self.names)
+            self.names = np.append(self.names, name)
+            self.ctime = np.append(self.ctime, st.st_ctime)
+            self.mtime = np.append(self.mtime, st.st_mtime)
+            self.size = np.append(self.size, st.st_size)
+        else:
+            self.ctime[row], self.mtime[row], self.size[row] = st.st_ctime, st.st_mtime, st.st_size
+
+    def ctime_of(self, name: str) -> float:
+        return float(self.ctime[self._pos[name]])
+
+    def ctimes(self, names: List[str]) -> np.ndarray:
+        return self.ctime[[self._pos[n] for n in names]] if names else np.zeros(0, dtype=np.float64)
+
+    def sorted_by_ctime(self) -> List[str]:
+        """Names oldest first; ties keep directory order, like sorted(os.listdir(...), key=getctime)."""
+        return self.names[np.argsort(self.ctime, kind="stable")].tolist()
+
+    def split_sessions(self, names: List[str], threshold: float = 3600) -> List[List[str]]:
+        """Split ctime-ordered names wherever consecutive files are more than `threshold` seconds apart."""
+        gaps = np.diff(self.ctimes(names))
+        assert (gaps >= 0).all(), "Time difference is negative"
+        cuts = (np.flatnonzero(gaps > threshold) + 1).tolist()
+        return [names[a:b] for a, b in zip([0] + cuts, cuts + [len(names)])]
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, version=MANIFEST_FORMAT_VERSION, directory=os.path.abspath(self.directory),
+                 suffix=self.suffix, dir_mtime_ns=self._dir_mtime_ns, settled=self._settled,
+                 names=self.names, ctime=self.ctime, mtime=self.mtime, size=self.size)
+        os.replace(tmp, path)
+
+    def _load(self, path: str):
+        with np.load(path, allow_pickle=False) as z:
+            if (int(z["version"]) != MANIFEST_FORMAT_VERSION or str(z["directory"]) != os.path.abspath(self.directory)
+                    or str(z["suffix"]) != self.suffix):
+                return
+            self.names, self.ctime, self.mtime, self.size = z["names"], z["ctime"], z["mtime"], z["size"]
+            self._dir_mtime_ns = int(z["dir_mtime_ns"])
+            self._settled = bool(z["settled"])
+        self._pos = {n: i for i, n in enumerate(self.names.tolist())}
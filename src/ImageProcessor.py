@@ -1,18 +1,16 @@
 import asyncio 
 import base64
 import os
-from openai import AsyncOpenAI
+from LLMGateway import get_gateway
 from typing import Optional
 from dotenv import load_dotenv
-from tenacity import retry, wait_exponential, stop_after_attempt, retry_if_exception_type
-from openai import APIError, RateLimitError
 
 class ImageProcessor():
     def __init__(self):
         load_dotenv()
 
         self.model_name = 'gpt-4o-mini'
-        self.client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.llm = get_gateway().caller("ImageProcessor")
     
     @staticmethod
     def _encode_image(img_path: str) -> str:
@@ -31,11 +29,6 @@ class ImageProcessor():
     def _sample_frames(video_path: str): 
         print('TBD')
 
-    @retry(
-        wait=wait_exponential(multiplier=1, min=4, max=10),
-        stop=stop_after_attempt(5),
-        retry=retry_if_exception_type((APIError, RateLimitError))
-    )
     async def call_gpt_vision(self, prompt: str, images: list[str], id: Optional[str]):
         """Call GPT Vision API to analyze images.
         
@@ -57,9 +50,9 @@ class ImageProcessor():
         ]
         content.append({"type": "text", "text": prompt})
 
-        rsp = await self.client.chat.completions.create(
+        rsp = await self.llm.run(lambda: self.llm.client.chat.completions.create(
             model=self.model_name,
             messages=[{"role": "user", "content": content}],
             response_format={"type": "text"},
-        )
+        ), self.model_name, prompt)
         return rsp.choices[0].message.content, id
\ No newline at end of file
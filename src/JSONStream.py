@@ -0,0 +1,59 @@
+from typing import List
+
+class ArrayItemStream:
+    """
+    Incremental scanner for structured-output text such as
+        {"observations": [{...}, {...}, ...]}
+    feed() takes the next chunk of the JSON document and returns the raw text of every
+    element of the top-level `field` array that closed within it, so each element can be
+    validated and used while the rest of the response is still being generated.
+    Elements must be objects or arrays (as in ObservationResponse / ClusterResponse).
+    Only strings (with escapes) and bracket depth are tracked; the document as a whole
+    is still expected to be valid JSON.
+    """
+    def __init__(self, field: str):
+        self.field = field
+        self._depth = 0
+        self._array_depth = None   # depth just inside the target array, once entered
+        self._closed = False       # target array finished
+        self._buf = []             # text of the element being collected
+        self._in_string = False
+        self._escape = False
+        self._key = []             # chars of the current string at depth 1
+        self._last_key = None
+
+    def feed(self, chunk: str) -> List[str]:
+        items = []
+        for ch in chunk:
+            inside = (self._array_depth is not None and not self._closed
+                      and (self._depth > self._array_depth or ch in "{["))
+            if inside:
+                self._buf.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_key = "".join(self._key)
+                elif self._depth == 1:
+                    self._key.append(ch)
+            elif ch == '"':
+                self._in_string = True
+                self._key = []
+            elif ch in "{[":
+                self._depth += 1
+                if ch == "[" and self._depth == 2 and self._array_depth is None and self._last_key == self.field:
+                    self._array_depth = 2
+                    self._buf = []
+            elif ch in "}]":
+                self._depth -= 1
+                if self._array_depth is not None and not self._closed:
+                    if self._depth == self._array_depth:
+                        items.append("".join(self._buf))
+                        self._buf = []
+                    elif self._depth < self._array_depth:
+                        self._closed = True
+        return items
@@ -0,0 +1,413 @@
+from contextlib import asynccontextmanager
+from itertools import count
+from typing import Optional
+import asyncio
+import heapq
+import os
+import random
+import re
+import threading
+import time
+import orjson
+from openai import DEFAULT_CONNECTION_LIMITS, AsyncOpenAI, DefaultAsyncHttpxClient, RateLimitError, Timeout
+from utils import RETRYABLE_ERRORS, call_gpt, lookup_response, stream_gpt_items
+from ResponseCache import CACHE_MISS
+from Telemetry import get_telemetry, note_cache_hit, note_usage
+
+# Lower value = served first when callers compete for a slot
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+def estimate_tokens(prompt) -> int:
+    """Rough prompt size for TPM budgeting (~4 characters per token)."""
+    text = prompt if isinstance(prompt, str) else orjson.dumps(prompt).decode()
+    return len(text) // 4 + 1
+
+class _PrioritySlots:
+    """Counting semaphore whose waiters are woken by (priority, arrival order). `limit` may change at runtime."""
+    def __init__(self, limit: int):
+        self.limit = int(limit)
+        self.in_use = 0
+        self._waiters = []   # heap of (priority, seq, future)
+        self._seq = count()
+
+    async def acquire(self, priority: int):
+        if self.in_use < self.limit and not self._waiters:
+            self.in_use += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # granted a slot just as we were cancelled: hand it on
+                self.release()
+            raise
+
+    def release(self):
+        self.in_use -= 1
+        self.wake()
+
+    def wake(self):
+        while self._waiters and self.in_use < self.limit:
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.cancelled():
+                continue
+            self.in_use += 1
+            fut.set_result(None)
+
+    def waiting(self) -> int:
+        return sum(1 for _, _, fut in self._waiters if not fut.cancelled())
+
+class _Budget:
+    """Per-model token buckets for requests/minute and tokens/minute (None = unlimited)."""
+    def __init__(self, rpm: Optional[float], tpm: Optional[float]):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm) if rpm else 0.0
+        self._tokens = float(tpm) if tpm else 0.0
+        self._stamp = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed, self._stamp = now - self._stamp, now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60.0)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60.0)
+
+    async def take(self, tokens: int):
+        # a request larger than the whole TPM budget waits for a full bucket instead of forever
+        tokens = min(tokens, self.tpm) if self.tpm else tokens
+        while True:
+            self._refill()
+            wait = 0.0
+            if self.rpm and self._requests < 1:
+                wait = max(wait, (1 - self._requests) * 60.0 / self.rpm)
+            if self.tpm and self._tokens < tokens:
+                wait = max(wait, (tokens - self._tokens) * 60.0 / self.tpm)
+            if wait <= 0:
+                if self.rpm:
+                    self._requests -= 1
+                if self.tpm:
+                    self._tokens -= tokens
+                return
+            await asyncio.sleep(wait)
+
+def _seconds(value) -> Optional[float]:
+    """Parse a rate-limit duration header: '20ms', '1.5s', '6m0s', '1h2m' or plain seconds."""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value)
+    if not parts:
+        return None
+    scale = {"ms": 1e-3, "s": 1.0, "m": 60.0, "h": 3600.0}
+    return sum(float(n) * scale[unit] for n, unit in parts)
+
+def _retry_after(response) -> Optional[float]:
+    if response is None:
+        return None
+    ms = _seconds(response.headers.get("retry-after-ms"))
+    if ms is not None:
+        return ms / 1000.0
+    return _seconds(response.headers.get("retry-after"))
+
+# -------- Shared LLM gateway --------
+class LLMGateway:
+    """
+    One process-wide entry point for OpenAI calls:
+      - a single AsyncOpenAI client on one tuned httpx connection pool
+      - a global concurrency limit (LLM_CONCURRENCY) shared by every pipeline
+      - per-model RPM/TPM budgets, from LLM_MODEL_LIMITS, e.g.
+        '{"gpt-4o": {"rpm": 5000, "tpm": 800000}, "*": {"rpm": 500}}' ("*" = any other model)
+      - priorities: when slots are contended, higher-priority callers go first
+      - retries: rate-limited and transient failures are re-queued, up to LLM_MAX_ATTEMPTS
+
+    With adaptive=True the concurrency limit follows AIMD: +1 slot per window of
+    successful requests, halved on a 429 (at most once per second, so one burst of
+    429s counts once). A 429's retry-after pauses every dispatch, not just the
+    failed request, and x-ratelimit-remaining-* headers clamp concurrency before the
+    server starts refusing. With adaptive=False, each failed request backs off on
+    its own (2^attempt * backoff_base), like the old tenacity decorators.
+    Pipelines get a named handle with caller(); see LLMCaller.
+    """
+    def __init__(self, concurrency: Optional[int] = None, model_limits: Optional[dict] = None,
+                 base_url: Optional[str] = None, adaptive: bool = True, max_attempts: Optional[int] = None,
+                 backoff_base: float = 1.0):
+        self.concurrency = int(concurrency or os.getenv("LLM_CONCURRENCY", "16"))
+        if model_limits is None:
+            model_limits = orjson.loads(os.getenv("LLM_MODEL_LIMITS", "{}"))
+        self.model_limits = model_limits
+        self.base_url = base_url
+        self.adaptive = adaptive
+        self.max_attempts = int(max_attempts or os.getenv("LLM_MAX_ATTEMPTS", "10"))
+        self.backoff_base = float(backoff_base)
+        self.slots = _PrioritySlots(self.concurrency)
+        self.ratelimit = {}   # latest x-ratelimit-* header values
+        self._budgets = {}
+        self._client = None
+        self._client_loop = None   # the event loop self._client's connections belong to
+        self._stats = {}      # caller -> counters
+        self._counters = {"ok": 0, "throttled": 0, "retried": 0, "failed": 0}
+        self._pause_until = 0.0
+        self._increase_credit = 0.0
+        self._last_decrease = 0.0
+        self._started = time.monotonic()
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        """
+        The shared client. httpx keeps its connections on the event loop that opened them, so
+        when another loop asks (e.g. a second asyncio.run()) the client is built again.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None   # built outside a loop: taken over by the first loop that uses it
+        if self._client is not None and self._client_loop is not None and loop is not None and loop is not self._client_loop:
+            self._client = None
+        if self._client is None:
+            # Limits/Timeout types come from the SDK so they match whichever httpx build it uses
+            limits = type(DEFAULT_CONNECTION_LIMITS)(max_connections=self.concurrency,
+                                                     max_keepalive_connections=self.concurrency, keepalive_expiry=60.0)
+            http_client = DefaultAsyncHttpxClient(
+                limits=limits,
+                timeout=Timeout(600.0, connect=10.0),
+                event_hooks={"response": [self._observe]},
+            )
+            # retries are scheduled here, not inside the SDK
+            self._client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=self.base_url,
+                                       http_client=http_client, max_retries=0)
+        if loop is not None:
+            self._client_loop = loop
+        return self._client
+
+    def caller(self, name: str, priority: int = PRIORITY_NORMAL) -> "LLMCaller":
+        return LLMCaller(self, name, priority)
+
+    def _budget(self, model: str) -> Optional[_Budget]:
+        if model not in self._budgets:
+            limits = self.model_limits.get(model, self.model_limits.get("*"))
+            self._budgets[model] = _Budget(limits.get("rpm"), limits.get("tpm")) if limits else None
+        return self._budgets[model]
+
+    @asynccontextmanager
+    async def slot(self, model: str, tokens: int = 0, priority: int = PRIORITY_NORMAL, caller: str = "default"):
+        """Hold one global concurrency slot and the model's rate budget for the duration of a request."""
+        stats = self._stats.setdefault(caller, {"calls": 0, "wait_s": 0.0, "busy_s": 0.0})
+        t0 = time.perf_counter()
+        await self.slots.acquire(priority)
+        try:
+            while (pause := self._pause_until - time.monotonic()) > 0:
+                await asyncio.sleep(pause)
+            budget = self._budget(model)
+            if budget is not None:
+                await budget.take(tokens)
+            t1 = time.perf_counter()
+            stats["wait_s"] += t1 - t0
+            yield
+        finally:
+            self.slots.release()
+            stats["calls"] += 1
+            stats["busy_s"] += time.perf_counter() - t0
+
+    async def run(self, make_request, model: str, tokens: int = 0, priority: int = PRIORITY_NORMAL,
+                  caller: str = "default", stage: Optional[str] = None, template: Optional[str] = None):
+        """
+        Await make_request() (a zero-argument coroutine factory) under the limiter. Requests
+        that fail with a RETRYABLE_ERRORS error release their slot and are queued again.
+        The whole call, retries included, is recorded in Telemetry under `stage`.
+        """
+        with get_telemetry().track(model, stage, template, caller) as record:
+            for attempt in range(1, self.max_attempts + 1):
+                async with self.slot(model, tokens, priority, caller):
+                    try:
+                        result = await make_request()
+                    except RETRYABLE_ERRORS as e:
+                        error = e
+                    else:
+                        self._on_success()
+                        # raw SDK responses (vision/logprob calls) carry usage; call_gpt notes its own
+                        note_usage(getattr(result, "usage", None))
+                        record["ok"] = result is not None
+                        return result
+                delay = self._on_error(error, attempt)
+                if attempt == self.max_attempts:
+                    break
+                self._counters["retried"] += 1
+                record["retries"] += 1
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self._counters["failed"] += 1
+            raise error
+
+    async def call(self, prompt, model: str, priority: int = PRIORITY_NORMAL, caller: str = "default",
+                   stage: Optional[str] = None, template: Optional[str] = None, **kwargs):
+        """
+        call_gpt through the shared client, under the global limiter and retry scheduler.
+        Response-cache hits are answered first, without a slot, rate budget or AIMD credit.
+        """
+        cached = lookup_response(prompt, model, kwargs.get("resp_format"), kwargs.get("temperature"), kwargs.get("cache"))
+        if cached is not CACHE_MISS:
+            with get_telemetry().track(model, stage, template, caller) as record:
+                note_cache_hit(record)
+                record["ok"] = True
+            return cached
+        return await self.run(lambda: call_gpt(self.client, prompt, model, cache_checked=True, **kwargs),
+                              model, estimate_tokens(prompt), priority, caller, stage, template)
+
+    async def stream_items(self, prompt, model: str, resp_format, field: str, priority: int = PRIORITY_NORMAL,
+                           caller: str = "default", stage: Optional[str] = None, template: Optional[str] = None):
+        """
+        stream_gpt_items under the limiter: yields the elements of resp_format.<field> as they
+        close. A failed stream is re-queued only if it had not yielded anything yet.
+        Response-cache hits are replayed first, without a slot, as in call().
+        """
+        cached = lookup_response(prompt, model, resp_format)
+        if cached is not CACHE_MISS:
+            with get_telemetry().track(model, stage, template, caller) as record:
+                note_cache_hit(record)
+                record["ok"] = True
+            for item in getattr(cached, field):
+                yield item
+            return
+        with get_telemetry().track(model, stage, template, caller) as record:
+            for attempt in range(1, self.max_attempts + 1):
+                yielded = False
+                async with self.slot(model, estimate_tokens(prompt), priority, caller):
+                    try:
+                        async for item in stream_gpt_items(self.client, prompt, model, resp_format, field, record=record,
+                                                                  cache_checked=True):
+                            yielded = True
+                            yield item
+                    except RETRYABLE_ERRORS as e:
+                        if yielded:
+                            raise
+                        error = e
+                    else:
+                        self._on_success()
+                        record["ok"] = True
+                        return
+                delay = self._on_error(error, attempt)
+                if attempt == self.max_attempts:
+                    break
+                self._counters["retried"] += 1
+                record["retries"] += 1
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self._counters["failed"] += 1
+            raise error
+
+    # ---------- adaptive control ----------
+    def _on_success(self):
+        self._counters["ok"] += 1
+        if not self.adaptive or self.slots.limit >= self.concurrency:
+            return
+        # additive increase: one extra slot per `limit` successes
+        self._increase_credit += 1.0 / self.slots.limit
+        if self._increase_credit >= 1.0:
+            self._increase_credit -= 1.0
+            self.slots.limit += 1
+            self.slots.wake()
+
+    def _on_error(self, error: Exception, attempt: int) -> float:
+        """Record a failed attempt; return how long this request should wait before re-queueing."""
+        throttled = isinstance(error, RateLimitError)
+        if throttled:
+            self._counters["throttled"] += 1
+        retry_after = _retry_after(getattr(error, "response", None))
+        backoff = min(60.0, self.backoff_base * 2 ** (attempt - 1))
+        if not self.adaptive:
+            return backoff
+        if throttled:
+            now = time.monotonic()
+            if now - self._last_decrease > 1.0:
+                self.slots.limit = max(1, self.slots.limit // 2)
+                self._increase_credit = 0.0
+                self._last_decrease = now
+            # pause everyone once instead of letting each request back off blindly
+            self._pause_until = max(self._pause_until, now + (retry_after if retry_after is not None else backoff))
+            return 0.0
+        return retry_after if retry_after is not None else backoff * random.uniform(0.5, 1.0)
+
+    async def _observe(self, response):
+        """httpx response hook: track x-ratelimit-* headers and slow down before the server refuses."""
+        headers = response.headers
+        for name in ("remaining-requests", "remaining-tokens", "limit-requests", "limit-tokens"):
+            value = headers.get(f"x-ratelimit-{name}")
+            if value is not None:
+                self.ratelimit[name] = int(float(value))
+        if not self.adaptive or response.status_code == 429:
+            return
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is None:
+                continue
+            if int(float(remaining)) <= 0:
+                reset = _seconds(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset:
+                    self._pause_until = max(self._pause_until, time.monotonic() + reset)
+            elif kind == "requests" and int(float(remaining)) < self.slots.limit:
+                self.slots.limit = max(1, int(float(remaining)))
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self._started
+        return {"in_flight": self.slots.in_use, "waiting": self.slots.waiting(), "limit": self.slots.limit,
+                **self._counters, "goodput_rps": self._counters["ok"] / elapsed if elapsed else 0.0,
+                "ratelimit": dict(self.ratelimit),
+                "callers": {name: dict(s) for name, s in self._stats.items()}}
+
+    def report(self) -> str:
+        """One-line throughput summary."""
+        st = self.stats()
+        return (f"llm: {st['ok']} ok, {st['throttled']} throttled, {st['retried']} retried, {st['failed']} failed | "
+                f"{st['goodput_rps']:.2f} req/s | concurrency {st['limit']}/{self.concurrency}")
+
+class LLMCaller:
+    """A pipeline's handle on the gateway: `await self.llm(prompt, model, resp_format=...)`."""
+    def __init__(self, gateway: LLMGateway, name: str, priority: int):
+        self.gateway = gateway
+        self.name = name
+        self.priority = priority
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        return self.gateway.client
+
+    async def __call__(self, prompt, model: str, stage: Optional[str] = None, template: Optional[str] = None, **kwargs):
+        return await self.gateway.call(prompt, model, priority=self.priority, caller=self.name,
+                                       stage=stage, template=template, **kwargs)
+
+    def stream(self, prompt, model: str, resp_format, field: str, stage: Optional[str] = None,
+               template: Optional[str] = None):
+        """`async for item in self.llm.stream(prompt, model, ObservationResponse, "observations")`"""
+        return self.gateway.stream_items(prompt, model, resp_format, field, priority=self.priority, caller=self.name,
+                                         stage=stage, template=template)
+
+    def slot(self, model: str, prompt=""):
+        """For requests that do not go through call_gpt (e.g. vision/logprob calls); no retries."""
+        return self.gateway.slot(model, estimate_tokens(prompt), self.priority, self.name)
+
+    async def run(self, make_request, model: str, prompt="", stage: Optional[str] = None,
+                  template: Optional[str] = None):
+        """Like slot(), with the gateway's retry scheduling: `await self.llm.run(lambda: client.x(...), model)`."""
+        return await self.gateway.run(make_request, model, estimate_tokens(prompt), self.priority, self.name,
+                                      stage, template)
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+def get_gateway() -> LLMGateway:
+    """The process-wide LLMGateway, created on first use."""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = LLMGateway()
+    return _gateway
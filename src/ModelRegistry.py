@@ -0,0 +1,72 @@
+import atexit
+import threading
+
+# Process-wide cache of loaded SentenceTransformer models, keyed by (model name, device)
+_MODELS = {}
+# Process-wide encoder pools, keyed by (model name, device, workers)
+_POOLS = {}
+_LOCK = threading.Lock()
+# What device=None resolves to, found on first use
+_DEFAULT_DEVICE = None
+
+def resolve_device(device=None) -> str:
+    """
+    The concrete device for `device`: None becomes the one SentenceTransformer would pick
+    (cuda, then mps, then cpu), so device=None and that device share one cache entry.
+    """
+    global _DEFAULT_DEVICE
+    if device is not None:
+        return device
+    if _DEFAULT_DEVICE is None:
+        import torch
+        if torch.cuda.is_available():
+            _DEFAULT_DEVICE = "cuda"
+        elif torch.backends.mps.is_available():
+            _DEFAULT_DEVICE = "mps"
+        else:
+            _DEFAULT_DEVICE = "cpu"
+    return _DEFAULT_DEVICE
+
+def get_sentence_model(model_name: str = "all-MiniLM-L6-v2", device=None):
+    """
+    Return the shared SentenceTransformer for (model_name, device), loading it on first use.
+    sentence_transformers (and torch) are only imported when a model is actually needed.
+    """
+    device = resolve_device(device)
+    key = (model_name, device)
+    model = _MODELS.get(key)
+    if model is None:
+        with _LOCK:
+            model = _MODELS.get(key)
+            if model is None:
+                from sentence_transformers import SentenceTransformer
+                model = SentenceTransformer(model_name, device=device)
+                _MODELS[key] = model
+    return model
+
+def get_encoder_pool(model_name: str = "all-MiniLM-L6-v2", device=None, workers=None):
+    """
+    Return the shared EncoderPool for (model_name, device, workers), starting its worker
+    processes on first use. Pools are shut down at interpreter exit.
+    """
+    device = resolve_device(device)
+    key = (model_name, device, workers)
+    pool = _POOLS.get(key)
+    if pool is None:
+        with _LOCK:
+            pool = _POOLS.get(key)
+            if pool is None:
+                from EncoderPool import EncoderPool
+                pool = EncoderPool(model_name, device=device, workers=workers)
+                _POOLS[key] = pool
+    return pool
+
+@atexit.register
+def _close_pools():
+    for pool in _POOLS.values():
+        pool.close()
+    _POOLS.clear()
+
+def loaded_models():
+    """(model name, device) keys of the models loaded so far."""
+    return list(_MODELS)
@@ -2,13 +2,14 @@ import json
 import stat 
 from prompts import need_finder, observation_filters
 from response_formats import NeedResponse, ObservationIDResponse, ScoredNeedResponse
-from utils import call_gpt, call_gpt_logprobs
+from utils import call_gpt_logprobs
 import os 
 import random
 import numpy as np
 import orjson
 import asyncio 
-from openai import AsyncOpenAI
+from LLMGateway import get_gateway
+from BatchRunner import get_batch_backend, run_batch
 from dotenv import load_dotenv
 from collections import deque
 from typing import List, Dict
@@ -23,8 +24,9 @@ class NeedPredictor():
             self.data = {i['id']: i for i in self.data}
         self.user = user
         self.model = model
-        self.client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        self._sem = asyncio.Semaphore(int(os.getenv("LLM_CONCURRENCY", "16")))
+        self.llm = get_gateway().caller("NeedPredictor")
+        # scoring passes go through the Batch API when LLM_BATCH_BACKEND is set
+        self.batch_backend = get_batch_backend()
     @staticmethod
     def format_observation(observation: Dict) -> str:
         return f"Observation ID {observation['id']}: {observation['description']}\nEvidence: {observation['evidence']}"
@@ -60,21 +62,19 @@ class NeedPredictor():
             else:
                 all_observations.append(f"ID {nid}: {self.data[nid]['description']}\nEvidence: {self.data[nid]['evidence']}")
         input_prompt = observation_filters.SELECTION_PROMPT.format(selected=selected, body='\n'.join(all_observations))
-        resp = await self._guarded_call(self.client, input_prompt, "gpt-4o", resp_format=ObservationIDResponse)
+        resp = await self.llm(input_prompt, "gpt-4o", resp_format=ObservationIDResponse,
+                              stage="select", template="observation_filters.SELECTION_PROMPT")
         return resp.observations
 
 
-    async def _guarded_call(self, *args, **kwargs):
-        async with self._sem:
-            return await call_gpt(*args, **kwargs)
-        
     async def generate_needs(self, observations): 
         if isinstance(observations, str):
             formatted_obs = observations
         else:
             formatted_obs = '\n'.join(observations)
         input_prompt = need_finder.NEEDFINDER_PROMPT.format(user_name=self.user, input=formatted_obs)
-        resp = await self._guarded_call(self.client, input_prompt, "o4-mini", resp_format=NeedResponse)
+        resp = await self.llm(input_prompt, "o4-mini", resp_format=NeedResponse,
+                              stage="needs", template="need_finder.NEEDFINDER_PROMPT")
         return resp 
     
     async def recognize_needs(self, observations, options):
@@ -83,7 +83,8 @@ class NeedPredictor():
         else:
             formatted_obs = '\n'.join(observations)
         input_prompt = need_finder.NEED_RECOG_PROMPT.format(user_name=self.user, input=formatted_obs, statements=options)
-        resp = await call_gpt_logprobs(self.client, input_prompt, "gpt-4o")
+        resp = await self.llm.run(lambda: call_gpt_logprobs(self.llm.client, input_prompt, "gpt-4o"), "gpt-4o", input_prompt,
+                                  stage="recognize", template="need_finder.NEED_RECOG_PROMPT")
         return resp 
     
     def apply_filter(self, nodes: List[str]) -> Dict:
@@ -96,7 +97,7 @@ class NeedPredictor():
         return observations
 
     async def score_needs(self, needs: List[Dict]):
-        tasks = []
+        prompts = []
         for need in needs['needs']:
             related_observations = need['related_observations']
             support = []
@@ -117,8 +118,14 @@ class NeedPredictor():
             fmt_support = "\n".join(support)
             input_prompt = need_finder.SCORE_NEEDS_PROMPT.format(need=need['need'], observations=fmt_support)
             print(input_prompt)
-            tasks.append(self._guarded_call(self.client, input_prompt, "gpt-4o", resp_format=ScoredNeedResponse))
-        resps = await asyncio.gather(*tasks, return_exceptions=True) 
+            prompts.append(input_prompt)
+        if self.batch_backend is not None:
+            resps = await run_batch([(p, "gpt-4o", ScoredNeedResponse) for p in prompts], self.batch_backend,
+                                    stage="score", template="need_finder.SCORE_NEEDS_PROMPT", caller=self.llm.name)
+        else:
+            resps = await asyncio.gather(*[self.llm(p, "gpt-4o", resp_format=ScoredNeedResponse, stage="score",
+                                                  template="need_finder.SCORE_NEEDS_PROMPT") for p in prompts],
+                                         return_exceptions=True)
         scored_needs = []
 
         for r, need in zip(resps, needs['needs']):
@@ -13,8 +13,9 @@ import numpy as np
 import re
 import uuid
 import orjson
-from utils import call_gpt, get_openai_embeddings
-from openai import AsyncOpenAI, OpenAI
+from utils import get_openai_embeddings
+from openai import OpenAI
+from LLMGateway import get_gateway
 from prompts import need_finder, reflection_module, observer, gum, test_dataset
 from response_formats import RelationsResponse, InsightResponse, ClusterResponse, CohesionResponse, DuplicateResponse, GeneralJudge
 from dotenv import load_dotenv
@@ -30,14 +31,15 @@ class Observer():
         self.model = model
         self.count = 0 
         self.name = params['name']
-        self.client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.llm = get_gateway().caller("Observer")
         self.sync_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
         self.sim_threshold = 0.8
         self.embed_store = EmbeddingsStore(
             st_model_name="all-MiniLM-L6-v2",
             sim_threshold=self.sim_threshold,
             device="cpu",
-            ann_max=int(os.getenv("ANN_MAX_ELEMENTS", "200000"))
+            ann_max=int(os.getenv("ANN_MAX_ELEMENTS", "200000")),
+            cache_dir=os.getenv("EMB_CACHE_DIR")
         )
         # Speed/quality knobs
         self.need_index = BM25NeedsIndex({})
@@ -49,7 +51,6 @@ class Observer():
             'text_image': need_finder.NEEDFINDING_TEXT_IMAGE_PROMPT
         }
         self.all_needs = {}
-        self._sem = asyncio.Semaphore(int(os.getenv("LLM_CONCURRENCY", "16")))
         self.timestamp = time.strftime("%Y%m%d")
 
 
@@ -62,10 +63,6 @@ class Observer():
         query = self._query_text(q)
         return self.need_index.search(query, top_k=top_k)
 
-    async def _guarded_call(self, *args, **kwargs):
-        async with self._sem:
-            return await call_gpt(*args, **kwargs)
-
     def _exists_id(self, nid: str) -> bool:
         return nid in self.all_needs
 
@@ -122,7 +119,7 @@ class Observer():
 
         return list(clusters.values())
 
-    async def cluster_observations(self, observations: List[dict], seed: List[str] = [], existing_clusters: List[dict] = []) -> List[dict]:
+    def _cluster_prompt(self, observations: List[dict], seed: List[str] = [], existing_clusters: List[dict] = []) -> str:
         fmt_observations = self._format_observations(observations)
         if len(seed) > 0:
             prompt = observer.LLM_CLUSTER_PROMPT_SEED.format(observations=fmt_observations, seed=seed, user_name=self.name)
@@ -133,9 +130,42 @@ class Observer():
                 prompt = observer.LLM_CLUSTER_PROMPT_UPDATE.format(observations=fmt_observations, existing_clusters=fmt_existing, user_name=self.name)
             else:
                 prompt = observer.LLM_CLUSTER_PROMPT.format(observations=fmt_observations, user_name=self.name)
-        resp = await self._guarded_call(self.client, prompt, self.model, resp_format=ClusterResponse) 
+        return prompt
+
+    async def cluster_observations(self, observations: List[dict], seed: List[str] = [], existing_clusters: List[dict] = []) -> List[dict]:
+        prompt = self._cluster_prompt(observations, seed, existing_clusters)
+        resp = await self.llm(prompt, self.model, resp_format=ClusterResponse,
+                              stage="cluster", template="observer.LLM_CLUSTER_PROMPT")
         clusters = resp.clusters
         return clusters 
+
+    def cluster_observations_stream(self, observations: List[dict], seed: List[str] = [], existing_clusters: List[dict] = []):
+        """Like cluster_observations, but yields each cluster as soon as the model finishes writing it."""
+        prompt = self._cluster_prompt(observations, seed, existing_clusters)
+        return self.llm.stream(prompt, self.model, ClusterResponse, "clusters",
+                               stage="cluster", template="observer.LLM_CLUSTER_PROMPT")
+
+    async def _judge_cluster(self, insight_task, cluster, output_observations: Dict, insights: List[dict]):
+        """Start the cohesion/duplicate judges for one cluster's insights as soon as its insight call returns."""
+        try:
+            r = await insight_task
+        except Exception as e:
+            return e, [], []
+        cohesion_tasks = []
+        duplicate_tasks = []
+        for observation in r.observations:
+            merged_obs = [output_observations[str(x)] for x in cluster.members if str(x) in output_observations]
+            input_obs = [x['description'] for x in merged_obs]
+            cohesion_prompt = observer.JUDGE_COHESION_PROMPT.format(observations='\n'.join(input_obs), grouping=observation.description)
+            cohesion_tasks.append(asyncio.ensure_future(self.llm(cohesion_prompt, "gpt-5", resp_format=CohesionResponse,
+                stage="cohesion", template="observer.JUDGE_COHESION_PROMPT")))
+
+            if len(insights) > 0:
+                fmt_insights = self.format_insights(insights)
+                duplicate_prompt = observer.JUDGE_DUPLICATE_PROMPT.format(new_insight=observation.description, existing_insights=fmt_insights)
+                duplicate_tasks.append(asyncio.ensure_future(self.llm(duplicate_prompt, "gpt-5", resp_format=DuplicateResponse,
+                    stage="duplicate", template="observer.JUDGE_DUPLICATE_PROMPT")))
+        return r, cohesion_tasks, duplicate_tasks
         
     async def get_insights(self, clusters: List[dict], output_observations: Dict) -> List[dict]:
         tasks = []
@@ -143,7 +173,8 @@ class Observer():
             members = [output_observations[str(member)] for member in cluster.members]
             fmt_observations = self._format_observations(members)
             prompt = observer.LLM_INSIGHT_PROMPT.format(observations=fmt_observations, reasoning=cluster.evidence)
-            tasks.append(self._guarded_call(self.client, prompt, "gpt-5", resp_format=InsightResponse))
+            tasks.append(self.llm(prompt, "gpt-5", resp_format=InsightResponse,
+                                  stage="insight", template="observer.LLM_INSIGHT_PROMPT"))
         resps = await asyncio.gather(*tasks, return_exceptions=True)
         return resps
 
@@ -155,7 +186,8 @@ class Observer():
         for insight in insights:
             new_insight = f"{insight['description']}\nEvidence: {insight['evidence']}"
             prompt = observer.JUDGE_INTERESTING_PROMPT.format(new_insight=new_insight)
-            tasks.append(self._guarded_call(self.client, prompt, "gpt-5", resp_format=GeneralJudge))
+            tasks.append(self.llm(prompt, "gpt-5", resp_format=GeneralJudge,
+                                  stage="judge", template="observer.JUDGE_INTERESTING_PROMPT"))
         resps = await asyncio.gather(*tasks, return_exceptions=True)
         return resps
 
@@ -200,34 +232,25 @@ class Observer():
         is_saturated = False
 
         while(count < num_iterations and not is_saturated):
-            tasks = []
-            clusters = await self.cluster_observations(observations, seed, existing_clusters=insights)
-            for cluster in clusters:
+            # Clusters stream in; each one's insight call (and then its cohesion/duplicate
+            # judges) starts while the model is still writing the remaining clusters
+            clusters = []
+            judged = []
+            async for cluster in self.cluster_observations_stream(observations, seed, existing_clusters=insights):
+                clusters.append(cluster)
                 members = [output_observations[str(member)] for member in cluster.members if str(member) in output_observations]
                 fmt_members = self._format_observations(members)
                 prompt = observer.LLM_INSIGHT_PROMPT.format(observations=fmt_members, reasoning=cluster.evidence)
-                tasks.append(self._guarded_call(self.client, prompt, self.model, resp_format=InsightResponse))
-            resps = await asyncio.gather(*tasks, return_exceptions=True)
+                insight_task = asyncio.ensure_future(self.llm(prompt, self.model, resp_format=InsightResponse,
+                    stage="insight", template="observer.LLM_INSIGHT_PROMPT"))
+                judged.append(asyncio.ensure_future(self._judge_cluster(insight_task, cluster, output_observations, insights)))
+            judged = await asyncio.gather(*judged)
+            resps = [r for r, _, _ in judged]
             new_observations = []
 
             # Judge Cohesion
-            cohesion_tasks = []
-            duplicate_tasks = []
-            for i, r in enumerate(resps):
-                for observation in r.observations:
-                    cluster_members = clusters[i].members
-                    merged_obs = [output_observations[str(x)] for x in cluster_members if str(x) in output_observations]
-                    input_obs = [x['description'] for x in merged_obs]
-                    cohesion_prompt = observer.JUDGE_COHESION_PROMPT.format(observations='\n'.join(input_obs), grouping=observation.description)
-                    cohesion_tasks.append(self._guarded_call(self.client, cohesion_prompt, "gpt-5", resp_format=CohesionResponse))
-                    
-                    if len(insights) > 0:
-                        fmt_insights = self.format_insights(insights)
-                        duplicate_prompt = observer.JUDGE_DUPLICATE_PROMPT.format(new_insight=observation.description, existing_insights=fmt_insights)
-                        duplicate_tasks.append(self._guarded_call(self.client, duplicate_prompt, "gpt-5", resp_format=DuplicateResponse))
-
-            cohesion_resps = await asyncio.gather(*cohesion_tasks, return_exceptions=True)
-            duplicate_resps = await asyncio.gather(*duplicate_tasks, return_exceptions=True)
+            cohesion_resps = await asyncio.gather(*[t for _, c, _ in judged for t in c], return_exceptions=True)
+            duplicate_resps = await asyncio.gather(*[t for _, _, d in judged for t in d], return_exceptions=True)
 
             # SAVE OBSERVATIONS
             num_duplicates = 0
@@ -351,7 +374,8 @@ class Observer():
                 members = [output_observations[str(member)] for member in cluster.members if str(member) in output_observations]
                 fmt_members = self._format_observations(members)
                 prompt = observer.LLM_INSIGHT_PROMPT.format(observations=fmt_members, reasoning=cluster.evidence)
-                tasks.append(self._guarded_call(self.client, prompt, self.model, resp_format=InsightResponse))
+                tasks.append(self.llm(prompt, self.model, resp_format=InsightResponse,
+                                      stage="insight", template="observer.LLM_INSIGHT_PROMPT"))
             resps = await asyncio.gather(*tasks, return_exceptions=True)
             new_observations = []
 
@@ -363,7 +387,8 @@ class Observer():
                     merged_obs = [output_observations[str(x)] for x in cluster_members if str(x) in output_observations]
                     input_obs = [x['description'] for x in merged_obs]
                     cohesion_prompt = observer.JUDGE_COHESION_PROMPT.format(observations='\n'.join(input_obs), grouping=observation.description)
-                    cohesion_tasks.append(self._guarded_call(self.client, cohesion_prompt, "gpt-4o", resp_format=CohesionResponse))
+                    cohesion_tasks.append(self.llm(cohesion_prompt, "gpt-4o", resp_format=CohesionResponse,
+                                                   stage="cohesion", template="observer.JUDGE_COHESION_PROMPT"))
             cohesion_resps = await asyncio.gather(*cohesion_tasks, return_exceptions=True)
 
             # SAVE OBSERVATIONS
@@ -499,7 +524,7 @@ class Observer():
     #     while(len(observations) >= 2 and count < max_iters):
     #         fmt_observations = self._format_observations(observations)
     #         prompt = observer.LLM_CLUSTER_PROMPT.format(observations=fmt_observations)
-    #         resp = await self._guarded_call(self.client, prompt, self.model, resp_format=ClusterResponse) 
+    #         resp = await self.llm(prompt, self.model, resp_format=ClusterResponse) 
     #         print(resp)
     #         tasks = []
     #         clusters = resp.clusters
@@ -588,7 +613,7 @@ class Observer():
             for member in clusters[c]:
                 fmt_members.append(f"ID {member['id']} | {member['text']}")
             prompt = observer.LLM_INSIGHT_PROMPT.format(observations=fmt_members)
-            tasks.append(self._guarded_call(self.client, prompt, self.model, resp_format=InsightResponse))
+            tasks.append(self.llm(prompt, self.model, resp_format=InsightResponse))
         resps = await asyncio.gather(*tasks, return_exceptions=True)
         print(resps)
         for resp, c in zip(resps, clusters):
@@ -702,7 +727,7 @@ if __name__ == "__main__":
 
                 #     # INTRUSION TEST
                 #     prompt = observer.INTRUSION_TEST.format(observations=formatted_merged_obs)
-                #     intrusion_tasks.append(self._guarded_call(self.client, prompt, "gpt-4o", resp_format=IntrusionResponse))
+                #     intrusion_tasks.append(self.llm(prompt, "gpt-4o", resp_format=IntrusionResponse))
                 # intrusion_resps = await asyncio.gather(*intrusion_tasks, return_exceptions=True)
                 # for intrusion_resp, observation in zip(intrusion_resps, r.observations):
                     is_general, is_cohesive = True, True
@@ -1,8 +1,8 @@
 import argparse
 from response_formats import GoalResponse, PatternInductionResponse, PatternJudgeResponse
 from prompts import tool_spec
-from utils import call_gpt
-from openai import AsyncOpenAI
+from LLMGateway import get_gateway, PRIORITY_LOW
+from BatchRunner import get_batch_backend, run_batch
 import os, json, time
 import asyncio
 import orjson
@@ -15,36 +15,50 @@ class PoppinsPipeline:
     def __init__(self, model, params, user, context):
         self.model = model
         self.params = params
-        self.client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.llm = get_gateway().caller("PoppinsPipeline", priority=PRIORITY_LOW)
         self.context = context
         self.fmt_goals = ""
         self.user = user
+        # judge passes go through the Batch API when LLM_BATCH_BACKEND is set
+        self.batch_backend = get_batch_backend()
 
     def format_goals(self, goals):
         self.fmt_goals = '\n'.join([f"{i.goal}: {i.description}" for i in goals])
     async def generate_goals(self):
         prompt = tool_spec.GOAL_INDUCTION_PROMPT.format(context=self.context, limit=3)
-        resp = await call_gpt(self.client, prompt, self.model, resp_format=GoalResponse)
+        resp = await self.llm(prompt, self.model, resp_format=GoalResponse,
+                              stage="goals", template="tool_spec.GOAL_INDUCTION_PROMPT")
 
         return resp
 
     async def generate_tools(self):
         prompt = tool_spec.PATTERN_INDUCTION_PROMPT.format(context=self.context, \
             goals=self.fmt_goals, limit=10, user=self.user, json_schema=tool_spec.PATTERN_INDUCTION_JSON_SCHEMA)
-        resp = await call_gpt(self.client, prompt, self.model, resp_format=PatternInductionResponse)
+        resp = await self.llm(prompt, self.model, resp_format=PatternInductionResponse,
+                              stage="tools", template="tool_spec.PATTERN_INDUCTION_PROMPT")
         return resp
 
     async def generate_tools_needs(self, needs):
         prompt = tool_spec.PATTERN_INDUCTION_PROMPT_NEEDS.format(context=self.context, goals=self.fmt_goals, needs=needs, \
             limit=10, user=self.user, json_schema=tool_spec.PATTERN_INDUCTION_JSON_SCHEMA)
-        resp = await call_gpt(self.client, prompt, self.model, resp_format=PatternInductionResponse)
+        resp = await self.llm(prompt, self.model, resp_format=PatternInductionResponse,
+                              stage="tools", template="tool_spec.PATTERN_INDUCTION_PROMPT_NEEDS")
         return resp
 
     async def judge_tools(self, tool, needs):
         prompt = tool_spec.PATTERN_JUDGE.format(design_pattern=tool, user_need=needs)
-        resp = await call_gpt(self.client, prompt, self.model, resp_format=PatternJudgeResponse)
+        resp = await self.llm(prompt, self.model, resp_format=PatternJudgeResponse,
+                              stage="judge", template="tool_spec.PATTERN_JUDGE")
         return resp
 
+    async def judge_tools_many(self, tools, needs):
+        """judge_tools for every tool; one Batch API job when a batch backend is configured."""
+        if self.batch_backend is None:
+            return await asyncio.gather(*[self.judge_tools(tool=tool, needs=needs) for tool in tools])
+        prompts = [tool_spec.PATTERN_JUDGE.format(design_pattern=tool, user_need=needs) for tool in tools]
+        return await run_batch([(p, self.model, PatternJudgeResponse) for p in prompts], self.batch_backend,
+                               stage="judge", template="tool_spec.PATTERN_JUDGE", caller=self.llm.name)
+
 
 async def evaluate(filename: str, model: str, fidx: str, timestep: str, is_annotated: int):
     eval_file = json.load(open(filename, 'r'))
@@ -65,10 +79,7 @@ async def evaluate(filename: str, model: str, fidx: str, timestep: str, is_annot
         else:   
             fmt_needs = '\n'.join([f"Need: {i['need']} | Reasoning: {i['reasoning']}" for i in needs])
         print(fmt_needs)
-        tasks = []
-        for tool in tools['patterns']:
-            tasks.append(pipeline.judge_tools(tool=tool, needs=fmt_needs))
-        resp = await asyncio.gather(*tasks)
+        resp = await pipeline.judge_tools_many(tools['patterns'], fmt_needs)
 
         for idx, r in enumerate(resp):
             tools['patterns'][idx]['judge'] = r.response
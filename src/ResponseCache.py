@@ -0,0 +1,206 @@
+from typing import Any, Optional
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import orjson
+
+# Schema of the SQLite file; bump when the table layout or key derivation changes
+RESPONSE_CACHE_VERSION = 1
+
+# Returned by ResponseCache.get on a miss, distinct from any cached value
+CACHE_MISS = object()
+
+class ResponseCacheMiss(LookupError):
+    """Raised in replay mode when a prompt has no cached response."""
+
+def schema_of(resp_format) -> Any:
+    """JSON-serializable description of a response format: the pydantic JSON schema, or "text"."""
+    if resp_format is None:
+        return "text"
+    return resp_format.model_json_schema()
+
+class ResponseCache:
+    """
+    Persistent cache of LLM responses in one SQLite file.
+
+    A key is sha256 over (model, prompt, response-format schema, temperature), so
+    changing any field of a pydantic response model invalidates its entries. Text
+    responses are stored as-is and structured ones as the model's JSON, revalidated
+    against resp_format on the way out.
+
+    mode:
+      "readwrite"  look up, and store every fresh response (default)
+      "replay"     read-only; a miss raises ResponseCacheMiss instead of calling the API,
+                   which makes reruns deterministic and lets tests run offline
+    Entries older than `ttl` seconds are ignored and evicted; past `max_entries`, the
+    least recently used entries are dropped. A hit only reads: its last_used time is
+    buffered and written with the next put() or evict(), or once `touch_every` hits are
+    pending. Safe to share across asyncio tasks and threads; WAL mode lets several
+    processes read while one writes.
+    """
+    def __init__(self, path: str, mode: str = "readwrite", ttl: Optional[float] = None,
+                 max_entries: Optional[int] = None, evict_every: int = 256, touch_every: int = 256):
+        if mode not in ("readwrite", "replay"):
+            raise ValueError(f"Unknown response cache mode '{mode}' (use 'readwrite' or 'replay').")
+        self.path = path
+        self.mode = mode
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evict_every = int(evict_every)
+        self.touch_every = int(touch_every)
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._puts_since_evict = 0
+        self._touched = {}   # key -> last hit time, not written yet
+        if mode == "replay":
+            self._db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, model TEXT, created REAL, last_used REAL, payload BLOB)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)")
+            self._db.execute(f"PRAGMA user_version={RESPONSE_CACHE_VERSION}")
+            self._db.commit()
+            self.evict()
+        version = self._db.execute("PRAGMA user_version").fetchone()[0]
+        if version != RESPONSE_CACHE_VERSION:
+            raise ValueError(f"Response cache at {path} has version {version}, expected {RESPONSE_CACHE_VERSION}.")
+
+    # ---------- public API ----------
+    @staticmethod
+    def key(model: str, prompt, resp_format=None, temperature: Optional[float] = None) -> str:
+        blob = orjson.dumps([RESPONSE_CACHE_VERSION, model, prompt, schema_of(resp_format), temperature],
+                            option=orjson.OPT_SORT_KEYS)
+        return hashlib.sha256(blob).hexdigest()
+
+    def get(self, key: str, resp_format=None):
+        """Cached response for key (a resp_format instance or str), or CACHE_MISS."""
+        with self._lock:
+            row = self._db.execute("SELECT created, payload FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and row[0] < time.time() - self.ttl:
+                row = None
+            if row is None:
+                self.misses += 1
+                if self.mode == "replay":
+                    raise ResponseCacheMiss(key)
+                return CACHE_MISS
+            self.hits += 1
+            if self.mode == "readwrite":
+                self._touched[key] = time.time()
+                if len(self._touched) >= self.touch_every:
+                    self._write_touched()
+                    self._db.commit()
+        payload = orjson.loads(row[1])
+        if resp_format is None:
+            return payload
+        return resp_format.model_validate(payload)
+
+    def put(self, key: str, model: str, response) -> None:
+        """Store a fresh response (str or pydantic model). No-op in replay mode."""
+        if self.mode == "replay":
+            return
+        payload = orjson.dumps(response.model_dump(mode="json") if hasattr(response, "model_dump") else response)
+        now = time.time()
+        with self._lock:
+            self._write_touched()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, model, created, last_used, payload) VALUES (?, ?, ?, ?, ?)",
+                (key, model, now, now, payload),
+            )
+            self._db.commit()
+            self.writes += 1
+            self._puts_since_evict += 1
+            due = self._puts_since_evict >= self.evict_every
+        if due:
+            self.evict()
+
+    def evict(self) -> int:
+        """Drop expired entries and trim to max_entries (least recently used first)."""
+        if self.mode == "replay":
+            return 0
+        removed = 0
+        with self._lock:
+            self._write_touched()   # LRU order needs the buffered hits
+            if self.ttl is not None:
+                removed += self._db.execute("DELETE FROM responses WHERE created < ?",
+                                            (time.time() - self.ttl,)).rowcount
+            if self.max_entries is not None:
+                removed += self._db.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    " SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (int(self.max_entries),),
+                ).rowcount
+            self._db.commit()
+            self._puts_since_evict = 0
+            self.evictions += removed
+        return removed
+
+    def flush(self) -> None:
+        """Write the buffered last_used times."""
+        with self._lock:
+            if self._touched:
+                self._write_touched()
+                self._db.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0,
+                "writes": self.writes, "evictions": self.evictions, "entries": len(self)}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._db.close()
+
+    # ---------- internals ----------
+    def _write_touched(self) -> None:
+        # caller holds self._lock and commits
+        if self._touched:
+            self._db.executemany("UPDATE responses SET last_used = ? WHERE key = ?",
+                                 [(t, k) for k, t in self._touched.items()])
+            self._touched.clear()
+
+# -------- process-wide default, configured from the environment --------
+_default = None
+_default_lock = threading.Lock()
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    Shared cache used by utils.call_gpt, or None when caching is off. Configured by
+    LLM_CACHE_PATH (enables it), LLM_CACHE_MODE (readwrite|replay), LLM_CACHE_TTL
+    (seconds) and LLM_CACHE_MAX_ENTRIES, unless set_response_cache() was called first.
+    """
+    global _default
+    if _default is None and os.getenv("LLM_CACHE_PATH"):
+        with _default_lock:
+            if _default is None:
+                ttl = os.getenv("LLM_CACHE_TTL")
+                max_entries = os.getenv("LLM_CACHE_MAX_ENTRIES")
+                _default = ResponseCache(
+                    os.environ["LLM_CACHE_PATH"],
+                    mode=os.getenv("LLM_CACHE_MODE", "readwrite"),
+                    ttl=float(ttl) if ttl else None,
+                    max_entries=int(max_entries) if max_entries else None,
+                )
+                # keep the last hits' recency
+                atexit.register(_default.flush)
+    return _default
+
+def set_response_cache(cache: Optional[ResponseCache]) -> None:
+    """Install the cache used by utils.call_gpt (None falls back to the LLM_CACHE_* environment)."""
+    global _default
+    _default = cache
@@ -0,0 +1,183 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+import atexit
+import os
+import threading
+import time
+import orjson
+
+# Latency histogram buckets (seconds) and token-count buckets, Prometheus-style upper bounds
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128)
+TOKEN_BUCKETS = (64, 256, 1024, 4096, 16384, 65536)
+
+# USD per 1M (input, output) tokens; override or extend with LLM_PRICES='{"model": [in, out]}'
+DEFAULT_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-5": (1.25, 10.00),
+    "o3": (2.00, 8.00),
+    "o4-mini": (1.10, 4.40),
+}
+
+# The record of the LLM call running in the current task; filled in by call_gpt & co.
+_current = ContextVar("llm_call", default=None)
+
+def note_usage(usage, call: Optional[dict] = None) -> None:
+    """Record token usage from an OpenAI response (chat.completions or responses) on `call` or the current one."""
+    call = call if call is not None else _current.get()
+    if call is None or usage is None:
+        return
+    call["input_tokens"] += getattr(usage, "input_tokens", None) or getattr(usage, "prompt_tokens", 0) or 0
+    call["output_tokens"] += getattr(usage, "output_tokens", None) or getattr(usage, "completion_tokens", 0) or 0
+
+def note_cache_hit(call: Optional[dict] = None) -> None:
+    call = call if call is not None else _current.get()
+    if call is not None:
+        call["cache_hit"] = True
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # last slot = +Inf
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += value
+        self.n += 1
+
+class Telemetry:
+    """
+    Per-call LLM accounting: model, stage, prompt template, input/output tokens, latency
+    (queueing included), retries, cache hits and estimated cost. Every call is appended
+    to `<out_dir>/llm_calls.jsonl` as it finishes; per-(stage, model) histograms and
+    counters are written to `<out_dir>/llm_metrics.prom` in Prometheus text format by
+    flush() (also at exit). Without out_dir, only the in-memory aggregates are kept.
+    """
+    def __init__(self, out_dir: Optional[str] = None, prices: Optional[dict] = None):
+        self.out_dir = out_dir
+        self.prices = dict(DEFAULT_PRICES)
+        self.prices.update(prices if prices is not None else orjson.loads(os.getenv("LLM_PRICES", "{}")))
+        self._lock = threading.Lock()
+        self._series = {}   # (stage, model) -> aggregates
+        self._jsonl = None
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+            self._jsonl = open(os.path.join(out_dir, "llm_calls.jsonl"), "ab")
+
+    @contextmanager
+    def track(self, model: str, stage: Optional[str] = None, template: Optional[str] = None, caller: str = "default"):
+        """Wrap one logical LLM call (all its retries). Yields the record, which the gateway and call_gpt fill in."""
+        call = self.new_call(model, stage, template, caller)
+        token = _current.set(call)
+        t0 = time.perf_counter()
+        try:
+            yield call
+        finally:
+            try:
+                _current.reset(token)
+            except ValueError:
+                # an async generator finalized from another context; nothing to restore there
+                pass
+            call["latency_s"] = time.perf_counter() - t0
+            self.record(call)
+
+    @staticmethod
+    def new_call(model: str, stage: Optional[str] = None, template: Optional[str] = None, caller: str = "default") -> dict:
+        """An empty call record, for calls that are not wrapped in track() (e.g. Batch API requests)."""
+        return {"ts": time.time(), "caller": caller, "stage": stage or "other", "template": template, "model": model,
+                "input_tokens": 0, "output_tokens": 0, "retries": 0, "cache_hit": False, "ok": False}
+
+    def record(self, call: dict) -> None:
+        price_in, price_out = self.prices.get(call["model"], (0.0, 0.0))
+        call["cost_usd"] = (call["input_tokens"] * price_in + call["output_tokens"] * price_out) / 1e6
+        with self._lock:
+            s = self._series.get((call["stage"], call["model"]))
+            if s is None:
+                s = self._series[(call["stage"], call["model"])] = {
+                    "latency": _Histogram(LATENCY_BUCKETS), "input": _Histogram(TOKEN_BUCKETS),
+                    "output": _Histogram(TOKEN_BUCKETS), "calls": 0, "errors": 0, "cache_hits": 0,
+                    "retries": 0, "cost_usd": 0.0}
+            s["calls"] += 1
+            s["errors"] += not call["ok"]
+            s["cache_hits"] += call["cache_hit"]
+            s["retries"] += call["retries"]
+            s["cost_usd"] += call["cost_usd"]
+            s["latency"].observe(call["latency_s"])
+            if not call["cache_hit"]:
+                s["input"].observe(call["input_tokens"])
+                s["output"].observe(call["output_tokens"])
+            if self._jsonl is not None:
+                self._jsonl.write(orjson.dumps(call) + b"\n")
+                self._jsonl.flush()
+
+    def summary(self) -> str:
+        """One line per (stage, model): calls, mean latency, tokens, cost; the most expensive first."""
+        with self._lock:
+            rows = sorted(self._series.items(), key=lambda kv: -kv[1]["latency"].total)
+            lines = []
+            for (stage, model), s in rows:
+                lat = s["latency"]
+                lines.append(f"{stage:<18} {model:<12} calls={s['calls']:<5} hits={s['cache_hits']:<4} "
+                             f"retries={s['retries']:<4} mean={lat.total / max(1, lat.n):6.2f}s total={lat.total:8.1f}s "
+                             f"in={int(s['input'].total):<8} out={int(s['output'].total):<8} ${s['cost_usd']:.4f}")
+        return "\n".join(lines)
+
+    def prometheus(self) -> str:
+        out = []
+        def histogram(name, help_text, key):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} histogram")
+            for (stage, model), s in self._series.items():
+                h = s[key]
+                labels = f'stage="{stage}",model="{model}"'
+                running = 0
+                for bound, count in zip(list(h.buckets) + ["+Inf"], h.counts):
+                    running += count
+                    out.append(f'{name}_bucket{{{labels},le="{bound}"}} {running}')
+                out.append(f"{name}_sum{{{labels}}} {h.total}")
+                out.append(f"{name}_count{{{labels}}} {h.n}")
+        def counter(name, help_text, key):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} counter")
+            for (stage, model), s in self._series.items():
+                out.append(f'{name}{{stage="{stage}",model="{model}"}} {s[key]}')
+        with self._lock:
+            histogram("llm_request_latency_seconds", "Wall time per LLM call, queueing and retries included.", "latency")
+            histogram("llm_input_tokens", "Input tokens per (uncached) LLM call.", "input")
+            histogram("llm_output_tokens", "Output tokens per (uncached) LLM call.", "output")
+            counter("llm_calls_total", "LLM calls.", "calls")
+            counter("llm_errors_total", "LLM calls that failed after all retries.", "errors")
+            counter("llm_cache_hits_total", "LLM calls answered from the response cache.", "cache_hits")
+            counter("llm_retries_total", "Re-queued attempts.", "retries")
+            counter("llm_cost_usd_total", "Estimated spend (see Telemetry.prices).", "cost_usd")
+        return "\n".join(out) + "\n"
+
+    def flush(self) -> None:
+        """Rewrite llm_metrics.prom from the current aggregates."""
+        if not self.out_dir:
+            return
+        path = os.path.join(self.out_dir, "llm_metrics.prom")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(self.prometheus())
+        os.replace(path + ".tmp", path)
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+def get_telemetry() -> Telemetry:
+    """Process-wide Telemetry; files go to LLM_TELEMETRY_DIR when it is set."""
+    global _telemetry
+    if _telemetry is None:
+        with _telemetry_lock:
+            if _telemetry is None:
+                _telemetry = Telemetry(os.getenv("LLM_TELEMETRY_DIR"))
+                atexit.register(_telemetry.flush)
+    return _telemetry
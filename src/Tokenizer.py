@@ -0,0 +1,55 @@
+from typing import FrozenSet, Optional, Tuple
+from functools import lru_cache
+from itertools import filterfalse
+import os
+import re
+
+# NLTK's English stopword list, bundled so workers never need nltk.download()
+STOPWORDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stopwords_english.txt")
+
+# After lowercasing, a token is a maximal run of [a-z0-9]; everything else is a separator.
+# Equivalent to the old re.sub(r"[^a-z0-9\s]", " ") + re.findall(r"\w+") two-pass version.
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+@lru_cache(maxsize=None)
+def load_stopwords(path: str = STOPWORDS_FILE) -> FrozenSet[str]:
+    """Read the stopword file once per process; every index shares the returned frozenset."""
+    with open(path, "r", encoding="utf-8") as f:
+        return frozenset(line.strip() for line in f if line.strip())
+
+class Tokenizer:
+    """
+    Lowercase -> [a-z0-9]+ tokens -> stopword filter -> optional Porter stemming.
+    Results are memoized in an LRU keyed by the raw text, since evidence and
+    description strings are tokenized over and over.
+    """
+    def __init__(self, stopwords: Optional[FrozenSet[str]] = None, stem: bool = False, cache_size: int = 65_536):
+        self.stopwords = load_stopwords() if stopwords is None else frozenset(stopwords)
+        self.stem = stem
+        if stem:
+            try:
+                from nltk.stem import PorterStemmer
+            except ImportError as e:
+                raise ImportError("Tokenizer(stem=True) requires nltk (pip install nltk)") from e
+            self._stem_word = lru_cache(maxsize=cache_size)(PorterStemmer().stem)
+        self._cached = lru_cache(maxsize=cache_size)(self._tokenize)
+
+    def __call__(self, text: str) -> Tuple[str, ...]:
+        return self._cached(text)
+
+    def _tokenize(self, text: str) -> Tuple[str, ...]:
+        tokens = filterfalse(self.stopwords.__contains__, _TOKEN_RE.findall(text.lower()))
+        if self.stem:
+            return tuple(map(self._stem_word, tokens))
+        return tuple(tokens)
+
+    def cache_info(self):
+        return self._cached.cache_info()
+
+    def cache_clear(self) -> None:
+        self._cached.cache_clear()
+
+@lru_cache(maxsize=None)
+def default_tokenizer() -> Tokenizer:
+    """Process-wide tokenizer (and memo) shared by indexes that don't bring their own."""
+    return Tokenizer()
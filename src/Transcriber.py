@@ -1,3 +1,4 @@
+import hashlib
 import json
 import os
 import argparse
@@ -5,25 +6,34 @@ import asyncio
 import time
 import numpy as np
 import re
+import shutil
 import orjson
-import pdb
+import threading
+from collections import deque
+from typing import Optional
 from prompts import observer
 from response_formats import ObservationResponse, RelationsResponse
-from openai import AsyncOpenAI
+from LLMGateway import get_gateway
 from dotenv import load_dotenv
 from BM25 import BM25NeedsIndex
 from EmbeddingStore import EmbeddingsStore
-from utils import call_gpt
+from ResponseCache import get_response_cache
+from BatchRunner import get_batch_backend, run_batch
+from Telemetry import get_telemetry
+from FileManifest import FileManifest
+from DirWatcher import DirWatcher
 load_dotenv()
 
 class Transcriber():
-    def __init__(self, model: str, index: str, name: str, save_file: str):
+    def __init__(self, model: str, index: str, name: str, save_file: str, state_dir: Optional[str] = None):
         self.name = name
-        self.client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        self._sem = asyncio.Semaphore(int(os.getenv("LLM_CONCURRENCY", "16")))
+        self.llm = get_gateway().caller("Transcriber")
         self.all_actions = {}
         self.model = model
         self.index = index
+        # where _get_actions reads each window's files from
+        self.summaries_dir = f'/Users/dorazhao/Documents/modelgardens/src/infact_dataset/summaries/{index}'
+        self.transcripts_dir = f'/Users/dorazhao/Documents/modelgardens/src/infact_dataset/transcripts/{index}'
         self.actions_index = BM25NeedsIndex({})
         self.timestamp = time.strftime("%Y%m%d_%H%M%S")
         self.save_file = save_file
@@ -34,9 +44,87 @@ class Transcriber():
             st_model_name=st_model,
             sim_threshold=self.sim_threshold,
             device="cpu",
-            ann_max=int(os.getenv("ANN_MAX_ELEMENTS", "200000"))
+            ann_max=int(os.getenv("ANN_MAX_ELEMENTS", "200000")),
+            cache_dir=os.getenv("EMB_CACHE_DIR")
         )
+        # windows (by start file stem) already committed; persisted with the rest of the state
+        self.processed_windows = set()
+        # one FileManifest (single-scan stat metadata) per directory read, kept under state_dir
+        self._manifests = {}
+        self._manifest_lock = threading.Lock()
+        # observer_pipeline_batched sends its proposals through the Batch API when LLM_BATCH_BACKEND is set
+        self.batch_backend = get_batch_backend()
+        self.state_dir = state_dir
+        if state_dir and Transcriber._current_state(state_dir):
+            self.load_state(state_dir)
 
+    @staticmethod
+    def _current_state(state_dir: str) -> Optional[str]:
+        """Directory holding the last complete save_state() under state_dir, or None."""
+        pointer = os.path.join(state_dir, "CURRENT")
+        if os.path.exists(pointer):
+            with open(pointer, "r", encoding="utf-8") as f:
+                return os.path.join(state_dir, f.read().strip())
+        # layout written before saves were versioned
+        if os.path.exists(os.path.join(state_dir, "transcriber.json")):
+            return state_dir
+        return None
+
+    def save_state(self, state_dir: str):
+        """
+        Persist actions, BM25 index and embedding store so a restarted run can resume.
+        Every save goes to a new state-<n> subdirectory and the CURRENT file is switched
+        to it last, so a save interrupted part-way leaves the previous state in use.
+        """
+        os.makedirs(state_dir, exist_ok=True)
+        current = Transcriber._current_state(state_dir)
+        name = os.path.basename(current) if current else ""
+        n = int(name.split("-")[1]) + 1 if name.startswith("state-") else 1
+        target = os.path.join(state_dir, f"state-{n}")
+        shutil.rmtree(target, ignore_errors=True)   # left over from an interrupted save
+        os.makedirs(target)
+        self.actions_index.save(os.path.join(target, "bm25"))
+        self.embed_store.save(os.path.join(target, "embeddings"))
+        state = {"count": self.count, "processed_windows": sorted(self.processed_windows), "all_actions": self.all_actions}
+        with open(os.path.join(target, "transcriber.json"), "wb") as f:
+            f.write(orjson.dumps(state))
+        tmp = os.path.join(state_dir, "CURRENT.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(f"state-{n}")
+        os.replace(tmp, os.path.join(state_dir, "CURRENT"))
+        for old in os.listdir(state_dir):
+            if old.startswith("state-") and old != f"state-{n}":
+                shutil.rmtree(os.path.join(state_dir, old), ignore_errors=True)
+
+    def load_state(self, state_dir: str):
+        path = Transcriber._current_state(state_dir)
+        with open(os.path.join(path, "transcriber.json"), "rb") as f:
+            state = orjson.loads(f.read())
+        self.actions_index = BM25NeedsIndex.load(os.path.join(path, "bm25"))
+        self.embed_store.load(os.path.join(path, "embeddings"))
+        self.count = state["count"]
+        self.processed_windows = set(state["processed_windows"])
+        self.all_actions = state["all_actions"]
+        print(f"Resumed from {state_dir}: {len(self.all_actions)} actions, {len(self.processed_windows)} windows")
+
+    def _manifest(self, directory: str) -> FileManifest:
+        """The directory's FileManifest, loaded from (and saved to) state_dir when there is one."""
+        with self._manifest_lock:
+            manifest = self._manifests.get(directory)
+            if manifest is None:
+                path = None
+                if self.state_dir:
+                    key = hashlib.sha1(os.path.abspath(directory).encode("utf-8")).hexdigest()[:16]
+                    path = os.path.join(self.state_dir, "manifests", f"{key}.npz")
+                manifest = self._manifests[directory] = FileManifest(directory, path=path)
+            return manifest
+
+    def _ctime(self, directory: str, fname: str) -> float:
+        manifest = self._manifest(directory)
+        with self._manifest_lock:
+            if fname not in manifest:
+                manifest.refresh()
+            return manifest.ctime_of(fname)
 
     @staticmethod
     def _load_markdown(filepath):
@@ -52,10 +140,6 @@ class Transcriber():
         query = self._query_text(q)
         return self.actions_index.search(query, top_k=top_k)
 
-    async def _guarded_call(self, *args, **kwargs):
-        async with self._sem:
-            return await call_gpt(*args, **kwargs)
-
     def _exists_id(self, nid: str) -> bool:
         return nid in self.all_actions
 
@@ -63,17 +147,30 @@ class Transcriber():
         actions = []
         for fname in fnames:
             # INSERT_YOUR_CODE
-            creation_time = os.path.getctime(f'/Users/dorazhao/Documents/modelgardens/src/infact_dataset/summaries/{self.index}/{fname}')
+            creation_time = self._ctime(self.summaries_dir, fname)
             formatted_creation_time = time.strftime("%m-%d-%Y (%H:%M:%S)", time.localtime(creation_time))
             actions.append(f"User's Actions at {formatted_creation_time}")
-            actions.append(Transcriber._load_markdown(f'/Users/dorazhao/Documents/modelgardens/src/infact_dataset/summaries/{self.index}/{fname}'))
+            actions.append(Transcriber._load_markdown(os.path.join(self.summaries_dir, fname)))
             if include_transcript:
                 actions.append(f"Transcription of User's Screen")
-                actions.append(Transcriber._load_markdown(f'/Users/dorazhao/Documents/modelgardens/src/infact_dataset/transcripts/{self.index}/{fname}'))
+                actions.append(Transcriber._load_markdown(os.path.join(self.transcripts_dir, fname)))
         actions = '\n'.join(actions)
-        pdb.set_trace()
         return actions
 
+    def _sources_ready(self, fname: str, include_transcript: bool = False, settle: float = 1.0) -> bool:
+        """Whether every file _get_actions reads for fname exists and has not been modified for `settle` seconds."""
+        paths = [os.path.join(self.summaries_dir, fname)]
+        if include_transcript:
+            paths.append(os.path.join(self.transcripts_dir, fname))
+        now = time.time()
+        for path in paths:
+            try:
+                if now - os.stat(path).st_mtime < settle:
+                    return False
+            except FileNotFoundError:
+                return False
+        return True
+
     def _handle_identical(self, new_obs:dict, targets: list[str]):
         new_evidence = new_obs['evidence']
         # add new source's evidence to exsting propisitions
@@ -81,6 +178,8 @@ class Transcriber():
             tid_ = str(tid_)
             tgt = self.all_actions[tid_]
             self.all_actions[tid_]['evidence'].extend(new_evidence)
+        # merged into its targets, so its vector should not keep gating new candidates
+        self.embed_store.remove(new_obs['id'])
 
     def _handle_different(self, new_obs:dict, description_only:str):
         if not self._exists_id(new_obs["id"]):
@@ -92,38 +191,16 @@ class Transcriber():
         """
             Split files into active sessions. 
             An active session is a period of time where there are continuous screenshots. 
+            Timestamps come from the directory's manifest, not one stat per file.
         """
-        sessions = []
-        prev_timestamp = 0
-        session_start = 0
-        for i, file in enumerate(files):
-            timestamp = os.path.getctime(os.path.join(input_dir, file))
-            if i == 0:
-                prev_timestamp = timestamp
-            time_diff = timestamp - prev_timestamp
-            assert time_diff >= 0, "Time difference is negative"
-            if time_diff > threshold:
-                sessions.append(files[session_start:i])
-                session_start = i
-            prev_timestamp = timestamp
-        sessions.append(files[session_start:])
-        return sessions
+        return self._manifest(input_dir).split_sessions(files, threshold)
     
-    async def observer_pipeline_batched(self, input_dir, end_file=-1, include_transcript=False, window_size=5):
-        """
-            Same as observer_pipeline, but it is batched
-        """
-        return 
-
-    async def observer_pipeline(self, input_dir, end_file=-1, include_transcript=False, window_size=5):
-        """
-            
-        """
-        prompt = observer.OBSERVE_PROMPT
-        files = sorted(
-            [f for f in os.listdir(input_dir) if f.endswith(".md")],
-            key=lambda x: os.path.getctime(os.path.join(input_dir, x))
-        )
+    def _plan_windows(self, input_dir: str, end_file: int = -1, window_size: int = 5):
+        """Windows still to run, in commit order, up to end_file: [(session index, tid, fnames)]."""
+        manifest = self._manifest(input_dir)
+        with self._manifest_lock:
+            manifest.refresh()
+            files = manifest.sorted_by_ctime()
 
         # split files into active sessions 
         sessions = self._split_sessions(input_dir, files)
@@ -132,99 +209,537 @@ class Transcriber():
 
         print("Transcriber Pipeline", end_file)
 
+        plan = []
         to_end_count = 0
-        end_session = False
+        for s, session in enumerate(sessions):
+            for index in range(0, len(session), window_size):
+                fnames = session[index: index + window_size]
+                tid = os.path.splitext(fnames[0])[0]
+                to_end_count += len(fnames)
+                # resumed windows are skipped but still count towards end_file
+                if tid not in self.processed_windows:
+                    plan.append((s, tid, fnames))
+                if to_end_count >= end_file:
+                    break
+            else:
+                continue
+            break
+        return plan
 
-        for session in sessions:
-            session_length = len(session)
-            for index in range(0, session_length, window_size):
-                try:
-                    fnames = session[index: index + window_size]
-                    start_file = fnames[0]
-                    tid = os.path.splitext(start_file)[0]
-                    print(tid)
-                    iter_t0 = time.perf_counter()
-                    # try:
-                    # ----- Load and propose -----
-                    actions = self._get_actions(fnames, include_transcript=include_transcript)
-                    print(actions)
-                    input_prompt = prompt.format(actions=actions, user_name=self.name)
-                    new_needs = await self._guarded_call(self.client, input_prompt, self.model, resp_format=ObservationResponse)
-
-                    # ----- Assemble candidates -----
-                    cand_items = []
-                    
-                    for prop in new_needs.observations:
-                        nid = f"{self.count}"
-                        item = {"id": nid, "description": prop.description, "evidence": [prop.evidence], "interestingness": prop.interestingness, "confidence": prop.confidence}
-                        # item = {"id": nid, "description": prop.description, "evidence": [prop.evidence], "generality": prop.generality, "interestingness": prop.interestingness}
-                        self.count += 1
-                        cand_items.append(item)
-                    
-                    # ----- Batch embed + ANN pre-filter -----
-                    desc_only = [f"{c['description']}" for c in cand_items]
-                    vecs = self.embed_store.encode(desc_only, batch_size=int(os.getenv("EMB_BATCH", "256")))
-                    keep_mask = self.embed_store.batch_add_if_new([c["id"] for c in cand_items], vecs)
-                    kept = int(np.sum(keep_mask)) if len(keep_mask) else 0
-                    print(f"[{tid}] kept {kept}/{len(cand_items)}")
-
-                    # Prepare survivors but DO NOT add to BM25 yet
-                    survivors = [(c, do) for keep, c, do in zip(keep_mask, cand_items, desc_only) if keep]
-                    if not survivors:
-                        print(f"[{tid}] skip: all proposed needs failed ANN threshold")
+    @staticmethod
+    def _observation_item(prop) -> dict:
+        return {"description": prop.description, "evidence": [prop.evidence], "interestingness": prop.interestingness, "confidence": prop.confidence}
+        # return {"description": prop.description, "evidence": [prop.evidence], "generality": prop.generality, "interestingness": prop.interestingness}
+
+    def _assign_ids(self, cand_items: list[dict]) -> list[dict]:
+        cand_items = [{"id": f"{self.count + i}", **c} for i, c in enumerate(cand_items)]
+        self.count += len(cand_items)
+        return cand_items
+
+    def _classifier_prompt(self, new_obs: dict, description_only: str) -> str:
+        """SIMILAR_PROMPT for one survivor against its BM25 neighbours in the current index."""
+        retrieved = self._search_bm25(description_only, top_k=3) # use description only to search for retrieved
+        return self._format_classifier_prompt(new_obs, retrieved)
+
+    def _classifier_prompts(self, survivors: list[tuple]) -> list[str]:
+        """_classifier_prompt for many survivors against the same index, in one search_many call."""
+        if not survivors:
+            return []
+        retrieved = self.actions_index.search_many([self._query_text(do) for _, do in survivors], top_k=3)
+        return [self._format_classifier_prompt(c, r) for (c, _), r in zip(survivors, retrieved)]
+
+    @staticmethod
+    def _format_classifier_prompt(new_obs: dict, retrieved: list[dict]) -> str:
+        input = f"ID: {new_obs['id']} | {new_obs['description']}"
+        existing = []
+        for r in retrieved:
+            existing.append(f"ID: {r['id']} | {r['description']}")
+        return observer.SIMILAR_PROMPT.format(new=input, existing=existing)
+
+    async def _classify(self, new_obs: dict, description_only: str, classifier_prompt: Optional[str] = None):
+        if classifier_prompt is None:
+            classifier_prompt = self._classifier_prompt(new_obs, description_only)
+        # print(classifier_prompt)
+        resp = await self.llm(classifier_prompt, self.model, resp_format=RelationsResponse,
+                              stage="similar-classify", template="observer.SIMILAR_PROMPT")
+        print('Relations', resp)
+        return resp
+
+    def _apply_relation(self, new_obs: dict, description_only: str, resp):
+        relation = resp.relations
+        label = relation.score
+        _, t_targets = str(relation.source), relation.target
+
+        if label < 8:
+            self._handle_different(new_obs, description_only) 
+        elif label >= 8:
+            if t_targets:
+                self._handle_identical(new_obs, t_targets)
+
+    def _seed_index(self, survivors: list[tuple]):
+        # nothing to compare against yet: the first survivors go straight in
+        for c, t in survivors:
+            nid = c['id']
+            self.all_actions[nid] = c
+            self.actions_index.add_needs([(nid, t)])
+
+    async def observer_pipeline_batched(self, input_dir, end_file=-1, include_transcript=False, window_size=5,
+                                        batch_windows: int = 64):
+        """
+            Same as observer_pipeline, but it is batched: the windows of a session are taken
+            up to `batch_windows` at a time, and for each batch
+              - the OBSERVE_PROMPT requests go out together (one Batch API job when
+                LLM_BATCH_BACKEND is set, otherwise one concurrent fan-out),
+              - all proposals are embedded in one encode call and ANN-filtered in one pass,
+              - the BM25 neighbours of every survivor are retrieved in one search_many call,
+              - every survivor is classified (SIMILAR_PROMPT) in one concurrent fan-out, and
+                the decisions are applied in window order.
+            Ids, saved files and processed windows are the same as observer_pipeline's. The
+            difference: a survivor is not compared (by BM25) with observations added earlier
+            in the same batch, only with the ones before it; the ANN pass still removes
+            near-duplicates within the batch. A window whose classification fails is left
+            out of processed_windows and its survivors are dropped from the embedding store.
+        """
+        plan = self._plan_windows(input_dir, end_file, window_size)
+        batches = []
+        for s, tid, fnames in plan:
+            if batches and batches[-1][0][0] == s and len(batches[-1]) < max(1, batch_windows):
+                batches[-1].append((s, tid, fnames))
+            else:
+                batches.append([(s, tid, fnames)])
+
+        session_t0 = time.perf_counter()
+        for b, batch in enumerate(batches):
+            tids = [tid for _, tid, _ in batch]
+            print(f"[{tids[0]}..{tids[-1]}] {len(batch)} windows")
+            unapplied = set()
+            try:
+                # ----- Load + propose (all windows of the batch together) -----
+                actions = await asyncio.gather(*[asyncio.to_thread(self._get_actions, fnames, include_transcript)
+                                                 for _, _, fnames in batch])
+                prompts = [observer.OBSERVE_PROMPT.format(actions=a, user_name=self.name) for a in actions]
+                if self.batch_backend is not None:
+                    resps = await run_batch([(p, self.model, ObservationResponse) for p in prompts], self.batch_backend,
+                                            stage="observe", template="observer.OBSERVE_PROMPT", caller=self.llm.name)
+                else:
+                    resps = await asyncio.gather(*[self.llm(p, self.model, resp_format=ObservationResponse,
+                                                            stage="observe", template="observer.OBSERVE_PROMPT")
+                                                   for p in prompts], return_exceptions=True)
+
+                # ----- Ids in window order; one encode + one ANN pass for the whole batch -----
+                windows = []   # (tid, candidates)
+                for tid, resp in zip(tids, resps):
+                    if resp is None or isinstance(resp, Exception):
+                        print(f"[{tid}] ERROR: {resp}")
                         continue
+                    windows.append((tid, self._assign_ids([self._observation_item(p) for p in resp.observations])))
+                cand_items = [c for _, cands in windows for c in cands]
+                desc_only = [f"{c['description']}" for c in cand_items]
+                vecs = await asyncio.to_thread(self.embed_store.encode, desc_only,
+                                               int(os.getenv("EMB_BATCH", "256")))
+                keep_mask = self.embed_store.batch_add_if_new([c["id"] for c in cand_items], vecs)
+                kept = int(np.sum(keep_mask)) if len(keep_mask) else 0
+                print(f"[{tids[0]}..{tids[-1]}] kept {kept}/{len(cand_items)}")
+
+                survivors = []   # (tid, candidate, description) in window order
+                i = 0
+                for tid, cands in windows:
+                    for c in cands:
+                        if keep_mask[i]:
+                            survivors.append((tid, c, desc_only[i]))
+                        i += 1
+                # in the embedding store since batch_add_if_new; dropped again if their window fails
+                unapplied = {c["id"] for _, c, _ in survivors}
+
+                # ----- One retrieval + classification fan-out against the index as of this batch -----
+                if len(self.actions_index.needs) == 0 and survivors:
+                    first = survivors[0][0]
+                    self._seed_index([(c, do) for tid, c, do in survivors if tid == first])
+                    unapplied.difference_update(c["id"] for tid, c, _ in survivors if tid == first)
+                    survivors = [x for x in survivors if x[0] != first]
+                prompts = self._classifier_prompts([(c, do) for _, c, do in survivors])
+                relations = await asyncio.gather(*[self._classify(c, do, p) for (_, c, do), p in zip(survivors, prompts)],
+                                                 return_exceptions=True)
+                failed = set()
+                for (tid, c, do), resp in zip(survivors, relations):
+                    if tid not in failed:
+                        try:
+                            if isinstance(resp, Exception):
+                                raise resp
+                            self._apply_relation(c, do, resp)
+                            unapplied.discard(c["id"])
+                            continue
+                        except Exception as e:
+                            print(f"[{tid}] ERROR: {e}")
+                            failed.add(tid)
+                    self.embed_store.remove(c["id"])
+                    unapplied.discard(c["id"])
+                self.processed_windows.update(tid for tid, _ in windows if tid not in failed)
+            except Exception as e:
+                print(f"[{tids[0]}..{tids[-1]}] ERROR: {e}")
+                for nid in unapplied:
+                    self.embed_store.remove(nid)
+            if b + 1 == len(batches) or batches[b + 1][0][0] != batch[0][0]:
+                self._end_session(tids[-1], session_t0)
+                session_t0 = time.perf_counter()
+        return self.all_actions
 
-                    if len(self.actions_index.needs) == 0:
-                        for c, t in survivors:
-                            nid = c['id']
-                            self.all_actions[nid] = c
-                            self.actions_index.add_needs([(nid, t)])
-                    else:
-                        for new_obs, do in survivors:
-                            # --- (a) BM25 retrieval body for THIS survivor only (no self in index yet) ---
-                            input = f"ID: {new_obs['id']} | {new_obs['description']}"
-                            retrieved = self._search_bm25(do, top_k=3) # use description only to search for retrieved
-                            existing = []
-                            for r in retrieved:
-                                existing.append(f"ID: {r['id']} | {r['description']}")
-
-                            classifier_prompt = observer.SIMILAR_PROMPT.format(new=input, existing=existing)
-                            # print(classifier_prompt)
-                            resp = await self._guarded_call(self.client, classifier_prompt, self.model, resp_format=RelationsResponse)
-                            print('Relations', resp)
-
-                            relation = resp.relations
-                            label = relation.score
-                            _, t_targets = str(relation.source), relation.target
-
-                            if label < 8:
-                                self._handle_different(new_obs, do) 
-                            elif label >= 8:
-                                if t_targets:
-                                    self._handle_identical(new_obs, t_targets)
-                    to_end_count += len(fnames)
-                    if to_end_count >= end_file:
-                        end_session = True
+    async def _propose_window(self, fnames: list[str], include_transcript: bool = False):
+        """
+        Load a window and stream its OBSERVE_PROMPT proposals into the encoder. Reads no
+        shared state, so any number of windows can be proposed ahead of the commit stage.
+        Returns the candidates (without ids yet) and their embeddings.
+        """
+        actions = await asyncio.to_thread(self._get_actions, fnames, include_transcript)
+        input_prompt = observer.OBSERVE_PROMPT.format(actions=actions, user_name=self.name)
+        cand_items = []
+
+        async def proposals():
+            async for prop in self.llm.stream(input_prompt, self.model, ObservationResponse, "observations",
+                                              stage="observe", template="observer.OBSERVE_PROMPT"):
+                item = self._observation_item(prop)
+                cand_items.append(item)
+                yield f"{item['description']}"
+
+        vecs = await self.embed_store.encode_stream(proposals(), batch_size=int(os.getenv("EMB_BATCH", "256")))
+        return cand_items, vecs
+
+    async def _commit_window(self, tid: str, cand_items: list[dict], vecs: np.ndarray):
+        """
+        Apply one proposed window to the store: assign ids, ANN pre-filter, classify the
+        survivors against BM25 and merge. Windows must be committed in order.
+        """
+        cand_items = self._assign_ids(cand_items)
+
+        # ----- Batch ANN pre-filter -----
+        desc_only = [f"{c['description']}" for c in cand_items]
+        keep_mask = self.embed_store.batch_add_if_new([c["id"] for c in cand_items], vecs)
+        kept = int(np.sum(keep_mask)) if len(keep_mask) else 0
+        print(f"[{tid}] kept {kept}/{len(cand_items)}")
+
+        # Prepare survivors but DO NOT add to BM25 yet
+        survivors = [(c, do) for keep, c, do in zip(keep_mask, cand_items, desc_only) if keep]
+        if not survivors:
+            print(f"[{tid}] skip: all proposed needs failed ANN threshold")
+            return
+
+        if len(self.actions_index.needs) == 0:
+            self._seed_index(survivors)
+            return
+
+        await self._classify_survivors(survivors)
+
+    def _speculative_prompts(self, survivors: list[tuple]) -> list[str]:
+        """
+        SIMILAR_PROMPT for each survivor, built as if every survivor before it had been added
+        to the index as "different" -- what one-at-a-time classification sees in that case.
+        The index is left as it was.
+        """
+        prompts = []
+        for c, do in survivors:
+            prompts.append(self._classifier_prompt(c, do))
+            self.actions_index.add_need(c["id"], do)
+        for c, _ in survivors:
+            self.actions_index.remove_need(c["id"])
+        return prompts
+
+    async def _classify_survivors(self, survivors: list[tuple]):
+        """
+        Classify a window's survivors concurrently and apply the decisions in order, with the
+        same result as classifying them one at a time. Each prompt already retrieves from the
+        window's earlier survivors (_speculative_prompts); if one of those is merged instead
+        of added, the speculation is wrong from the next survivor on, which is classified
+        again in another concurrent round (prompts that did not change keep their answer).
+        If a request fails, the survivors not applied yet are dropped from the embedding
+        store, so committing the window again proposes them anew.
+        """
+        answered = {}   # prompt -> response
+        pending, done = survivors, 0
+        try:
+            while pending:
+                prompts = self._speculative_prompts(pending)
+                todo = {p: (c, do) for (c, do), p in zip(pending, prompts) if p not in answered}
+                relations = await asyncio.gather(*[self._classify(c, do, p) for p, (c, do) in todo.items()],
+                                                 return_exceptions=True)
+                # fail before applying anything of this round
+                for resp in relations:
+                    if isinstance(resp, Exception):
+                        raise resp
+                answered.update(zip(todo, relations))
+                for (new_obs, do), prompt in zip(pending, prompts):
+                    self._apply_relation(new_obs, do, answered[prompt])
+                    done += 1
+                    if new_obs["id"] not in self.actions_index.needs:
                         break
+                pending, done = pending[done:], 0
+        except Exception:
+            for c, _ in pending[done:]:
+                self.embed_store.remove(c["id"])
+            raise
+
+    def _checkpoint(self):
+        print("Save to", self.save_file)
+        with open(self.save_file, "wb") as f:
+            f.write(orjson.dumps(self.all_actions, option=orjson.OPT_INDENT_2))
+        if self.state_dir:
+            self.save_state(self.state_dir)
+            with self._manifest_lock:
+                for manifest in self._manifests.values():
+                    if manifest.path:
+                        manifest.save(manifest.path)
+
+    def _end_session(self, tid: str, session_t0: float):
+        # Save at the end of each session
+        self._checkpoint()
+        print(f"[{tid}] done. total actions={len(self.all_actions)} | session={time.perf_counter()-session_t0:.2f}s")
+        if self.embed_store.cache is not None:
+            print(f"[{tid}] embedding cache: {self.embed_store.cache_stats()}")
+        if get_response_cache() is not None:
+            print(f"[{tid}] response cache: {get_response_cache().stats()}")
+        print(f"[{tid}] {self.llm.gateway.report()}")
+        print(get_telemetry().summary())
+        get_telemetry().flush()
+
+    async def observer_pipeline(self, input_dir, end_file=-1, include_transcript=False, window_size=5,
+                                lookahead: int = 8):
+        """
+            Two stages: up to `lookahead` windows are loaded, proposed (OBSERVE_PROMPT) and
+            embedded concurrently, while a single commit stage applies them one by one in file
+            order (ids, ANN filter, SIMILAR_PROMPT classification, merges). Everything that
+            reads or writes the store happens in the commit stage, so the result is the same
+            as processing the windows sequentially.
+        """
+        plan = self._plan_windows(input_dir, end_file, window_size)
+
+        # ----- Propose ahead (bounded), commit in order -----
+        proposed = deque()
+        upcoming = iter(plan)
+
+        def propose_ahead():
+            while len(proposed) < max(1, lookahead):
+                window = next(upcoming, None)
+                if window is None:
+                    return
+                proposed.append((window, asyncio.ensure_future(self._propose_window(window[2], include_transcript))))
+
+        propose_ahead()
+        session_t0 = time.perf_counter()
+        while proposed:
+            (s, tid, fnames), task = proposed.popleft()
+            propose_ahead()
+            print(tid)
+            try:
+                cand_items, vecs = await task
+                await self._commit_window(tid, cand_items, vecs)
+                self.processed_windows.add(tid)
+            except Exception as e:
+                print(f"[{tid}] ERROR: {e}")
+            if not proposed or proposed[0][0][0] != s:
+                self._end_session(tid, session_t0)
+                session_t0 = time.perf_counter()
+        return self.all_actions
+
+    async def watch(self, input_dir, include_transcript=False, window_size=5, threshold: float = 3600,
+                    lookahead: int = 8, queue_size: int = 16, poll_interval: float = 2.0,
+                    flush_after: Optional[float] = None, checkpoint_every: int = 20,
+                    idle_exit: Optional[float] = None, use_inotify: bool = True,
+                    source_wait: float = 600.0, max_attempts: int = 3):
+        """
+            Long-running observer_pipeline for a directory that keeps receiving summaries.
+            Files already there are taken first (resuming via processed_windows), then new
+            .md files are picked up as they are completed (DirWatcher: inotify, or polling).
+            A file only joins a window once everything _get_actions reads for it (its summary,
+            and its transcript with include_transcript) exists; files are held back in ctime
+            order until then, and skipped after `source_wait` seconds.
+            Windows are formed incrementally as in observer_pipeline: up to window_size files
+            of one session, the last window of a session being flushed once no file has
+            arrived for `threshold` seconds (or `flush_after`, if shorter). Stages:
+              watcher -> windows (queue_size) -> propose, up to lookahead ahead -> commit in order
+            Both queues are bounded, so a slow commit stage holds back proposals and then
+            the watcher. A window whose commit fails is queued again, up to max_attempts times.
+            Every committed window reports the time from each new file's creation to its
+            commit; percentiles are printed with each session save.
+            Runs until cancelled, or until no file has arrived for `idle_exit` seconds and
+            every window formed so far has been committed or given up on.
+        """
+        flush_after = threshold if flush_after is None else min(flush_after, threshold)
+        manifest = self._manifest(input_dir)
+        watcher = DirWatcher(manifest, poll_interval=poll_interval, use_inotify=use_inotify,
+                             lock=self._manifest_lock)
+        with self._manifest_lock:
+            backlog = [f for f in manifest.sorted_by_ctime() if f in watcher.seen]
+        started = time.time()
+        print(f"Watching {input_dir} ({watcher.mode}); {len(backlog)} files already there")
+
+        windows = asyncio.Queue(maxsize=max(1, queue_size))   # formed, not yet proposed
+        proposed = asyncio.Queue(maxsize=max(1, lookahead))   # proposals in flight, in commit order
+        waiting = deque()     # (name, arrived) in ctime order, sources not all there yet
+        retries = deque()     # (tid, fnames, attempt, not_before) of windows whose commit failed
+        outstanding = set()   # windows formed and not yet committed or given up on
+        latencies = []
+
+        async def form_windows():
+            window, last, session_open = [], None, False
+
+            async def emit(end_of_session: bool):
+                nonlocal window, session_open
+                if window:
+                    tid = os.path.splitext(window[0])[0]
+                    if tid not in self.processed_windows:
+                        outstanding.add(tid)
+                        await windows.put(("window", (tid, window, 1)))
+                    window = []
+                if end_of_session and session_open:
+                    session_open = False
+                    await windows.put(("session", None))
+
+            async def release():
+                nonlocal last, session_open
+                while waiting:
+                    name, arrived = waiting[0]
+                    if not self._sources_ready(name, include_transcript, watcher.settle):
+                        if time.monotonic() - arrived < source_wait:
+                            return
+                        print(f"[{name}] sources missing after {source_wait:.0f}s; skipped")
+                        waiting.popleft()
+                        continue
+                    waiting.popleft()
+                    with self._manifest_lock:
+                        ts = manifest.ctime_of(name)
+                    if last is not None and ts - last > threshold:
+                        await emit(True)
+                    last = ts if last is None else max(last, ts)
+                    session_open = True
+                    window.append(name)
+                    if len(window) == window_size:
+                        await emit(False)
+
+            async def requeue():
+                now = time.monotonic()
+                for _ in range(len(retries)):
+                    tid, fnames, attempt, not_before = retries.popleft()
+                    if now < not_before:
+                        retries.append((tid, fnames, attempt, not_before))
+                    else:
+                        await windows.put(("window", (tid, fnames, attempt)))
+
+            now = time.monotonic()
+            waiting.extend((name, now) for name in backlog)
+            await release()
+            idle_t0 = time.monotonic()
+            while True:
+                await requeue()
+                names = await watcher.next_batch(timeout=poll_interval)
+                now = time.monotonic()
+                waiting.extend((name, now) for name in names)
+                await release()
+                if names:
+                    idle_t0 = now
+                    continue
+                if waiting:
+                    # a later file may still belong to the current window or session
+                    continue
+                if last is not None and time.time() - last > threshold:
+                    await emit(True)
+                elif window and time.time() - last > flush_after:
+                    await emit(False)
+                if idle_exit is not None and time.monotonic() - idle_t0 > idle_exit:
+                    await emit(True)
+                    if not outstanding:
+                        await windows.put(None)
+                        return
+
+        async def propose():
+            while True:
+                item = await windows.get()
+                if item is not None and item[0] == "window":
+                    tid, fnames, attempt = item[1]
+                    task = asyncio.ensure_future(self._propose_window(fnames, include_transcript))
+                    item = ("window", (tid, fnames, attempt, task))
+                await proposed.put(item)
+                if item is None:
+                    return
+
+        async def commit():
+            session_t0 = time.perf_counter()
+            tid, since_checkpoint = None, 0
+            while True:
+                item = await proposed.get()
+                if item is None:
+                    return
+                kind, payload = item
+                if kind == "session":
+                    if tid is not None:
+                        self._end_session(tid, session_t0)
+                        print(f"[{tid}] {self._latency_report(latencies)}")
+                        since_checkpoint = 0
+                    session_t0 = time.perf_counter()
+                    continue
+                tid, fnames, attempt, task = payload
+                print(tid)
+                try:
+                    cand_items, vecs = await task
+                    await self._commit_window(tid, cand_items, vecs)
                 except Exception as e:
-                    print(f"[{tid}] ERROR: {e}")
-            # Save at the end of each session
-            print("Save to", self.save_file)
-            with open(self.save_file, "wb") as f:
-                f.write(orjson.dumps(self.all_actions, option=orjson.OPT_INDENT_2))
-            print(f"[{tid}] done. total actions={len(self.all_actions)} | iter={time.perf_counter()-iter_t0:.2f}s")
-            if end_session: break
+                    if attempt < max_attempts:
+                        print(f"[{tid}] ERROR (attempt {attempt}/{max_attempts}, queued again): {e}")
+                        retries.append((tid, fnames, attempt + 1, time.monotonic() + poll_interval * attempt))
+                    else:
+                        print(f"[{tid}] ERROR (attempt {attempt}/{max_attempts}, giving up): {e}")
+                        outstanding.discard(tid)
+                    continue
+                self.processed_windows.add(tid)
+                outstanding.discard(tid)
+                now = time.time()
+                with self._manifest_lock:
+                    ctimes = [manifest.ctime_of(f) for f in fnames]
+                lat = [now - ts for ts in ctimes if ts >= started]
+                if lat:
+                    latencies.extend(lat)
+                    print(f"[{tid}] arrival->commit {min(lat):.1f}-{max(lat):.1f}s | "
+                          f"queued windows={windows.qsize()} proposals={proposed.qsize()}")
+                since_checkpoint += 1
+                if checkpoint_every and since_checkpoint >= checkpoint_every:
+                    self._checkpoint()
+                    since_checkpoint = 0
+
+        stages = [asyncio.ensure_future(stage) for stage in (form_windows(), propose(), commit())]
+        try:
+            await asyncio.gather(*stages)
+        finally:
+            for stage in stages:
+                stage.cancel()
+            watcher.close()
+            self._checkpoint()
+            print(self._latency_report(latencies))
         return self.all_actions
 
+    @staticmethod
+    def _latency_report(latencies: list[float]) -> str:
+        if not latencies:
+            return "arrival->commit: no new files"
+        p50, p95 = np.percentile(latencies, [50, 95])
+        return f"arrival->commit over {len(latencies)} files: p50={p50:.1f}s p95={p95:.1f}s max={max(latencies):.1f}s"
+
 
 async def main(args):
     include_transcript = True
     timestamp = time.strftime("%Y%m%d_%H%M%S")
     save_file = f"/Users/dorazhao/Documents/modelgardens/src/infact_dataset/actions/{args.index}_{args.model}_{'both' if include_transcript else 'summary'}_tooleval_{timestamp}.json"
-    t = Transcriber(args.model, str(args.index), args.user, save_file=save_file)
+    t = Transcriber(args.model, str(args.index), args.user, save_file=save_file, state_dir=args.state_dir)
     input_dir = f"/Users/dorazhao/Documents/modelgardens/src/infact_dataset/transcripts/{args.index}"
 
-    results = await t.observer_pipeline(input_dir, end_file=args.end_file, include_transcript=include_transcript)
+    if args.watch:
+        results = await t.watch(input_dir, include_transcript=include_transcript, lookahead=args.lookahead,
+                                queue_size=args.queue_size, poll_interval=args.poll_interval,
+                                idle_exit=args.idle_exit)
+    elif args.batched:
+        results = await t.observer_pipeline_batched(input_dir, end_file=args.end_file,
+                                                    include_transcript=include_transcript,
+                                                    batch_windows=args.batch_windows)
+    else:
+        results = await t.observer_pipeline(input_dir, end_file=args.end_file, include_transcript=include_transcript,
+                                            lookahead=args.lookahead)
     with open(save_file, "wb") as f:
         f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
 
@@ -235,6 +750,19 @@ if __name__ == "__main__":
                         help="OpenAI model name.")
     parser.add_argument("--user", type=str, default="Dora")
     parser.add_argument("--end_file", type=int, default=-1)
+    parser.add_argument("--state_dir", type=str, default=None,
+                        help="Directory to persist/resume actions, BM25 and embedding indexes.")
+    parser.add_argument("--lookahead", type=int, default=8,
+                        help="Windows proposed concurrently ahead of the (ordered) commit stage.")
+    parser.add_argument("--batched", action="store_true",
+                        help="Use observer_pipeline_batched (batched proposals, embedding and classification).")
+    parser.add_argument("--batch_windows", type=int, default=64)
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and ingest new files as they appear (inotify, or polling).")
+    parser.add_argument("--queue_size", type=int, default=16, help="Watch mode: formed windows waiting to be proposed.")
+    parser.add_argument("--poll_interval", type=float, default=2.0)
+    parser.add_argument("--idle_exit", type=float, default=None,
+                        help="Watch mode: stop after this many seconds without a new file.")
     args = parser.parse_args()
     asyncio.run(main(args))
 
@@ -282,7 +810,7 @@ if __name__ == "__main__":
                     
                 #     if merge_prompt is not None:
                 #         merge_tasks.append(
-                #             self._guarded_call(self.client, merge_prompt, "o3", resp_format=ObservationResponse)
+                #             self.llm(merge_prompt, "o3", resp_format=ObservationResponse)
                 #         )
                 #         self.already_merged.add(to_merge)
                 #         to_merge_ids.append(mids)
@@ -0,0 +1,260 @@
+import os
+import tempfile
+import weakref
+import numpy as np
+
+def _normalize(vecs: np.ndarray) -> np.ndarray:
+    vecs = np.asarray(vecs, dtype=np.float32)
+    if vecs.ndim == 1:
+        vecs = vecs[np.newaxis, :]
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    return vecs / np.maximum(norms, 1e-30)
+
+# -------- Flat cosine indexes with an hnswlib.Index-compatible surface --------
+class _FlatIndex:
+    """
+    Row bookkeeping shared by the flat indexes: labels, live mask, tombstoned rows
+    available for reuse. Mirrors the subset of hnswlib.Index that EmbeddingsStore
+    uses, so the store can swap a flat index in for the HNSW graph. Subclasses
+    provide vector storage (_resize_storage, _store, _exact_rows) and knn_query.
+    """
+    def __init__(self, dim: int):
+        self.dim = int(dim)
+        self.ef = 0
+        self._capacity = 0
+        self._rows = 0                 # rows ever used (live + tombstones)
+        self.labels = np.zeros(0, dtype=np.int64)
+        self.live = np.zeros(0, dtype=bool)
+        self.row_of = {}               # label -> row
+        self._free = []                # tombstoned rows available for reuse
+
+    def init_index(self, max_elements: int, **kwargs):
+        self.resize_index(max_elements)
+
+    def set_ef(self, ef: int):
+        self.ef = int(ef)
+
+    def get_current_count(self) -> int:
+        return self._rows
+
+    def get_max_elements(self) -> int:
+        return self._capacity
+
+    def resize_index(self, new_cap: int):
+        new_cap = int(new_cap)
+        if new_cap <= self._capacity:
+            return
+        self.labels = _grow(self.labels, new_cap)
+        self.live = _grow(self.live, new_cap)
+        self._resize_storage(new_cap)
+        self._capacity = new_cap
+
+    def add_items(self, data, ids, replace_deleted: bool = False, **kwargs):
+        vecs = _normalize(data)
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        for vec, label in zip(vecs, ids.tolist()):
+            if label in self.row_of:
+                row = self.row_of[label]
+            elif replace_deleted and self._free:
+                row = self._free.pop()
+            else:
+                if self._rows >= self._capacity:
+                    raise RuntimeError("The number of elements exceeds the specified limit")
+                row = self._rows
+                self._rows += 1
+            self._store(row, vec)
+            self.labels[row] = label
+            self.live[row] = True
+            self.row_of[label] = row
+
+    def mark_deleted(self, label: int):
+        row = self.row_of.pop(int(label))
+        self.live[row] = False
+        self._free.append(row)
+
+    def get_items(self, ids, return_type: str = "numpy"):
+        rows = [self.row_of[int(label)] for label in ids]
+        return np.array(self._exact_rows(rows), dtype=np.float32)
+
+    def save_index(self, path: str):
+        n = self._rows
+        with open(path, "wb") as f:
+            np.savez(f, labels=self.labels[:n], live=self.live[:n], **self._storage_arrays(n))
+
+    def load_index(self, path: str, max_elements: int = 0, **kwargs):
+        with open(path, "rb") as f:
+            data = np.load(f)
+            n = len(data["labels"])
+            self.resize_index(max(int(max_elements), n))
+            self.labels[:n] = data["labels"]
+            self.live[:n] = data["live"]
+            self._load_storage(data, n)
+        self._rows = n
+        self.row_of = {int(self.labels[r]): r for r in range(n) if self.live[r]}
+        self._free = [r for r in range(n) if not self.live[r]]
+
+    def _top_rows(self, scores: np.ndarray, n_cand: int) -> np.ndarray:
+        """Row indices of the n_cand best live rows per query column of `scores` (n, B)."""
+        scores[~self.live[:len(scores)]] = -np.inf
+        n_cand = min(n_cand, len(scores))
+        return np.argpartition(-scores, n_cand - 1, axis=0)[:n_cand]
+
+    @staticmethod
+    def _too_few(found: int, k: int):
+        if found < k:
+            raise RuntimeError("Cannot return the results in a contiguous 2D array. Probably ef or M is too small")
+
+class ExactFlatIndex(_FlatIndex):
+    """
+    Brute-force cosine index over a contiguous float32 matrix: each knn_query is one
+    BLAS (n, D) x (D, B) product. Cheaper than HNSW to build and query for small n.
+    """
+    def __init__(self, dim: int):
+        super().__init__(dim)
+        self.matrix = np.zeros((0, self.dim), dtype=np.float32)
+
+    def knn_query(self, data, k: int = 1):
+        """Return (labels, distances) with distance = 1 - cosine, like hnswlib's cosine space."""
+        queries = _normalize(data)
+        scores = self.matrix[:self._rows] @ queries.T         # (n, B)
+        if k == 1:
+            self._top_rows(scores, 1)                          # masks tombstones
+            best = np.argmax(scores, axis=0)[np.newaxis, :]
+        else:
+            best = self._top_rows(scores, k)
+        labels = np.empty((len(queries), k), dtype=np.uint64)
+        dists = np.empty((len(queries), k), dtype=np.float32)
+        for qi in range(len(queries)):
+            rows = best[:, qi]
+            rows = rows[self.live[rows]]
+            self._too_few(len(rows), k)
+            rows = rows[np.argsort(-scores[rows, qi])]
+            labels[qi] = self.labels[rows]
+            dists[qi] = 1.0 - scores[rows, qi]
+        return labels, dists
+
+    def nbytes_in_memory(self) -> int:
+        per_row = self.matrix.itemsize * self.dim + self.labels.itemsize + self.live.itemsize
+        return self._rows * per_row
+
+    def _resize_storage(self, new_cap: int):
+        self.matrix = _grow(self.matrix, new_cap)
+
+    def _store(self, row: int, vec: np.ndarray):
+        self.matrix[row] = vec
+
+    def _exact_rows(self, rows):
+        return self.matrix[rows]
+
+    def _storage_arrays(self, n: int) -> dict:
+        return {"matrix": self.matrix[:n]}
+
+    def _load_storage(self, data, n: int):
+        self.matrix[:n] = data["matrix"]
+
+# -------- Compact cosine index (int8 / float16 codes) --------
+class QuantizedFlatIndex(_FlatIndex):
+    """
+    Flat cosine index that keeps only compressed codes in RAM:
+      int8    per-vector symmetric scalar quantization (code * scale ~= x), ~4x smaller
+      float16 half-precision copy, ~2x smaller
+    knn_query scores every live code, keeps the `rerank` best candidates per query and
+    re-scores them exactly against float32 originals held in a memory-mapped arena file
+    in `arena_dir` (the system temp dir if None), which grows with the rows in use.
+    """
+    def __init__(self, dim: int, dtype: str = "int8", rerank: int = 32, arena_dir=None):
+        if dtype not in ("int8", "float16"):
+            raise ValueError(f"Unsupported compact dtype '{dtype}' (use 'int8' or 'float16').")
+        super().__init__(dim)
+        self.dtype = dtype
+        self.rerank = int(rerank)
+        self.ef = self.rerank
+        self.codes = np.zeros((0, self.dim), dtype=np.int8 if dtype == "int8" else np.float16)
+        self.scales = np.zeros(0, dtype=np.float32)
+        fd, self._arena_path = tempfile.mkstemp(prefix="vectors_", suffix=".f32", dir=arena_dir)
+        # grown and mapped through this handle, so removing arena_dir does not break the index
+        self._arena = os.fdopen(fd, "r+b")
+        self._arena_rows = 0
+        self._exact = None
+        weakref.finalize(self, _close_arena, self._arena, self._arena_path)
+
+    def knn_query(self, data, k: int = 1):
+        """Return (labels, distances) with distance = 1 - cosine, like hnswlib's cosine space."""
+        queries = _normalize(data)
+        cand = self._top_rows(self._approx_scores(queries, self._rows), max(self.rerank, k))
+        labels = np.empty((len(queries), k), dtype=np.uint64)
+        dists = np.empty((len(queries), k), dtype=np.float32)
+        for qi, q in enumerate(queries):
+            rows = cand[:, qi]
+            rows = rows[self.live[rows]]
+            exact = np.asarray(self._exact_rows(rows)) @ q
+            order = np.argsort(-exact)[:k]
+            self._too_few(len(order), k)
+            labels[qi] = self.labels[rows[order]]
+            dists[qi] = 1.0 - exact[order]
+        return labels, dists
+
+    def nbytes_in_memory(self) -> int:
+        """RAM held by the used rows of the codes and bookkeeping arrays (the float32 arena lives on disk)."""
+        per_row = self.codes.itemsize * self.dim + self.scales.itemsize + self.labels.itemsize + self.live.itemsize
+        return self._rows * per_row
+
+    def _resize_storage(self, new_cap: int):
+        self.codes = _grow(self.codes, new_cap)
+        self.scales = _grow(self.scales, new_cap)
+
+    def _grow_arena(self, rows: int):
+        """Extend the arena file to hold at least `rows` rows (doubling, up to capacity), then re-map it."""
+        rows = min(self._capacity, max(rows, 2 * self._arena_rows, 1024))
+        self._exact = None
+        self._arena.truncate(rows * self.dim * 4)
+        self._exact = np.memmap(self._arena, dtype=np.float32, mode="r+", shape=(rows, self.dim))
+        self._arena_rows = rows
+
+    def _store(self, row: int, vec: np.ndarray):
+        if row >= self._arena_rows:
+            self._grow_arena(row + 1)
+        if self.dtype == "int8":
+            scale = float(np.abs(vec).max()) / 127.0 or 1.0
+            self.codes[row] = np.clip(np.rint(vec / scale), -127, 127).astype(np.int8)
+            self.scales[row] = scale
+        else:
+            self.codes[row] = vec.astype(np.float16)
+            self.scales[row] = 1.0
+        self._exact[row] = vec
+
+    def _exact_rows(self, rows):
+        if self._exact is None:   # nothing stored yet
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return self._exact[rows]
+
+    def _storage_arrays(self, n: int) -> dict:
+        return {"codes": self.codes[:n], "scales": self.scales[:n], "exact": np.asarray(self._exact_rows(slice(0, n)))}
+
+    def _load_storage(self, data, n: int):
+        self.codes[:n] = data["codes"]
+        self.scales[:n] = data["scales"]
+        if n > self._arena_rows:
+            self._grow_arena(n)
+        if n:
+            self._exact[:n] = data["exact"]
+
+    def _approx_scores(self, queries: np.ndarray, n: int, chunk: int = 65_536) -> np.ndarray:
+        out = np.empty((n, len(queries)), dtype=np.float32)
+        qt = queries.T
+        for lo in range(0, n, chunk):
+            hi = min(n, lo + chunk)
+            out[lo:hi] = (self.codes[lo:hi].astype(np.float32) @ qt) * self.scales[lo:hi, np.newaxis]
+        return out
+
+def _grow(arr: np.ndarray, new_len: int) -> np.ndarray:
+    out = np.zeros((new_len,) + arr.shape[1:], dtype=arr.dtype)
+    out[:len(arr)] = arr
+    return out
+
+def _close_arena(f, path: str):
+    f.close()
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,60 @@
+"""
+Exact (flat BLAS) vs HNSW benchmark for EmbeddingsStore's float32 backends.
+
+For each corpus size N, builds a store with backend="exact" and one with
+backend="hnsw" from the same synthetic vectors, then times
+  build   one add_batch of all N vectors
+  query   max_cosine (k=1, one vector per call, like add_if_new)
+  batch   max_cosine_batch over 16 vectors (like batch_add_if_new)
+and prints the first N at which HNSW's per-query time beats the flat scan,
+i.e. a sensible value for EmbeddingsStore(promote_at=...).
+
+    cd src && python -m benchmarks.ann_crossover --sizes 500,1000,2000,4000,8000,16000,32000
+"""
+import argparse
+import time
+import numpy as np
+from benchmarks.quantized_recall import synthetic_stream, _FixedDimStore
+
+
+def run(vecs: np.ndarray, queries: np.ndarray, backend: str):
+    store = _FixedDimStore(vecs.shape[1], backend=backend, ann_max=len(vecs))
+    t0 = time.perf_counter()
+    store.add_batch([str(i) for i in range(len(vecs))], vecs)
+    build_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for q in queries:
+        store.max_cosine(q)
+    query_us = (time.perf_counter() - t0) / len(queries) * 1e6
+
+    t0 = time.perf_counter()
+    for lo in range(0, len(queries), 16):
+        store.max_cosine_batch(queries[lo:lo + 16])
+    batch_us = (time.perf_counter() - t0) / max(1, len(queries) // 16) * 1e6
+    return build_s, query_us, batch_us
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the exact/HNSW crossover for EmbeddingsStore.")
+    parser.add_argument("--sizes", type=str, default="500,1000,2000,4000,8000,16000,32000")
+    parser.add_argument("--queries", type=int, default=512)
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    pool = synthetic_stream(max(sizes) + args.queries, seed=1)
+    queries = pool[-args.queries:]
+    crossover = None
+    print(f"{'N':>7} | {'build exact':>11} {'build hnsw':>10} | {'k=1 exact':>10} {'k=1 hnsw':>9} | "
+          f"{'x16 exact':>10} {'x16 hnsw':>9}")
+    for n in sizes:
+        exact = run(pool[:n], queries, "exact")
+        hnsw = run(pool[:n], queries, "hnsw")
+        print(f"{n:>7} | {exact[0]:>10.3f}s {hnsw[0]:>9.3f}s | {exact[1]:>8.0f}us {hnsw[1]:>7.0f}us | "
+              f"{exact[2]:>8.0f}us {hnsw[2]:>7.0f}us")
+        if crossover is None and hnsw[1] < exact[1]:
+            crossover = n
+    if crossover is None:
+        print(f"exact search is faster per query up to N={sizes[-1]}")
+    else:
+        print(f"HNSW queries overtake exact search at N~{crossover} (build cost aside)")
@@ -0,0 +1,65 @@
+"""
+Ingest benchmark for BM25NeedsIndex.
+
+Adds synthetic needs one at a time (the way Transcriber.observer_pipeline does)
+and reports the time per block of inserts as the corpus grows. With the
+incremental index the per-block time should stay roughly flat.
+
+    cd src && python -m benchmarks.bm25_ingest --n 100000 --block 1000
+"""
+import argparse
+import random
+import time
+from rank_bm25 import BM25Okapi
+from BM25 import BM25NeedsIndex
+from prompts.test_dataset import TESTSET
+
+
+def synthetic_needs(n: int, seed: int = 0):
+    """Yield (id, text) pairs built from the test-set vocabulary plus a long tail of rare tokens."""
+    rng = random.Random(seed)
+    vocab = sorted({w for d in TESTSET for w in d["text"].split()})
+    for i in range(n):
+        words = rng.choices(vocab, k=rng.randint(6, 14))
+        words.append(f"tok{rng.randint(0, n)}")
+        yield str(i), " ".join(words)
+
+
+def run_incremental(n: int, block: int, probe_every: int):
+    index = BM25NeedsIndex({})
+    t0 = time.perf_counter()
+    for nid, text in synthetic_needs(n):
+        index.add_needs([(nid, text)])
+        size = len(index.needs)
+        if size % block == 0:
+            t1 = time.perf_counter()
+            if size % probe_every == 0:
+                print(f"[incremental] n={size:>7} | {1000 * (t1 - t0) / block:.3f} ms/add")
+            t0 = time.perf_counter()
+
+
+def run_rebuild(n: int, block: int):
+    """Old behaviour: re-tokenize everything and rebuild BM25Okapi after each add."""
+    index = BM25NeedsIndex({})
+    texts = []
+    t0 = time.perf_counter()
+    for nid, text in synthetic_needs(n):
+        texts.append(text)
+        BM25Okapi([index._preprocess(t) for t in texts])
+        if len(texts) % block == 0:
+            t1 = time.perf_counter()
+            print(f"[rebuild]     n={len(texts):>7} | {1000 * (t1 - t0) / block:.3f} ms/add")
+            t0 = time.perf_counter()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark BM25NeedsIndex ingest.")
+    parser.add_argument("--n", type=int, default=100_000)
+    parser.add_argument("--block", type=int, default=1000)
+    parser.add_argument("--probe_every", type=int, default=10_000)
+    parser.add_argument("--rebuild_n", type=int, default=2000,
+                        help="Corpus size for the full-rebuild baseline (0 to skip).")
+    args = parser.parse_args()
+    run_incremental(args.n, args.block, args.probe_every)
+    if args.rebuild_n:
+        run_rebuild(args.rebuild_n, max(1, args.rebuild_n // 4))
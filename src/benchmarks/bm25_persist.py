@@ -0,0 +1,51 @@
+"""
+Warm-restart benchmark for BM25NeedsIndex.save/load.
+
+Compares rebuilding the index from raw need texts against loading the saved,
+memory-mapped index, and has several worker processes open the same index
+read-only to show that each load stays in the millisecond range.
+
+    cd src && python -m benchmarks.bm25_persist --n 100000 --workers 4
+"""
+import argparse
+import tempfile
+import time
+from multiprocessing import Pool
+from BM25 import BM25NeedsIndex
+from benchmarks.bm25_ingest import synthetic_needs
+
+
+def load_and_query(args):
+    path, query = args
+    t0 = time.perf_counter()
+    index = BM25NeedsIndex.load(path)
+    t1 = time.perf_counter()
+    hits = index.search(query, top_k=3)
+    return t1 - t0, time.perf_counter() - t1, [h["id"] for h in hits]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark BM25 index persistence.")
+    parser.add_argument("--n", type=int, default=100_000)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    texts = list(synthetic_needs(args.n))
+    t0 = time.perf_counter()
+    index = BM25NeedsIndex({})
+    index.add_needs(texts)
+    query = texts[0][1]
+    expected = [h["id"] for h in index.search(query, top_k=3)]
+    print(f"rebuild from texts : {time.perf_counter() - t0:8.3f} s")
+
+    with tempfile.TemporaryDirectory() as path:
+        t0 = time.perf_counter()
+        index.save(path)
+        print(f"save               : {time.perf_counter() - t0:8.3f} s")
+
+        load_s, query_s, got = load_and_query((path, query))
+        print(f"load (mmap)        : {1000 * load_s:8.2f} ms | first query {1000 * query_s:.2f} ms | same hits: {got == expected}")
+
+        with Pool(args.workers) as pool:
+            for i, (load_s, query_s, got) in enumerate(pool.map(load_and_query, [(path, query)] * args.workers)):
+                print(f"worker {i}           : {1000 * load_s:8.2f} ms | first query {1000 * query_s:.2f} ms | same hits: {got == expected}")
@@ -0,0 +1,84 @@
+"""
+Query benchmark for BM25NeedsIndex.search.
+
+Compares posting-list top-k search against the old approach of scoring every
+need with BM25Okapi.get_scores and fully sorting the result, and looping over
+search() against one batched search_many() call. The interleaved run mimics
+observer_pipeline_batched: add a batch of needs, then retrieve for a batch of
+queries, so search_many's weight matrix is rebuilt once per round.
+
+    cd src && python -m benchmarks.bm25_search --n 50000 --queries 500
+"""
+import argparse
+import random
+import time
+from rank_bm25 import BM25Okapi
+from BM25 import BM25NeedsIndex
+from benchmarks.bm25_ingest import synthetic_needs
+
+
+def build(n: int):
+    index = BM25NeedsIndex({})
+    index.add_needs(synthetic_needs(n))
+    return index
+
+
+def sample_queries(index: BM25NeedsIndex, q: int, seed: int = 1):
+    rng = random.Random(seed)
+    return [index.needs[nid] for nid in rng.sample(list(index.needs), q)]
+
+
+def full_scan(index: BM25NeedsIndex, bm25: BM25Okapi, ids, query: str, top_k: int):
+    scores = bm25.get_scores(index._preprocess(query))
+    ranked = sorted(range(len(scores)), key=lambda i: (-scores[i], ids[i]))
+    return [ids[i] for i in ranked[:top_k] if scores[i] > 0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark BM25NeedsIndex search.")
+    parser.add_argument("--n", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--top_k", type=int, default=3)
+    parser.add_argument("--rounds", type=int, default=20, help="Interleaved add/search rounds.")
+    parser.add_argument("--batch", type=int, default=192, help="Needs added and queries per round.")
+    args = parser.parse_args()
+
+    index = build(args.n)
+    queries = sample_queries(index, args.queries)
+    ids = list(index.needs)
+    bm25 = BM25Okapi([index._preprocess(index.needs[nid]) for nid in ids])
+
+    t0 = time.perf_counter()
+    expected = [full_scan(index, bm25, ids, q, args.top_k) for q in queries]
+    t_scan = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    got = [[r["id"] for r in index.search(q, top_k=args.top_k)] for q in queries]
+    t_index = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    batched = [[r["id"] for r in res] for res in index.search_many(queries, top_k=args.top_k)]
+    t_many = time.perf_counter() - t0
+
+    print(f"n={args.n} | queries={args.queries} | top_k={args.top_k}")
+    print(f"full scan + sort : {1000 * t_scan / args.queries:.3f} ms/query")
+    print(f"posting top-k    : {1000 * t_index / args.queries:.3f} ms/query")
+    print(f"search_many      : {1000 * t_many / args.queries:.3f} ms/query (incl. matrix build)")
+    print(f"identical rankings: {expected == got} | batched: {expected == batched}")
+
+    # interleaved: one round = add `batch` needs, then retrieve for `batch` queries
+    extra = list(synthetic_needs(args.n + args.rounds * args.batch))[args.n:]
+    for mode in ("search", "search_many"):
+        live = build(args.n)
+        elapsed = 0.0
+        for r in range(args.rounds):
+            live.add_needs(extra[r * args.batch:(r + 1) * args.batch])
+            qs = sample_queries(live, args.batch, seed=r)
+            t0 = time.perf_counter()
+            if mode == "search":
+                [live.search(q, top_k=args.top_k) for q in qs]
+            else:
+                live.search_many(qs, top_k=args.top_k)
+            elapsed += time.perf_counter() - t0
+        n_q = args.rounds * args.batch
+        print(f"interleaved {mode:<11}: {1000 * elapsed / n_q:.3f} ms/query ({args.rounds} rounds of {args.batch})")
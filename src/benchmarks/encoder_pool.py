@@ -0,0 +1,56 @@
+"""
+Throughput benchmark for EncoderPool (multi-process SentenceTransformer encoding).
+
+Encodes the same synthetic action-log sentences with the single-process
+EmbeddingsStore path and with EncoderPool at several worker counts, checks
+that the pooled embeddings match the single-process ones row for row, and
+reports texts/second. Pool start-up (spawning workers, loading the model in
+each) is timed separately, since backfill jobs pay it once.
+
+    cd src && python -m benchmarks.encoder_pool --n 20000 --workers 1,2,4,8
+"""
+import argparse
+import os
+import time
+import numpy as np
+from EmbeddingStore import EmbeddingsStore
+from EncoderPool import EncoderPool
+
+APPS = ["Slack", "Chrome", "VS Code", "Calendar", "Mail", "Notion", "Terminal", "Zoom"]
+VERBS = ["opened", "scrolled through", "typed a reply in", "closed", "searched in", "switched to"]
+
+
+def synthetic_texts(n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    return [f"User {VERBS[rng.integers(len(VERBS))]} {APPS[rng.integers(len(APPS))]} "
+            f"while working on task {rng.integers(10_000)}." for _ in range(n)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark multi-process embedding encoding.")
+    parser.add_argument("--n", type=int, default=20_000)
+    parser.add_argument("--workers", type=str, default=",".join(str(w) for w in (1, 2, 4, os.cpu_count() or 1)))
+    parser.add_argument("--chunk_size", type=int, default=1024)
+    parser.add_argument("--model", type=str, default="all-MiniLM-L6-v2")
+    args = parser.parse_args()
+
+    texts = synthetic_texts(args.n)
+    store = EmbeddingsStore(st_model_name=args.model, device="cpu")
+    store.encode(texts[:64])  # load the model outside the timed region
+    t0 = time.perf_counter()
+    ref = store.encode(texts)
+    base = time.perf_counter() - t0
+    print(f"single process  | {args.n / base:8.0f} texts/s")
+
+    for workers in sorted({int(w) for w in args.workers.split(",")}):
+        t0 = time.perf_counter()
+        pool = EncoderPool(args.model, device="cpu", workers=workers, chunk_size=args.chunk_size)
+        pool.encode(texts[:workers * args.chunk_size])  # spawn workers and load the model in each
+        startup = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        vecs = pool.encode(texts)
+        secs = time.perf_counter() - t0
+        pool.close()
+        match = np.allclose(vecs, ref, atol=1e-5)
+        print(f"pool x{workers:<2} workers | {args.n / secs:8.0f} texts/s | {base / secs:4.1f}x | "
+              f"startup {startup:5.1f} s | matches single process: {match}")
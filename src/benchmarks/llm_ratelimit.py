@@ -0,0 +1,114 @@
+"""
+Goodput under 429 storms: LLMGateway's adaptive scheduler vs blind backoff.
+
+Starts a local mock of /v1/chat/completions that admits `--rps` requests per
+one-second window, answers after `--latency` seconds, and sends OpenAI-style
+x-ratelimit-* headers plus a 429 with retry-after-ms once the window is spent.
+The same batch of requests is then pushed through an LLMGateway with
+adaptive=True (AIMD concurrency, shared retry-after pause, header-driven
+clamping) and with adaptive=False (per-request exponential backoff, like the
+old tenacity decorators). Reports goodput (successful requests/s), 429s
+received and requests that ran out of attempts.
+
+    cd src && python -m benchmarks.llm_ratelimit --requests 400 --rps 40
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from LLMGateway import LLMGateway
+
+
+class MockLimits:
+    def __init__(self, rps: int, latency: float):
+        self.rps = rps
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.window = int(time.monotonic())
+        self.used = 0
+
+    def admit(self):
+        """(admitted, remaining in window, seconds until the window resets)"""
+        with self.lock:
+            now = time.monotonic()
+            if int(now) != self.window:
+                self.window, self.used = int(now), 0
+            reset = self.window + 1 - now
+            if self.used >= self.rps:
+                return False, 0, reset
+            self.used += 1
+            return True, self.rps - self.used, reset
+
+
+def make_handler(limits: MockLimits):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))) or b"{}")
+            admitted, remaining, reset = limits.admit()
+            headers = {
+                "x-ratelimit-limit-requests": str(limits.rps),
+                "x-ratelimit-remaining-requests": str(remaining),
+                "x-ratelimit-reset-requests": f"{int(reset * 1000)}ms",
+            }
+            if admitted:
+                time.sleep(limits.latency)
+                status, payload = 200, {
+                    "id": "mock", "object": "chat.completion", "created": 0, "model": body.get("model", "mock"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": "ok"}}],
+                    "usage": {"prompt_tokens": len(json.dumps(body.get("messages", []))) // 4,
+                              "completion_tokens": 1, "total_tokens": 0},
+                }
+            else:
+                headers["retry-after-ms"] = str(int(reset * 1000))
+                status, payload = 429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                                  "code": "rate_limit_exceeded"}}
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            for k, v in {**headers, "content-type": "application/json", "content-length": str(len(data))}.items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+async def drive(base_url: str, n: int, concurrency: int, adaptive: bool, backoff_base: float):
+    gateway = LLMGateway(concurrency=concurrency, model_limits={}, base_url=base_url, adaptive=adaptive,
+                         max_attempts=8, backoff_base=backoff_base)
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*[gateway.call(f"request {i}", "mock-model") for i in range(n)],
+                                   return_exceptions=True)
+    secs = time.perf_counter() - t0
+    await gateway.client.close()
+    ok = sum(1 for r in results if r == "ok")
+    return ok, secs, gateway.stats()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark adaptive vs blind LLM retry scheduling.")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--rps", type=int, default=40, help="Mock server admits this many requests per second.")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--backoff_base", type=float, default=0.5)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(MockLimits(args.rps, args.latency)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    ideal = args.requests / args.rps
+    print(f"{args.requests} requests against a {args.rps} req/s mock (ideal ~{ideal:.1f} s)")
+    for adaptive in (False, True):
+        ok, secs, st = asyncio.run(drive(base_url, args.requests, args.concurrency, adaptive, args.backoff_base))
+        name = "adaptive (AIMD)" if adaptive else "blind backoff"
+        print(f"{name:<16} | {ok:>5} ok in {secs:6.2f} s | goodput {ok / secs:6.1f} req/s | "
+              f"429s {st['throttled']:>5} | gave up {st['failed']:>4} | final concurrency {st['limit']}")
+    server.shutdown()
@@ -0,0 +1,49 @@
+"""
+Startup-time and RSS benchmark for the shared SentenceTransformer registry.
+
+Simulates several pipelines (Observer, Transcriber, EndToEnd, ...) living in
+one process, each with its own embedding store that encodes some text. The
+"private" mode reproduces the old behaviour of one SentenceTransformer per
+store; "shared" goes through ModelRegistry. Each mode runs in a fresh
+subprocess so peak RSS is measured independently.
+
+    cd src && python -m benchmarks.model_registry --pipelines 4
+"""
+import argparse
+import resource
+import subprocess
+import sys
+import time
+
+TEXTS = ["User opened the calendar and declined an optional meeting."] * 64
+
+
+def run(mode: str, pipelines: int, model: str):
+    t0 = time.perf_counter()
+    if mode == "private":
+        from sentence_transformers import SentenceTransformer
+        for _ in range(pipelines):
+            SentenceTransformer(model, device="cpu").encode(TEXTS, normalize_embeddings=True)
+    else:
+        from EmbeddingStore import EmbeddingsStore
+        for _ in range(pipelines):
+            EmbeddingsStore(st_model_name=model, device="cpu").encode(TEXTS)
+    elapsed = time.perf_counter() - t0
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{mode:<8} pipelines={pipelines} | {elapsed:7.2f} s | peak RSS {rss_mb:8.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark shared vs per-store embedding models.")
+    parser.add_argument("--pipelines", type=int, default=4)
+    parser.add_argument("--model", type=str, default="all-MiniLM-L6-v2")
+    parser.add_argument("--mode", type=str, choices=["shared", "private"], default=None,
+                        help="Run a single mode in this process (used internally).")
+    args = parser.parse_args()
+
+    if args.mode:
+        run(args.mode, args.pipelines, args.model)
+    else:
+        for mode in ("private", "shared"):
+            subprocess.run([sys.executable, "-m", "benchmarks.model_registry", "--mode", mode,
+                            "--pipelines", str(args.pipelines), "--model", args.model], check=True)
@@ -0,0 +1,73 @@
+"""
+Recall / memory benchmark for EmbeddingsStore's compact vector modes.
+
+Feeds the same stream of embeddings through batch_add_if_new in the exact
+float32 HNSW mode and in the int8 / float16 compact modes, at the 0.8
+threshold Observer/Transcriber use, and reports how often the keep decisions
+agree and the in-memory bytes per stored observation.
+
+By default the stream is synthetic (clustered unit vectors with near
+duplicates, dim 384 like all-MiniLM-L6-v2). Pass --texts to embed a JSON
+list of strings with the real model instead.
+
+    cd src && python -m benchmarks.quantized_recall --n 20000
+"""
+import argparse
+import json
+import time
+import numpy as np
+from EmbeddingStore import EmbeddingsStore
+
+
+def synthetic_stream(n: int, dim: int = 384, clusters: int = 2000, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    vecs = centers[rng.integers(0, clusters, n)] + rng.normal(scale=0.06, size=(n, dim)).astype(np.float32)
+    return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+
+class _FixedDimStore(EmbeddingsStore):
+    """Store for pre-computed vectors: never touches the sentence model."""
+    def __init__(self, dim, **kwargs):
+        super().__init__(**kwargs)
+        self._dim = dim
+
+
+def memory_bytes(store) -> int:
+    if store.vector_dtype == "float32":
+        return store.ann.index_file_size()
+    return store.ann.nbytes_in_memory()
+
+
+def run(vecs: np.ndarray, dtype: str, threshold: float, batch: int):
+    store = _FixedDimStore(vecs.shape[1], sim_threshold=threshold, vector_dtype=dtype, ann_max=len(vecs),
+                           backend="hnsw")
+    mask = []
+    t0 = time.perf_counter()
+    for lo in range(0, len(vecs), batch):
+        ids = [str(i) for i in range(lo, min(len(vecs), lo + batch))]
+        mask.extend(store.batch_add_if_new(ids, vecs[lo:lo + batch]))
+    return np.array(mask), time.perf_counter() - t0, memory_bytes(store) / max(1, len(store.id2ann))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark compact EmbeddingsStore modes.")
+    parser.add_argument("--n", type=int, default=20_000)
+    parser.add_argument("--batch", type=int, default=16)
+    parser.add_argument("--threshold", type=float, default=0.8)
+    parser.add_argument("--texts", type=str, default=None, help="JSON list of strings to embed instead of synthetic vectors.")
+    args = parser.parse_args()
+
+    if args.texts:
+        vecs = EmbeddingsStore().encode(json.load(open(args.texts)))
+    else:
+        vecs = synthetic_stream(args.n)
+
+    exact_mask, exact_s, exact_bytes = run(vecs, "float32", args.threshold, args.batch)
+    print(f"float32 (HNSW) | kept {int(exact_mask.sum()):>6} | {exact_s:6.2f} s | {exact_bytes:7.0f} B/obs")
+    for dtype in ("float16", "int8"):
+        mask, secs, nbytes = run(vecs, dtype, args.threshold, args.batch)
+        agree = float((mask == exact_mask).mean())
+        recall = float((mask & exact_mask).sum() / max(1, exact_mask.sum()))
+        print(f"{dtype:<14} | kept {int(mask.sum()):>6} | {secs:6.2f} s | {nbytes:7.0f} B/obs "
+              f"({exact_bytes / nbytes:.1f}x smaller) | agreement {agree:.4f} | recall of kept {recall:.4f}")
@@ -0,0 +1,44 @@
+"""
+Startup-time benchmark for the pipeline classes.
+
+Times construction of BM25NeedsIndex, Observer and Transcriber. The first
+construction pays one-time process costs (module imports, stopword load,
+model weights); later ones show the steady-state per-instance cost.
+
+    cd src && python -m benchmarks.startup --repeats 5
+"""
+import argparse
+import os
+import tempfile
+import time
+
+
+def timed(label: str, fn, repeats: int):
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    rest = times[1:] or times
+    print(f"{label:<18} first={1000 * times[0]:9.2f} ms | next avg={1000 * sum(rest) / len(rest):9.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Observer/Transcriber construction.")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--model", type=str, default="gpt-4o")
+    args = parser.parse_args()
+
+    # the clients only need a key to be constructed; no request is made
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+    t0 = time.perf_counter()
+    from BM25 import BM25NeedsIndex
+    from Observer import Observer
+    from Transcriber import Transcriber
+    print(f"{'imports':<18} {1000 * (time.perf_counter() - t0):9.2f} ms")
+
+    save_file = os.path.join(tempfile.gettempdir(), "startup_bench.json")
+    timed("BM25NeedsIndex", lambda: BM25NeedsIndex({}), args.repeats)
+    timed("Observer", lambda: Observer(args.model, {"name": "bench"}), args.repeats)
+    timed("Transcriber", lambda: Transcriber(args.model, "0", "bench", save_file=save_file), args.repeats)
@@ -0,0 +1,56 @@
+"""
+Micro-benchmark for the BM25 tokenizer on the prompt test corpora.
+
+Compares the old two-regex _preprocess against Tokenizer cold (memo cleared
+before every pass) and warm (memo populated, the common case for repeated
+evidence strings), and checks that both produce the same tokens.
+
+    cd src && python -m benchmarks.tokenizer --repeats 200
+"""
+import argparse
+import re
+import time
+from prompts.test_dataset import TESTSET, SMALL_TESTSET
+from Tokenizer import Tokenizer, load_stopwords
+
+
+def legacy_preprocess(text: str, stopwords):
+    text = text.lower()
+    text = re.sub(r"[^a-z0-9\s]", " ", text)
+    text = re.findall(r"\w+", text.lower())
+    return [t for t in text if t and t not in stopwords]
+
+
+def bench(label: str, fn, texts, repeats: int, before_pass=None):
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        if before_pass:
+            before_pass()
+        for t in texts:
+            fn(t)
+    elapsed = time.perf_counter() - t0
+    print(f"{label:<22} {1e6 * elapsed / (repeats * len(texts)):8.3f} us/text")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark BM25 tokenization.")
+    parser.add_argument("--repeats", type=int, default=200)
+    args = parser.parse_args()
+
+    texts = [d["text"] for d in TESTSET + SMALL_TESTSET]
+    stopwords = load_stopwords()
+    tok = Tokenizer()
+
+    assert all(list(tok(t)) == legacy_preprocess(t, stopwords) for t in texts), "tokenizer output changed"
+    print(f"{len(texts)} texts | {args.repeats} passes")
+    bench("legacy two-pass", lambda t: legacy_preprocess(t, stopwords), texts, args.repeats)
+    bench("tokenizer (cold)", tok._tokenize, texts, args.repeats)
+    bench("tokenizer (memo)", tok, texts, args.repeats)
+    try:
+        stem_tok = Tokenizer(stem=True)
+    except ImportError:
+        print("stemming skipped (nltk not installed)")
+    else:
+        bench("tokenizer+stem (cold)", stem_tok._tokenize, texts, args.repeats, before_pass=stem_tok._stem_word.cache_clear)
+        bench("tokenizer+stem (memo)", stem_tok, texts, args.repeats)
+    print(tok.cache_info())
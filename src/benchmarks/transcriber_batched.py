@@ -0,0 +1,123 @@
+"""
+Windows/second of Transcriber.observer_pipeline vs observer_pipeline_batched.
+
+Writes `--windows` windows of synthetic screen summaries to a temp directory
+(split into sessions by a gap every `--session_windows` windows) and runs both
+pipelines over it with a simulated LLM: every request waits for a real
+LLMGateway slot (so `--concurrency` applies as in production) and then sleeps
+for `--observe_latency` (OBSERVE_PROMPT) or `--classify_latency` (SIMILAR_PROMPT)
+seconds before returning a deterministic response. Embeddings, ANN and BM25
+are real. Reports windows/s, LLM calls and resulting observation counts.
+
+    cd src && python -m benchmarks.transcriber_batched --windows 200 --concurrency 16
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import re
+import tempfile
+import time
+from LLMGateway import LLMGateway
+from response_formats import Observation, ObservationResponse, Relation, RelationsResponse
+from Transcriber import Transcriber
+
+APPS = ["Slack", "Chrome", "VS Code", "Calendar", "Mail", "Notion", "Terminal", "Zoom", "Overleaf", "Figma"]
+TASKS = ["replying to a colleague", "debugging a test", "writing the related work", "planning a trip",
+         "reviewing a pull request", "editing a figure", "scheduling a meeting", "reading a paper"]
+
+
+class SimulatedLLM:
+    """Stands in for Transcriber.llm: gateway slots and latency are real, responses are canned."""
+    def __init__(self, gateway: LLMGateway, observe_latency: float, classify_latency: float, per_window: int):
+        self.caller = gateway.caller("Transcriber")
+        self.gateway = gateway
+        self.observe_latency = observe_latency
+        self.classify_latency = classify_latency
+        self.per_window = per_window
+        self.calls = 0
+
+    async def _wait(self, model, prompt, latency):
+        self.calls += 1
+        async with self.caller.slot(model, prompt):
+            await asyncio.sleep(latency)
+
+    def _observations(self, prompt):
+        rng = random.Random(prompt)
+        return [Observation(description=f"User is {rng.choice(TASKS)} in {rng.choice(APPS)}",
+                            evidence=f"Seen in {rng.choice(APPS)}", confidence=rng.randint(1, 10),
+                            interestingness=rng.randint(1, 10)) for _ in range(self.per_window)]
+
+    async def stream(self, prompt, model, resp_format, field, **kwargs):
+        await self._wait(model, prompt, self.observe_latency)
+        for obs in self._observations(prompt):
+            yield obs
+
+    async def __call__(self, prompt, model, resp_format=None, **kwargs):
+        if resp_format is ObservationResponse:
+            await self._wait(model, prompt, self.observe_latency)
+            return ObservationResponse(observations=self._observations(prompt))
+        await self._wait(model, prompt, self.classify_latency)
+        ids = [int(x) for x in re.findall(r"ID: (\d+)", prompt)]
+        score = random.Random(prompt).choice([3, 9])
+        return RelationsResponse(relations=Relation(source=ids[0], score=score, target=ids[1:2] if score >= 8 else []))
+
+
+class BenchTranscriber(Transcriber):
+    def __init__(self, input_dir, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.input_dir = input_dir
+
+    def _get_actions(self, fnames, include_transcript=False):
+        return "\n".join(Transcriber._load_markdown(os.path.join(self.input_dir, f)) for f in fnames)
+
+
+def write_windows(input_dir: str, windows: int, window_size: int, session_windows: int):
+    rng = random.Random(0)
+    t = time.time() - 10 * 24 * 3600
+    for i in range(windows * window_size):
+        path = os.path.join(input_dir, f"{i:06d}.md")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"The user switched to {rng.choice(APPS)} and kept {rng.choice(TASKS)}.")
+        t += 7200 if i and i % (session_windows * window_size) == 0 else 30
+        os.utime(path, (t, t))
+
+
+async def run(mode: str, input_dir: str, args):
+    gateway = LLMGateway(concurrency=args.concurrency, model_limits={})
+    work = tempfile.mkdtemp()
+    t = BenchTranscriber(input_dir, "gpt-4o", "bench", "User", save_file=os.path.join(work, "actions.json"))
+    t.llm = SimulatedLLM(gateway, args.observe_latency, args.classify_latency, args.per_window)
+    t.embed_store.encode(["warm up"])  # load the model outside the timed region
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if mode == "batched":
+            await t.observer_pipeline_batched(input_dir, batch_windows=args.batch_windows)
+        else:
+            await t.observer_pipeline(input_dir, lookahead=args.lookahead)
+    return time.perf_counter() - t0, t
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark batched vs pipelined transcriber ingestion.")
+    parser.add_argument("--windows", type=int, default=200)
+    parser.add_argument("--window_size", type=int, default=5)
+    parser.add_argument("--session_windows", type=int, default=50)
+    parser.add_argument("--per_window", type=int, default=5, help="Observations proposed per window.")
+    parser.add_argument("--observe_latency", type=float, default=1.0)
+    parser.add_argument("--classify_latency", type=float, default=0.3)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--lookahead", type=int, default=8)
+    parser.add_argument("--batch_windows", type=int, default=64)
+    args = parser.parse_args()
+
+    input_dir = tempfile.mkdtemp(prefix="transcripts_")
+    write_windows(input_dir, args.windows, args.window_size, args.session_windows)
+    print(f"{args.windows} windows, {args.per_window} proposals each, observe {args.observe_latency}s / "
+          f"classify {args.classify_latency}s per call, concurrency {args.concurrency}")
+    for mode in ("pipeline", "batched"):
+        secs, t = asyncio.run(run(mode, input_dir, args))
+        print(f"{mode:<9} | {len(t.processed_windows) / secs:7.2f} windows/s | {secs:7.2f} s | "
+              f"{t.llm.calls:>5} LLM calls | {len(t.all_actions):>5} observations")
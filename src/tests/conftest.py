@@ -0,0 +1,5 @@
+import os
+import sys
+
+# modules under src/ are imported by their flat names (`from BM25 import ...`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
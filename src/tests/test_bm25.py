@@ -0,0 +1,21 @@
+from BM25 import BM25NeedsIndex
+
+NEEDS = {
+    "1": "User drafts replies to colleagues in Slack",
+    "2": "User debugs failing Python tests in VS Code",
+    "3": "User edits the related work section in Overleaf",
+    "4": "User schedules meetings in Google Calendar",
+}
+
+
+def test_save_to_own_path_keeps_mapped_index(tmp_path):
+    path = str(tmp_path / "bm25")
+    BM25NeedsIndex(NEEDS).save(path)
+    loaded = BM25NeedsIndex.load(path)   # postings memory-mapped from `path`
+    expected = loaded.search("Python tests", top_k=2)
+    assert expected and expected[0]["id"] == "2"
+
+    loaded.save(path)
+    assert loaded.search("Python tests", top_k=2) == expected
+    assert BM25NeedsIndex.load(path).search("Python tests", top_k=2) == expected
+    assert BM25NeedsIndex.load(path, mmap=False).search("meetings calendar", top_k=1)[0]["id"] == "4"
@@ -0,0 +1,66 @@
+import os
+import numpy as np
+from EmbeddingCache import EmbeddingCache
+
+DIM = 8
+
+
+def vec(seed):
+    v = np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+
+def append_orphan_row(cache):
+    # what an interrupted put_many leaves behind: a vector without its key line
+    with open(os.path.join(cache.path, "vectors.f32"), "ab") as f:
+        f.write(vec(99).tobytes())
+
+
+def test_orphan_row_in_same_process(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "m", dim=DIM, lru_size=0)
+    cache.put_many(["a", "b", "c"], np.stack([vec(0), vec(1), vec(2)]))
+    append_orphan_row(cache)
+    cache.put_many(["d"], vec(3)[None])
+    got, missing = cache.get_many(["a", "d"])
+    assert missing == []
+    np.testing.assert_array_equal(got[1], vec(3))
+    np.testing.assert_array_equal(got[0], vec(0))
+
+
+def test_orphan_row_and_duplicate_keys_on_reload(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "m", dim=DIM)
+    cache.put_many(["a", "b"], np.stack([vec(0), vec(1)]))
+    # a second writer that appended "b" again: row and line stay paired
+    other = EmbeddingCache(str(tmp_path), "m", lru_size=0)
+    other._rows.clear()
+    other.put_many(["b"], vec(1)[None])
+    append_orphan_row(cache)
+
+    reloaded = EmbeddingCache(str(tmp_path), "m", lru_size=0)
+    assert os.path.getsize(os.path.join(reloaded.path, "vectors.f32")) == 3 * 4 * DIM
+    reloaded.put_many(["d"], vec(3)[None])
+    again = EmbeddingCache(str(tmp_path), "m", lru_size=0)
+    got, missing = again.get_many(["a", "b", "d"])
+    assert missing == []
+    for g, seed in zip(got, (0, 1, 3)):
+        np.testing.assert_array_equal(g, vec(seed))
+
+
+def test_two_instances_share_one_directory(tmp_path):
+    a = EmbeddingCache(str(tmp_path), "m", dim=DIM, lru_size=0)
+    b = EmbeddingCache(str(tmp_path), "m", dim=DIM, lru_size=0)
+    a.put_many(["a"], vec(0)[None])
+    b.put_many(["b"], vec(1)[None])
+    a.put_many(["c"], vec(2)[None])
+    # each sees the other's writes without reloading
+    got, missing = b.get_many(["a", "c"])
+    assert missing == []
+    np.testing.assert_array_equal(got[1], vec(2))
+
+    reloaded = EmbeddingCache(str(tmp_path), "m", lru_size=0)
+    got, missing = reloaded.get_many(["a", "b", "c"])
+    assert missing == []
+    for g, seed in zip(got, (0, 1, 2)):
+        np.testing.assert_array_equal(g, vec(seed))
+    with open(os.path.join(reloaded.path, "keys.txt")) as f:
+        assert len(f.read().splitlines()) == 3
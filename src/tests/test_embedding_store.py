@@ -0,0 +1,81 @@
+import glob
+import os
+import shutil
+import numpy as np
+import orjson
+from EmbeddingStore import EmbeddingsStore
+from VectorIndex import QuantizedFlatIndex
+
+DIM = 8
+
+
+def vecs(n, seed=0):
+    v = np.random.default_rng(seed).standard_normal((n, DIM)).astype(np.float32)
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+def store(**kwargs):
+    s = EmbeddingsStore(device="cpu", **kwargs)
+    s._dim = DIM
+    return s
+
+
+def test_index_file_is_named_after_the_backend(tmp_path):
+    for kind, kwargs, index_file in [("exact", {"backend": "exact"}, "index.npz"),
+                                     ("int8", {"vector_dtype": "int8"}, "index.npz"),
+                                     ("hnsw", {"backend": "hnsw"}, "hnsw.bin")]:
+        path = str(tmp_path / kind)
+        s = store(**kwargs)
+        s.batch_add_if_new([str(i) for i in range(5)], vecs(5))
+        s.save(path)
+        assert sorted(os.listdir(path)) == sorted([index_file, "meta.json"])
+        loaded = store(**kwargs)
+        loaded.load(path)
+        assert loaded.index_kind == kind and loaded.id2ann == s.id2ann
+
+
+def test_loads_flat_index_saved_as_hnsw_bin(tmp_path):
+    # stores saved before index_file was recorded wrote flat indexes to hnsw.bin
+    s = store(backend="exact")
+    s.batch_add_if_new([str(i) for i in range(5)], vecs(5))
+    s.save(str(tmp_path))
+    os.rename(tmp_path / "index.npz", tmp_path / "hnsw.bin")
+    meta = orjson.loads((tmp_path / "meta.json").read_bytes())
+    del meta["index_file"]
+    (tmp_path / "meta.json").write_bytes(orjson.dumps(meta))
+
+    loaded = store(backend="exact")
+    loaded.load(str(tmp_path))
+    assert loaded.index_kind == "exact" and loaded.id2ann == s.id2ann
+    assert not any(loaded.batch_add_if_new(["dup"], vecs(1)))   # the loaded vectors gate duplicates
+
+
+def test_quantized_arena_grows_with_the_rows_in_use(tmp_path):
+    index = QuantizedFlatIndex(DIM, arena_dir=str(tmp_path))
+    index.init_index(max_elements=200_000)
+    (arena,) = glob.glob(str(tmp_path / "vectors_*.f32"))
+    assert os.path.getsize(arena) == 0
+    data = vecs(1500)
+    index.add_items(data[:10], ids=np.arange(10))
+    assert os.path.getsize(arena) == 1024 * DIM * 4
+    index.add_items(data[10:], ids=np.arange(10, 1500))
+    assert os.path.getsize(arena) == 2048 * DIM * 4
+    labels, _ = index.knn_query(data[[3, 1200]], k=1)
+    assert labels[:, 0].tolist() == [3, 1200]
+
+
+def test_quantized_arena_defaults_to_the_cache_or_store_dir(tmp_path):
+    s = store(vector_dtype="int8", cache_dir=str(tmp_path / "cache"))
+    s.batch_add_if_new([str(i) for i in range(5)], vecs(5))
+    assert glob.glob(str(tmp_path / "cache" / "vectors_*.f32"))
+
+    s.save(str(tmp_path / "saved"))
+    loaded = store(vector_dtype="int8")
+    loaded.load(str(tmp_path / "saved"))
+    assert glob.glob(str(tmp_path / "saved" / "vectors_*.f32"))
+    # the arena stays usable after its directory is replaced
+    shutil.rmtree(tmp_path / "saved")
+    more = vecs(2000, seed=1)
+    loaded.ann.add_items(more, ids=np.arange(100, 2100))
+    labels, _ = loaded.ann.knn_query(more[[1500]], k=1)
+    assert labels[0, 0] == 1600
@@ -0,0 +1,57 @@
+import asyncio
+import os
+from LLMGateway import LLMGateway
+from ResponseCache import ResponseCache, set_response_cache
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+
+def test_cache_hit_takes_no_slot(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    cache.put(ResponseCache.key("gpt-4o", "hello"), "gpt-4o", "cached answer")
+    gateway = LLMGateway(concurrency=1, model_limits={})
+
+    async def main():
+        # the only slot is taken: a request that needs one would wait forever
+        await gateway.slots.acquire(0)
+        return await asyncio.wait_for(gateway.call("hello", "gpt-4o", cache=cache), timeout=1.0)
+
+    assert asyncio.run(main()) == "cached answer"
+    assert gateway.stats()["callers"] == {}
+
+
+def test_client_follows_the_running_loop():
+    gateway = LLMGateway(concurrency=2, model_limits={})
+
+    async def client():
+        return gateway.client
+
+    first = asyncio.run(client())
+    assert asyncio.run(client()) is not first
+    # built outside a loop, then taken over by the first loop that uses it
+    gateway = LLMGateway(concurrency=2, model_limits={})
+    outside = gateway.client
+    assert asyncio.run(client()) is outside
+
+
+def test_stream_cache_hit_takes_no_slot(tmp_path):
+    from response_formats import Observation, ObservationResponse
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    cached = ObservationResponse(observations=[Observation(description="d", evidence="e", confidence=1, interestingness=2)])
+    cache.put(ResponseCache.key("gpt-4o", "hello", ObservationResponse), "gpt-4o", cached)
+    set_response_cache(cache)
+    gateway = LLMGateway(concurrency=1, model_limits={})
+
+    async def main():
+        await gateway.slots.acquire(0)
+        stream = gateway.stream_items("hello", "gpt-4o", ObservationResponse, "observations")
+        return await asyncio.wait_for(_collect(stream), timeout=1.0)
+
+    try:
+        assert asyncio.run(main()) == cached.observations
+    finally:
+        set_response_cache(None)
+
+
+async def _collect(stream):
+    return [item async for item in stream]
@@ -0,0 +1,31 @@
+from ResponseCache import CACHE_MISS, ResponseCache
+
+
+def _last_used(cache, key):
+    return cache._db.execute("SELECT last_used FROM responses WHERE key = ?", (key,)).fetchone()[0]
+
+
+def test_hits_are_written_in_batches(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), touch_every=3)
+    keys = [ResponseCache.key("m", f"prompt {i}") for i in range(3)]
+    for key in keys:
+        cache.put(key, "m", "answer")
+    stored = _last_used(cache, keys[0])
+    assert cache.get(keys[0]) == "answer"
+    assert cache.get(keys[1]) == "answer"
+    assert _last_used(cache, keys[0]) == stored   # buffered, no write on the hit path
+    assert cache.get(keys[2]) == "answer"
+    assert _last_used(cache, keys[0]) > stored    # touch_every reached
+
+
+def test_lru_eviction_sees_buffered_hits(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    old, new = ResponseCache.key("m", "old"), ResponseCache.key("m", "new")
+    cache.put(old, "m", "a")
+    cache.put(new, "m", "b")
+    assert cache.get(old) == "a"    # old is now the most recently used
+    cache.put(ResponseCache.key("m", "newest"), "m", "c")
+    cache.evict()
+    assert cache.get(old) == "a"
+    assert cache.get(new) is CACHE_MISS
+    cache.close()
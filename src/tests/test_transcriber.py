@@ -0,0 +1,363 @@
+import asyncio
+import copy
+import os
+import random
+import re
+import threading
+import time
+import hashlib
+import json
+import numpy as np
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+import ModelRegistry
+from BatchRunner import LocalBatchBackend
+from BM25 import BM25NeedsIndex
+from EmbeddingStore import EmbeddingsStore
+from LLMGateway import get_gateway
+from ResponseCache import ResponseCache, set_response_cache
+from response_formats import Observation, ObservationResponse, Relation, RelationsResponse
+from Telemetry import get_telemetry
+from Transcriber import Transcriber
+
+DIM = 8
+
+
+def _unit(seed):
+    v = np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+
+def _bare_transcriber(processed=()):
+    # only what _plan_windows touches; no models or LLM client
+    t = Transcriber.__new__(Transcriber)
+    t._manifests = {}
+    t._manifest_lock = threading.Lock()
+    t.state_dir = None
+    t.processed_windows = set(processed)
+    return t
+
+
+def _write_files(directory, n):
+    t0 = time.time() - 10000
+    for i in range(n):
+        path = os.path.join(directory, f"{i:03d}.md")
+        with open(path, "w") as f:
+            f.write("x")
+        os.utime(path, (t0 + i, t0 + i))
+
+
+def test_plan_stops_at_end_file_even_when_resuming(tmp_path):
+    _write_files(tmp_path, 20)
+    plan = _bare_transcriber()._plan_windows(str(tmp_path), end_file=10)
+    assert [tid for _, tid, _ in plan] == ["000", "005"]
+    # the window that reaches end_file was already committed: nothing after it is planned
+    resumed = _bare_transcriber(processed={"005"})._plan_windows(str(tmp_path), end_file=10)
+    assert [tid for _, tid, _ in resumed] == ["000"]
+
+
+class _RandomJudge:
+    """SIMILAR_PROMPT stand-in: a fixed verdict per prompt, merging into the first candidate or not."""
+    def __init__(self):
+        self.prompts = []
+
+    async def __call__(self, prompt, model, resp_format=None, **kwargs):
+        self.prompts.append(prompt)
+        ids = [int(x) for x in re.findall(r"ID: (\d+)", prompt)]
+        score = 9 if len(ids) > 1 and random.Random(prompt).random() < 0.4 else 3
+        return RelationsResponse(relations=Relation(source=ids[0], score=score, target=ids[1:2] if score >= 8 else []))
+
+
+class _Vectors:
+    def remove(self, nid):
+        pass
+
+
+def _classifying_transcriber(seed_needs):
+    t = _bare_transcriber()
+    t.model = "test"
+    t.llm = _RandomJudge()
+    t.embed_store = _Vectors()
+    t.all_actions = {nid: {"id": nid, "description": d, "evidence": []} for nid, d in seed_needs}
+    t.actions_index = BM25NeedsIndex(dict(seed_needs))
+    return t
+
+
+def test_concurrent_classification_matches_one_at_a_time():
+    words = "slack email meeting paper figure python latex calendar travel budget".split()
+    for seed in range(20):
+        rng = random.Random(seed)
+        seed_needs = [(str(i), " ".join(rng.sample(words, 3))) for i in range(4)]
+        survivors = []
+        for i in range(4, 12):
+            d = " ".join(rng.sample(words, 3))
+            survivors.append(({"id": str(i), "description": d, "evidence": [f"ev {i}"]}, d))
+
+        serial = _classifying_transcriber(seed_needs)
+        for c, do in copy.deepcopy(survivors):
+            serial._apply_relation(c, do, asyncio.run(serial._classify(c, do)))
+
+        concurrent = _classifying_transcriber(seed_needs)
+        asyncio.run(concurrent._classify_survivors(copy.deepcopy(survivors)))
+
+        assert concurrent.all_actions == serial.all_actions
+        assert list(concurrent.actions_index.needs) == list(serial.actions_index.needs)
+        # every prompt the serial run needed was asked
+        assert set(serial.llm.prompts) <= set(concurrent.llm.prompts)
+
+
+def _stateful_transcriber():
+    t = _bare_transcriber()
+    t.all_actions, t.count = {}, 0
+    t.actions_index = BM25NeedsIndex({})
+    t.embed_store = EmbeddingsStore(device="cpu", backend="exact")
+    t.embed_store._dim = DIM
+    return t
+
+
+def _add(t, nid, text, seed):
+    t.all_actions[nid] = {"id": nid, "description": text, "evidence": []}
+    t.actions_index.add_need(nid, text)
+    t.embed_store.batch_add_if_new([nid], _unit(seed)[None])
+    t.count += 1
+
+
+def test_state_round_trip(tmp_path):
+    t = _stateful_transcriber()
+    _add(t, "0", "user edits the figure", 0)
+    _add(t, "1", "user answers email", 1)
+    _add(t, "2", "user books a train", 2)
+    t.processed_windows = {"000"}
+    t.save_state(str(tmp_path))
+
+    resumed = _stateful_transcriber()
+    resumed.load_state(str(tmp_path))
+    assert resumed.all_actions == t.all_actions
+    assert resumed.count == 3 and resumed.processed_windows == {"000"}
+    assert [r["id"] for r in resumed.actions_index.search("email", top_k=1)] == ["1"]
+    assert resumed.embed_store.id2ann == t.embed_store.id2ann
+
+
+def test_interrupted_save_keeps_previous_state(tmp_path):
+    t = _stateful_transcriber()
+    _add(t, "0", "user edits the figure", 0)
+    t.processed_windows = {"000"}
+    t.save_state(str(tmp_path))
+    t.save_state(str(tmp_path))   # a second save replaces the first completely
+
+    _add(t, "1", "user answers email", 1)
+    t.processed_windows.add("005")
+
+    def crash(path):
+        raise OSError("disk full")
+    t.embed_store.save = crash
+    with pytest.raises(OSError):
+        t.save_state(str(tmp_path))
+
+    resumed = _stateful_transcriber()
+    resumed.load_state(str(tmp_path))
+    assert resumed.count == 1 and resumed.processed_windows == {"000"}
+    assert list(resumed.actions_index.needs) == ["0"]
+    assert list(resumed.embed_store.id2ann) == ["0"]
+
+
+def test_batched_prompts_match_one_by_one():
+    t = _classifying_transcriber([(str(i), d) for i, d in enumerate(
+        ["user edits the figure", "user answers email", "user books a train", "user reads a paper"])])
+    survivors = [({"id": str(i), "description": d}, d) for i, d in
+                 enumerate(["edits email", "reads the figure paper", "plans a trip"], start=4)]
+    assert t._classifier_prompts(survivors) == [t._classifier_prompt(c, do) for c, do in survivors]
+
+
+# ---------- pipelines end to end: real BM25 and vector index, canned LLM and encoder ----------
+WORDS = ("slack email meeting paper figure python latex calendar travel budget train hotel review "
+         "draft slides notebook plot dataset grant lecture").split()
+
+
+class _HashEncoder:
+    """Bag-of-words vectors; stands in for the SentenceTransformer."""
+    def get_sentence_embedding_dimension(self):
+        return 32
+
+    def encode(self, texts, **kwargs):
+        out = np.zeros((len(texts), 32), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for w in text.lower().split():
+                out[i, int(hashlib.md5(w.encode()).hexdigest(), 16) % 32] += 1
+        return out / np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-9)
+
+
+class _FakeObserver(_RandomJudge):
+    """OBSERVE_PROMPT and SIMILAR_PROMPT stand-in; SIMILAR_PROMPT fails for the ids in `fail_ids`."""
+    def __init__(self, fail_ids=()):
+        super().__init__()
+        self.gateway = get_gateway()
+        self.name = "Transcriber"
+        self.fail_ids = set(fail_ids)
+
+    @staticmethod
+    def observations(prompt):
+        rng = random.Random(prompt)
+        return ObservationResponse(observations=[
+            Observation(description=" ".join(rng.sample(WORDS, 3)), evidence=f"ev {rng.randint(0, 99)}",
+                        confidence=5, interestingness=5) for _ in range(3)])
+
+    async def stream(self, prompt, model, resp_format, field, **kwargs):
+        for obs in self.observations(prompt).observations:
+            yield obs
+
+    async def __call__(self, prompt, model, resp_format=None, **kwargs):
+        if resp_format is ObservationResponse:
+            return self.observations(prompt)
+        if re.search(r"ID: (\d+)", prompt).group(1) in self.fail_ids:
+            raise RuntimeError("judge unavailable")
+        return await super().__call__(prompt, model, resp_format, **kwargs)
+
+
+@pytest.fixture
+def pipeline_env(tmp_path, monkeypatch):
+    for var in ("EMB_CACHE_DIR", "LLM_BATCH_BACKEND", "LLM_CACHE_PATH"):
+        monkeypatch.delenv(var, raising=False)
+    monkeypatch.setitem(ModelRegistry._MODELS, ("all-MiniLM-L6-v2", "cpu"), _HashEncoder())
+    input_dir = tmp_path / "summaries"
+    input_dir.mkdir()
+    rng = random.Random(0)
+    t0 = time.time() - 100000
+    for i in range(20):
+        path = input_dir / f"{i:03d}.md"
+        path.write_text(f"The user worked on {' and '.join(rng.sample(WORDS, 2))}.")
+        os.utime(path, (t0 + 10 * i, t0 + 10 * i))
+    yield tmp_path, str(input_dir)
+    set_response_cache(None)
+
+
+def _pipeline_transcriber(tmp_path, input_dir, name="out.json", **kwargs):
+    t = Transcriber("gpt-4o", "0", "U", save_file=str(tmp_path / name), **kwargs)
+    t.summaries_dir = input_dir
+    t.llm = _FakeObserver()
+    return t
+
+
+def test_batched_pipeline_commits_every_window(pipeline_env):
+    tmp_path, input_dir = pipeline_env
+    t = _pipeline_transcriber(tmp_path, input_dir)
+    out = asyncio.run(t.observer_pipeline_batched(input_dir, batch_windows=2))
+    assert t.processed_windows == {"000", "005", "010", "015"}
+    assert out and t.count == 12
+    with open(tmp_path / "out.json") as f:
+        assert json.load(f) == out
+    # every kept observation is indexed under its own id
+    assert set(out) == set(t.actions_index.needs)
+
+
+def test_batched_pipeline_drops_a_failed_windows_survivors(pipeline_env):
+    tmp_path, input_dir = pipeline_env
+    t = _pipeline_transcriber(tmp_path, input_dir)
+    t.llm.fail_ids = {"3", "4", "5"}   # the second window's proposals
+    asyncio.run(t.observer_pipeline_batched(input_dir, batch_windows=4))
+    assert t.processed_windows == {"000", "010", "015"}
+    assert not {"3", "4", "5"} & set(t.embed_store.id2ann)
+    assert not {"3", "4", "5"} & set(t.all_actions)
+
+
+def test_batched_pipeline_batch_backend_uses_cache_and_telemetry(pipeline_env):
+    tmp_path, input_dir = pipeline_env
+    submitted = []
+
+    def respond(body):
+        submitted.append(body)
+        return _FakeObserver.observations(body["messages"][0]["content"]).model_dump_json()
+
+    set_response_cache(ResponseCache(str(tmp_path / "cache.sqlite")))
+    series = get_telemetry()._series
+    hits_before = series.get(("observe", "gpt-4o"), {}).get("cache_hits", 0)
+    results = []
+    for run in range(2):
+        t = _pipeline_transcriber(tmp_path, input_dir, name=f"out{run}.json")
+        t.batch_backend = LocalBatchBackend(str(tmp_path / "batches"), responder=respond)
+        results.append(asyncio.run(t.observer_pipeline_batched(input_dir, batch_windows=4)))
+    assert len(submitted) == 4   # the second run is answered from the cache
+    assert results[0] == results[1]
+    assert series[("observe", "gpt-4o")]["cache_hits"] - hits_before == 4
+
+
+# ---------- watch mode: polling watcher, files arriving while it runs ----------
+def _write_later(directory, names, text="The user worked on slides."):
+    for name in names:
+        path = os.path.join(directory, name)
+        with open(path, "w") as f:
+            f.write(text)
+        old = time.time() - 60   # already settled
+        os.utime(path, (old, old))
+
+
+async def _watch_while(t, input_dir, writes, **kwargs):
+    async def writer():
+        for delay, directory, names in writes:
+            await asyncio.sleep(delay)
+            _write_later(directory, names)
+    w = asyncio.ensure_future(writer())
+    out = await t.watch(input_dir, poll_interval=0.05, idle_exit=0.5, use_inotify=False, **kwargs)
+    await w
+    return out
+
+
+def test_watch_commits_backlog_and_new_files_under_the_manifest_lock(pipeline_env, monkeypatch):
+    from FileManifest import FileManifest
+    tmp_path, input_dir = pipeline_env
+    t = _pipeline_transcriber(tmp_path, input_dir)
+    unlocked = []
+    for method in ("refresh", "update"):
+        original = getattr(FileManifest, method)
+
+        def guarded(self, *args, _original=original, _method=method):
+            if not t._manifest_lock.locked():
+                unlocked.append(_method)
+            return _original(self, *args)
+        monkeypatch.setattr(FileManifest, method, guarded)
+
+    out = asyncio.run(_watch_while(t, input_dir, [(0.2, input_dir, [f"{i:03d}.md" for i in range(20, 30)])]))
+    assert t.processed_windows == {"000", "005", "010", "015", "020", "025"}
+    assert out and set(out) == set(t.actions_index.needs)
+    assert not unlocked
+
+
+def test_watch_holds_a_file_until_its_transcript_arrives(pipeline_env):
+    tmp_path, input_dir = pipeline_env
+    transcripts = tmp_path / "transcripts"
+    transcripts.mkdir()
+    _write_later(str(transcripts), [f"{i:03d}.md" for i in range(15)])
+    t = _pipeline_transcriber(tmp_path, input_dir)
+    t.transcripts_dir = str(transcripts)
+    committed_at = {}
+    commit_window = t._commit_window
+
+    async def timed_commit(tid, cand_items, vecs):
+        await commit_window(tid, cand_items, vecs)
+        committed_at[tid] = time.monotonic()
+    t._commit_window = timed_commit
+
+    t0 = time.monotonic()
+    asyncio.run(_watch_while(t, input_dir, [(0.3, str(transcripts), [f"{i:03d}.md" for i in range(15, 20)])],
+                             include_transcript=True))
+    assert t.processed_windows == {"000", "005", "010", "015"}
+    assert committed_at["015"] - t0 >= 0.3
+
+
+def test_watch_retries_a_failed_commit(pipeline_env):
+    tmp_path, input_dir = pipeline_env
+    t = _pipeline_transcriber(tmp_path, input_dir)
+    attempts = []
+    commit_window = t._commit_window
+
+    async def flaky_commit(tid, cand_items, vecs):
+        attempts.append(tid)
+        if tid == "005" and attempts.count(tid) == 1:
+            raise RuntimeError("store unavailable")
+        await commit_window(tid, cand_items, vecs)
+    t._commit_window = flaky_commit
+
+    asyncio.run(_watch_while(t, input_dir, []))
+    assert t.processed_windows == {"000", "005", "010", "015"}
+    assert attempts.count("005") == 2
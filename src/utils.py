@@ -1,10 +1,10 @@
-from tenacity import retry, wait_exponential, stop_after_attempt, retry_if_exception_type
-from openai import APIError, RateLimitError
-import asyncio, base64, mimetypes
+from openai import APIConnectionError, InternalServerError, RateLimitError
+from ResponseCache import CACHE_MISS, ResponseCache, get_response_cache
+from JSONStream import ArrayItemStream
+from Telemetry import note_cache_hit, note_usage
 import re
 import numpy as np
-from typing import List
-from pathlib import Path
+from typing import List, get_args
 
 async def call_gpt_logprobs(client, prompt, model):
     resp = await client.chat.completions.create(
@@ -16,70 +16,96 @@ async def call_gpt_logprobs(client, prompt, model):
     )
     return resp
 
-@retry(
-    wait=wait_exponential(multiplier=1, min=2, max=5),
-    stop=stop_after_attempt(1),
-    retry=retry_if_exception_type((APIError, RateLimitError))
-)
-async def call_gpt(client, prompt, model, base_url="https://api.openai.com/v1", resp_format=None):
+# Transient failures (429s, dropped connections/timeouts, 5xx). These propagate so
+# LLMGateway can re-queue the request; any other error is printed and yields None.
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+
+def lookup_response(prompt, model, resp_format=None, temperature=None, cache=None):
+    """call_gpt's cache lookup on its own: the cached output, or CACHE_MISS (also without a cache)."""
+    cache = cache if cache is not None else get_response_cache()
+    if cache is None:
+        return CACHE_MISS
+    return cache.get(ResponseCache.key(model, prompt, resp_format, temperature), resp_format)  # raises ResponseCacheMiss in replay mode
+
+async def call_gpt(client, prompt, model, base_url="https://api.openai.com/v1", resp_format=None,
+                   temperature=None, cache=None, cache_checked=False):
+    # cache: a ResponseCache; defaults to the shared one configured via LLM_CACHE_PATH (if any)
+    # cache_checked: the caller already looked the prompt up (LLMGateway.call does, before taking a slot)
+    # base_url: kept for old call sites; the endpoint is a property of `client`
+    cache = cache if cache is not None else get_response_cache()
+    key = None
+    if cache is not None:
+        key = ResponseCache.key(model, prompt, resp_format, temperature)
+        cached = CACHE_MISS if cache_checked else cache.get(key, resp_format)  # raises ResponseCacheMiss in replay mode
+        if cached is not CACHE_MISS:
+            note_cache_hit()
+            return cached
+    sampling = {} if temperature is None else {"temperature": temperature}
     try:
         if resp_format == None: 
             resp = await client.chat.completions.create(
                 model=model,
-                base_url=base_url,
                 messages=[{"role": "user", "content": prompt}],
                 response_format={"type": "text"},
+                **sampling,
             )
-            return resp.choices[0].message.content
+            note_usage(resp.usage)
+            out = resp.choices[0].message.content
         else: 
             resp = await client.responses.parse(
                 model=model,
                 input=[{"role": "user", "content": prompt}],
                 text_format=resp_format,
+                **sampling,
             )
-        
-            return resp.output_parsed
+            note_usage(resp.usage)
+            out = resp.output_parsed
+    except RETRYABLE_ERRORS:
+        raise
     except Exception as e:
         print(e)
+        return None
+    if cache is not None and out is not None:
+        cache.put(key, model, out)
+    return out
 
-def encode_image_as_data_url(img_path: str) -> str:
-    mime, _ = mimetypes.guess_type(img_path)
-    if mime is None:
-        mime = "image/jpeg" 
-    b64 = Path(img_path).read_bytes()
-    return f"data:{mime};base64,{base64.b64encode(b64).decode()}"
-
-@retry(
-    wait=wait_exponential(multiplier=1, min=4, max=10),
-    stop=stop_after_attempt(5),
-    retry=retry_if_exception_type((APIError, RateLimitError))
-)
-async def call_gpt_vision(client, prompt, model, images, resp_format):
-    # Encode images concurrently
-    try:
-        data_urls = await asyncio.gather(
-            *[asyncio.to_thread(encode_image_as_data_url, p) for p in images]
-        )
-
-        content = []
-        for url in data_urls:
-            content.append({
-                "type": "input_image",
-                "image_url": url, 
-            })
-        content.append({
-            "type": "input_text",
-            "text": prompt
-        })
-
-        resp = await client.responses.parse(
-            model=model,
-            input=[{"role": "user", "content": content}],
-            text_format=resp_format 
-        )
-        return resp.output_parsed
-    except Exception as e:
-        print(e)
+async def stream_gpt_items(client, prompt, model, resp_format, field, cache=None, record=None, cache_checked=False):
+    """
+    Streaming counterpart of call_gpt(..., resp_format=...) for responses whose `field` is a
+    list of objects (e.g. ObservationResponse.observations): yields each element, validated
+    as the list's item model, as soon as its JSON object closes in the output stream.
+    Shares call_gpt's response cache: a hit replays the cached elements, and a completed
+    stream is stored as the full resp_format. Usage goes to the Telemetry `record`, if given.
+    cache_checked: the caller already looked the prompt up (LLMGateway.stream_items does).
+    """
+    item_type = get_args(resp_format.model_fields[field].annotation)[0]
+    cache = cache if cache is not None else get_response_cache()
+    key = None
+    if cache is not None:
+        key = ResponseCache.key(model, prompt, resp_format, None)
+        cached = CACHE_MISS if cache_checked else cache.get(key, resp_format)  # raises ResponseCacheMiss in replay mode
+        if cached is not CACHE_MISS:
+            note_cache_hit(record)
+            for item in getattr(cached, field):
+                yield item
+            return
+    parser = ArrayItemStream(field)
+    items = []
+    async with client.responses.stream(
+        model=model,
+        input=[{"role": "user", "content": prompt}],
+        text_format=resp_format,
+    ) as stream:
+        async for event in stream:
+            if event.type != "response.output_text.delta":
+                continue
+            for raw in parser.feed(event.delta):
+                item = item_type.model_validate_json(raw)
+                items.append(item)
+                yield item
+        note_usage((await stream.get_final_response()).usage, record)
+    if cache is not None:
+        cache.put(key, model, resp_format(**{field: items}))
 
 def human_sort(s: str) -> List:
     return [int(t) if t.isdigit() else t.lower() for t in re.split(r'(\d+)', s)]